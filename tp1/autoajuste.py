@@ -0,0 +1,326 @@
+# autoajuste.py
+#
+# Elige cómo filtrar una imagen: en un solo proceso o repartiendo teselas
+# entre trabajadores, cuántos y de qué tamaño. Decide con un modelo de costo
+# cuyas constantes salen de un micro-benchmark corto en la máquina; la
+# calibración y los planes elegidos se leen de un JSON, así las corridas
+# siguientes no vuelven a medir. Solo los programas (no las llamadas de
+# biblioteca) lo escriben, al salir.
+
+import os
+import sys
+import json
+import atexit
+import math
+import time
+import argparse
+import platform
+from collections import namedtuple
+import numpy as np
+from PIL import Image
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tp1.backends import obtener_backend
+from tp1.blur_teselado import ArrayCompartido, PlanificadorTeselas, calcular_halo, filtrar_imagen_teselada
+from tp1.cancelacion import verificar
+
+# Archivo con la calibración y los planes; se puede cambiar con esta variable de entorno
+VARIABLE_ENTORNO = 'TP_AUTOAJUSTE'
+RUTA_POR_DEFECTO = os.path.join(os.path.expanduser('~'), '.cache', 'tp1_autoajuste.json')
+# Cambiarla invalida los archivos guardados con un modelo anterior
+VERSION_MODELO = 1
+TAMANOS_TESELA = (64, 128, 256, 512)
+# Lados de las imágenes de calibración: una entra en la cache y la otra no
+LADO_CHICO = 384
+LADO_GRANDE = 2048
+# El paralelo tiene que ganarle al secuencial por este factor: ante la duda, un solo proceso
+MARGEN_PARALELO = 0.8
+MAX_PLANES = 256
+
+SECUENCIAL = 'secuencial'
+PARALELO = 'paralelo'
+
+Plan = namedtuple('Plan', 'modo workers tamano_tesela estimado_s')
+
+_autoajuste = None
+
+
+def _mejor_tiempo(fn, repeticiones):
+    mejor = float('inf')
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        fn()
+        mejor = min(mejor, time.perf_counter() - inicio)
+    return mejor
+
+
+def calibrar(backend=None, lado=LADO_CHICO, repeticiones=3):
+    """
+    Mide las constantes del modelo de costo en esta máquina (tarda menos de un segundo):
+
+    - px_s y tap_s: segundos por valor (píxel y canal) del desenfoque de una
+      imagen que entra en la cache, fijo y por cada coeficiente del núcleo (se
+      separan con dos sigmas).
+    - factor_grande: cuánto más cuesta cada valor en una imagen de LADO_GRANDE,
+      que ya no entra en la cache.
+    - byte_s: copiar un byte a o desde la memoria compartida.
+    - proceso_s: levantar y bajar un proceso trabajador.
+    - tesela_s: repartir una tesela y recibir el aviso de que terminó.
+    """
+    backend = obtener_backend(backend)
+    rng = np.random.default_rng(0)
+    imagen = rng.integers(0, 256, (lado, lado), dtype=np.uint8)
+    backend.desenfocar(imagen, 1.0)
+    taps = {sigma: 2 * calcular_halo(sigma) + 1 for sigma in (1.0, 4.0)}
+    tiempos = {sigma: _mejor_tiempo(lambda: backend.desenfocar(imagen, sigma), repeticiones) for sigma in taps}
+    tap_s = max((tiempos[4.0] - tiempos[1.0]) / (imagen.size * (taps[4.0] - taps[1.0])), 0.0)
+    px_s = max(tiempos[1.0] / imagen.size - tap_s * taps[1.0], 0.0)
+
+    grande = rng.integers(0, 256, (LADO_GRANDE, LADO_GRANDE), dtype=np.uint8)
+    por_valor = _mejor_tiempo(lambda: backend.desenfocar(grande, 1.0), 2) / grande.size
+    factor_grande = max(por_valor / (tiempos[1.0] / imagen.size), 1.0)
+
+    origen = np.ones(8 * 1024 * 1024, dtype=np.uint8)
+    destino = np.empty_like(origen)
+    byte_s = _mejor_tiempo(lambda: np.copyto(destino, origen), repeticiones) / origen.nbytes
+
+    chica = np.ascontiguousarray(imagen[:64, :64])
+    inicio = time.perf_counter()
+    with PlanificadorTeselas(1) as planificador, ArrayCompartido.desde_array(chica) as entrada, \
+            ArrayCompartido(chica.shape, chica.dtype) as salida:
+        # La primera tesela espera a que el trabajador esté listo
+        planificador.filtrar(entrada, salida, 0.5, tamano_tesela=64)
+        arranque = time.perf_counter() - inicio
+        # 64 teselas de 8x8: casi todo es el costo de repartirlas
+        tesela_s = _mejor_tiempo(lambda: planificador.filtrar(entrada, salida, 0.5, tamano_tesela=8),
+                                 repeticiones) / 64
+        inicio = time.perf_counter()
+    proceso_s = arranque + time.perf_counter() - inicio
+
+    return {'px_s': px_s, 'tap_s': tap_s, 'factor_grande': factor_grande, 'byte_s': byte_s,
+            'proceso_s': proceso_s, 'tesela_s': tesela_s, 'backend': backend.nombre}
+
+
+class ModeloCosto:
+    """
+    Tiempo estimado de filtrar una imagen de alto x ancho x canales con un sigma.
+
+    El paralelo suma arrancar los trabajadores (si no hay un planificador ya
+    creado), copiar la imagen a memoria compartida y de vuelta, repartir las
+    teselas, y el cálculo de cada tesela con su halo por las rondas que le
+    tocan a cada trabajador. Con más trabajadores que núcleos, los núcleos se
+    comparten.
+
+    El costo por valor crece cuando el array deja de entrar en la cache: se
+    interpola (en escala logarítmica) entre LADO_CHICO y LADO_GRANDE. Por eso
+    una tesela chica rinde más por píxel que la imagen entera.
+    """
+
+    def __init__(self, calibracion, cores=None):
+        self.c = calibracion
+        self.cores = cores or os.cpu_count() or 1
+
+    def _factor_memoria(self, valores):
+        chico, grande = math.log(LADO_CHICO ** 2), math.log(LADO_GRANDE ** 2)
+        t = min(max((math.log(max(valores, 1)) - chico) / (grande - chico), 0.0), 1.0)
+        return 1.0 + t * (self.c['factor_grande'] - 1.0)
+
+    def _desenfoque(self, alto, ancho, canales, sigma):
+        valores = alto * ancho * canales
+        por_valor = self.c['px_s'] + self.c['tap_s'] * (2 * calcular_halo(sigma) + 1)
+        return valores * por_valor * self._factor_memoria(valores)
+
+    def secuencial(self, alto, ancho, canales, sigma):
+        return self._desenfoque(alto, ancho, canales, sigma)
+
+    def paralelo(self, alto, ancho, canales, sigma, workers, tamano_tesela, arrancar=True):
+        halo = calcular_halo(sigma)
+        teselas = math.ceil(alto / tamano_tesela) * math.ceil(ancho / tamano_tesela)
+        por_tesela = self._desenfoque(min(tamano_tesela + 2 * halo, alto), min(tamano_tesela + 2 * halo, ancho),
+                                      canales, sigma)
+        calculo = math.ceil(teselas / workers) * por_tesela * max(1.0, workers / self.cores)
+        copias = 2 * alto * ancho * canales * self.c['byte_s']
+        arranque = workers * self.c['proceso_s'] if arrancar else 0.0
+        return arranque + copias + teselas * self.c['tesela_s'] + calculo
+
+    def elegir(self, alto, ancho, canales=1, sigma=2.0, workers=None, arrancar=True):
+        """
+        Devuelve el Plan más rápido según el modelo. Con `workers` fijo (un
+        planificador o pool que ya existe) solo se elige el modo y la tesela.
+        """
+        mejor = Plan(SECUENCIAL, 1, None, self.secuencial(alto, ancho, canales, sigma))
+        limite = mejor.estimado_s * MARGEN_PARALELO
+        candidatos = [workers] if workers else range(2, self.cores + 1)
+        for n in candidatos:
+            for tamano in TAMANOS_TESELA:
+                estimado = self.paralelo(alto, ancho, canales, sigma, n, tamano, arrancar)
+                if estimado < limite:
+                    mejor, limite = Plan(PARALELO, n, tamano, estimado), estimado
+        return mejor
+
+
+class Autoajuste:
+    """
+    Modelo de costo con su calibración y los planes ya elegidos, persistidos en
+    `ruta` (por defecto ~/.cache/tp1_autoajuste.json o TP_AUTOAJUSTE).
+
+    Si el archivo es de otra máquina, otro backend u otra versión del modelo,
+    se descarta y se calibra de nuevo la primera vez que hace falta.
+
+    Elegir planes no escribe nada: con `persistir` (los puntos de entrada de
+    línea de comandos) lo nuevo se guarda una vez, al salir del proceso; sin
+    él solo se guarda llamando a guardar().
+    """
+
+    def __init__(self, ruta=None, backend=None, cores=None, persistir=False):
+        self.ruta = ruta or os.environ.get(VARIABLE_ENTORNO) or RUTA_POR_DEFECTO
+        self.backend = obtener_backend(backend).nombre
+        self.cores = cores or os.cpu_count() or 1
+        self.maquina = {'version': VERSION_MODELO, 'plataforma': platform.platform(), 'cpu_count': self.cores,
+                        'backend': self.backend}
+        self._estado = self._cargar()
+        self._modelo = None
+        self._cambios = False
+        if persistir:
+            atexit.register(self.guardar_si_cambio)
+
+    def _cargar(self):
+        try:
+            with open(self.ruta) as f:
+                estado = json.load(f)
+            if estado.get('maquina') == self.maquina:
+                return estado
+        except (OSError, ValueError):
+            pass
+        return {'maquina': self.maquina, 'calibracion': None, 'planes': {}}
+
+    def guardar(self):
+        """
+        Escribe el estado en un temporal y lo reemplaza de una vez: otro proceso
+        que lee o escribe a la vez ve el archivo anterior o el nuevo, nunca uno a medias.
+        """
+        directorio = os.path.dirname(self.ruta)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        temporal = f"{self.ruta}.{os.getpid()}.tmp"
+        try:
+            with open(temporal, 'w') as f:
+                json.dump(self._estado, f, indent=2)
+            os.replace(temporal, self.ruta)
+            self._cambios = False
+        except OSError as e:
+            # Sin dónde guardar se sigue igual: solo se pierde la persistencia
+            print(f"No se pudo guardar el autoajuste en {self.ruta}: {e}")
+            try:
+                os.remove(temporal)
+            except OSError:
+                pass
+
+    def guardar_si_cambio(self):
+        if self._cambios:
+            self.guardar()
+
+    @property
+    def calibracion(self):
+        if self._estado['calibracion'] is None:
+            inicio = time.perf_counter()
+            self._estado['calibracion'] = calibrar(self.backend)
+            self._estado['planes'] = {}
+            print(f"Autoajuste calibrado en {time.perf_counter() - inicio:.2f} s.")
+            self._cambios = True
+        return self._estado['calibracion']
+
+    @property
+    def modelo(self):
+        if self._modelo is None:
+            self._modelo = ModeloCosto(self.calibracion, self.cores)
+        return self._modelo
+
+    def recalibrar(self):
+        self._estado = {'maquina': self.maquina, 'calibracion': None, 'planes': {}}
+        self._modelo = None
+        return self.calibracion
+
+    def elegir(self, alto, ancho, canales=1, sigma=2.0, workers=None, arrancar=True):
+        """
+        Plan para filtrar una imagen de alto x ancho x canales (ver ModeloCosto.elegir).
+        """
+        clave = f"{alto}x{ancho}x{canales}:{float(sigma):g}:{workers or 'auto'}:{'frio' if arrancar else 'caliente'}"
+        guardado = self._estado['planes'].get(clave)
+        if guardado is not None:
+            return Plan(**guardado)
+        plan = self.modelo.elegir(alto, ancho, canales, sigma, workers, arrancar)
+        planes = self._estado['planes']
+        planes[clave] = plan._asdict()
+        while len(planes) > MAX_PLANES:
+            del planes[next(iter(planes))]
+        self._cambios = True
+        return plan
+
+    def elegir_para(self, np_array, sigma=2.0, workers=None, arrancar=True):
+        canales = np_array.shape[2] if np_array.ndim == 3 else 1
+        return self.elegir(np_array.shape[0], np_array.shape[1], canales, sigma, workers, arrancar)
+
+
+def configurar_autoajuste(**opciones):
+    """
+    Reemplaza el autoajuste del proceso por uno nuevo con estas opciones.
+    """
+    global _autoajuste
+    _autoajuste = Autoajuste(**opciones)
+    return _autoajuste
+
+
+def obtener_autoajuste():
+    """
+    Devuelve el autoajuste del proceso, creándolo la primera vez.
+    """
+    global _autoajuste
+    if _autoajuste is None or _autoajuste.backend != obtener_backend().nombre:
+        _autoajuste = Autoajuste()
+    return _autoajuste
+
+
+def filtrar_auto(np_array, sigma=2.0, planificador=None, cancelacion=None):
+    """
+    Desenfoca np_array en uno o varios procesos según el plan del autoajuste.
+
+    Con un PlanificadorTeselas ya creado, el modelo no cuenta el arranque de
+    los trabajadores y usa los que tiene.
+    """
+    workers = planificador.num_procesos if planificador is not None else None
+    plan = obtener_autoajuste().elegir_para(np_array, sigma, workers, arrancar=planificador is None)
+    if plan.modo == SECUENCIAL:
+        verificar(cancelacion)
+        return obtener_backend().desenfocar(np_array, sigma)
+    return filtrar_imagen_teselada(np_array, sigma, plan.workers, plan.tamano_tesela, planificador=planificador,
+                                   cancelacion=cancelacion)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Muestra (y opcionalmente mide) el plan del autoajuste.")
+    parser.add_argument("imagenes", nargs="*", help="Imágenes para las que mostrar el plan")
+    parser.add_argument("--sigma", type=float, default=2.0)
+    parser.add_argument("--recalibrar", action="store_true", help="Descartar la calibración guardada")
+    parser.add_argument("--medir", action="store_true", help="Comparar el plan contra el secuencial")
+    args = parser.parse_args()
+
+    autoajuste = configurar_autoajuste(persistir=True)
+    if args.recalibrar:
+        autoajuste.recalibrar()
+    for nombre, valor in autoajuste.calibracion.items():
+        print(f"{nombre:10} {valor:.3e}" if isinstance(valor, float) else f"{nombre:10} {valor}")
+
+    for ruta in args.imagenes:
+        imagen = np.asarray(Image.open(ruta).convert('RGB'))
+        plan = autoajuste.elegir_para(imagen, args.sigma)
+        print(f"{ruta}: {plan.modo}, {plan.workers} trabajadores, tesela {plan.tamano_tesela}, "
+              f"estimado {plan.estimado_s:.4f} s")
+        if args.medir:
+            inicio = time.perf_counter()
+            obtener_backend().desenfocar(imagen, args.sigma)
+            secuencial = time.perf_counter() - inicio
+            inicio = time.perf_counter()
+            filtrar_auto(imagen, args.sigma)
+            print(f"  medido: secuencial {secuencial:.4f} s, plan {time.perf_counter() - inicio:.4f} s")
@@ -0,0 +1,190 @@
+import os
+import sys
+import numpy as np
+from PIL import Image
+from scipy.ndimage import gaussian_filter
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Mismo valor por defecto que usa scipy.ndimage.gaussian_filter
+TRUNCATE = 4.0
+# Los procesos hijos (forkserver, spawn) leen el backend elegido de acá
+VARIABLE_ENTORNO = 'TP_BACKEND'
+BACKEND_POR_DEFECTO = 'pil'
+
+_instancias = {}
+
+
+class BackendPIL:
+    """
+    Implementación de referencia: PIL para color y tamaño, scipy para el desenfoque.
+    """
+
+    nombre = 'pil'
+
+    def a_grises(self, np_array):
+        if np_array.ndim == 2:
+            return np_array
+        return np.asarray(Image.fromarray(np_array).convert('L'))
+
+    def redimensionar(self, np_array, ancho, alto):
+        return np.asarray(Image.fromarray(np_array).resize((ancho, alto)))
+
+    def desenfocar(self, np_array, sigma, truncate=TRUNCATE):
+        """
+        Desenfoque gaussiano solo en los ejes espaciales (los canales no se mezclan).
+        """
+        sigmas = (sigma, sigma) + (0,) * (np_array.ndim - 2)
+        return gaussian_filter(np_array, sigma=sigmas, truncate=truncate)
+
+
+class BackendCV2:
+    """
+    OpenCV sobre arrays contiguos: cvtColor, resize con INTER_AREA al reducir y
+    GaussianBlur separable con el mismo radio y los mismos bordes (reflect) que
+    scipy. Los resultados difieren de BackendPIL en redondeos; ver
+    verificar_equivalencia().
+    """
+
+    nombre = 'cv2'
+    CONVERSIONES_GRIS = {3: 'COLOR_RGB2GRAY', 4: 'COLOR_RGBA2GRAY'}
+
+    def __init__(self):
+        if cv2 is None:
+            raise ImportError("El backend 'cv2' necesita opencv-python")
+
+    def a_grises(self, np_array):
+        if np_array.ndim == 2:
+            return np_array
+        conversion = self.CONVERSIONES_GRIS.get(np_array.shape[2])
+        if conversion is None:
+            return BackendPIL().a_grises(np_array)
+        return cv2.cvtColor(np.ascontiguousarray(np_array), getattr(cv2, conversion))
+
+    def redimensionar(self, np_array, ancho, alto):
+        reduce = ancho * alto < np_array.shape[0] * np_array.shape[1]
+        interpolacion = cv2.INTER_AREA if reduce else cv2.INTER_CUBIC
+        return cv2.resize(np.ascontiguousarray(np_array), (ancho, alto), interpolation=interpolacion)
+
+    def desenfocar(self, np_array, sigma, truncate=TRUNCATE):
+        if sigma <= 0:
+            return np_array.copy()
+        lado = 2 * int(truncate * sigma + 0.5) + 1
+        return cv2.GaussianBlur(np.ascontiguousarray(np_array), (lado, lado), sigmaX=sigma, sigmaY=sigma,
+                                borderType=cv2.BORDER_REFLECT)
+
+
+BACKENDS = {
+    'pil': BackendPIL,
+    'cv2': BackendCV2,
+}
+
+
+def disponibles():
+    return [nombre for nombre in BACKENDS if nombre != 'cv2' or cv2 is not None]
+
+
+def obtener_backend(nombre=None):
+    """
+    Devuelve el backend `nombre`, o el configurado para el proceso (variable de
+    entorno TP_BACKEND), o el por defecto.
+    """
+    nombre = nombre or os.environ.get(VARIABLE_ENTORNO) or BACKEND_POR_DEFECTO
+    backend = _instancias.get(nombre)
+    if backend is None:
+        if nombre not in BACKENDS:
+            raise ValueError(f"Backend desconocido: {nombre}")
+        backend = _instancias[nombre] = BACKENDS[nombre]()
+    return backend
+
+
+def configurar_backend(nombre):
+    """
+    Elige el backend del proceso y de los procesos que cree a partir de ahora.
+    """
+    backend = obtener_backend(nombre)
+    os.environ[VARIABLE_ENTORNO] = nombre
+    return backend
+
+
+def a_grises_pil(image, backend=None):
+    """
+    convert('L') de una imagen PIL a través del backend (para RGB y RGBA).
+    """
+    backend = backend or obtener_backend()
+    if image.mode not in ('RGB', 'RGBA') or isinstance(backend, BackendPIL):
+        return image.convert('L')
+    return Image.fromarray(backend.a_grises(np.asarray(image)))
+
+
+def redimensionar_pil(image, tamano, backend=None):
+    """
+    resize() de una imagen PIL a través del backend (para L, RGB y RGBA).
+    """
+    backend = backend or obtener_backend()
+    if image.mode not in ('L', 'RGB', 'RGBA') or isinstance(backend, BackendPIL):
+        return image.resize(tamano)
+    return Image.fromarray(backend.redimensionar(np.asarray(image), *tamano))
+
+
+def _imagen_de_prueba(lado, semilla):
+    # Gradientes suaves con ruido: parecido a una foto, sin bordes perfectos
+    rng = np.random.default_rng(semilla)
+    y, x = np.mgrid[0:lado, 0:lado].astype(np.float32)
+    canales = [np.sin(x / 17) * 80 + y / lado * 90, np.cos(y / 23) * 80 + x / lado * 90, (x + y) / (2 * lado) * 200]
+    imagen = np.stack(canales, axis=-1) + rng.normal(0, 12, (lado, lado, 3))
+    return np.clip(imagen + 40, 0, 255).astype(np.uint8)
+
+
+def verificar_equivalencia(referencia='pil', candidato='cv2', lado=301, semilla=0, tolerancias=None):
+    """
+    Compara dos backends sobre una imagen sintética y devuelve, por operación, la
+    diferencia absoluta máxima y media y si están dentro de la tolerancia.
+
+    Las tolerancias por defecto son las diferencias medidas, con poco margen:
+    en grises solo difiere el redondeo (máximo 1). En el desenfoque de uint8
+    scipy trunca el resultado de cada pasada separable (queda ~1 nivel por
+    debajo en promedio) y OpenCV redondea, así que la diferencia típica es 1 y
+    la máxima 2. Al reducir, el núcleo bicúbico de PIL y INTER_AREA difieren en
+    hasta 4 niveles en los bordes finos.
+    """
+    tolerancias = tolerancias or {
+        'grises': (1, 0.05),
+        'desenfoque': (2, 1.1),
+        'redimension': (4, 0.75),
+    }
+    a, b = obtener_backend(referencia), obtener_backend(candidato)
+    imagen = _imagen_de_prueba(lado, semilla)
+    gris = a.a_grises(imagen)
+
+    casos = {
+        'grises': lambda backend: backend.a_grises(imagen),
+        'desenfoque': lambda backend: np.stack([backend.desenfocar(gris, s) for s in (0.8, 2.0, 5.0)]),
+        'desenfoque_rgb': lambda backend: backend.desenfocar(imagen, 2.0),
+        'redimension': lambda backend: backend.redimensionar(gris, int(lado * 0.7), int(lado * 0.7)),
+    }
+    informe = {}
+    for operacion, ejecutar in casos.items():
+        diferencia = np.abs(ejecutar(a).astype(np.int16) - ejecutar(b).astype(np.int16))
+        maximo, media = tolerancias.get(operacion.split('_')[0], (0, 0.0))
+        informe[operacion] = {
+            'max': int(diferencia.max()),
+            'media': float(diferencia.mean()),
+            'ok': bool(diferencia.max() <= maximo and diferencia.mean() <= media),
+        }
+    return informe
+
+
+if __name__ == "__main__":
+    if cv2 is None:
+        print("opencv-python no está instalado: solo está el backend 'pil'.")
+        sys.exit(0)
+    informe = verificar_equivalencia()
+    for operacion, r in informe.items():
+        print(f"{operacion:16} max={r['max']:<3} media={r['media']:.4f} {'ok' if r['ok'] else 'FUERA DE TOLERANCIA'}")
+    sys.exit(0 if all(r['ok'] for r in informe.values()) else 1)
@@ -0,0 +1,441 @@
+import sys
+import os
+import json
+import time
+import platform
+import argparse
+import resource
+import tempfile
+import threading
+import statistics
+import multiprocessing
+import numpy as np
+import scipy
+from PIL import Image
+from scipy.ndimage import gaussian_filter
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tp1 import backends, tp1_punto1, tp1_punto2, tp1_punto3, tp1_punto4, tp1_punto5
+from tp1.autoajuste import filtrar_auto
+from tp1.blur_teselado import PlanificadorTeselas, filtrar_imagen_teselada
+from tp1.pool_persistente import PoolFiltros
+
+# nombre -> (preparar(workers) -> recursos, ejecutar(imagen, sigma, workers, recursos))
+ESTRATEGIAS = {}
+# nombre -> estrategia contra la que se calcula el speedup
+REFERENCIAS = {}
+# Estrategias que no reparten trabajo: se miden una sola vez, con workers=1
+SIN_WORKERS = set()
+# Estrategias que convierten las partes a RGB: en 'L' no son comparables con su referencia
+SOLO_RGB = set()
+# Estrategias que no usan sigma: se miden una sola vez por imagen, con sigma None
+SIN_SIGMA = set()
+PARTES_CODIFICACION = 16
+PARTES_SECUENCIAL = 16
+# Cada cuánto se suma el RSS del árbol de procesos durante una medición
+INTERVALO_RSS = 0.02
+
+
+def registrar_estrategia(nombre, preparar=None, referencia='secuencial', usa_workers=True, solo_rgb=False,
+                         usa_sigma=True):
+    """
+    Decorador para agregar una estrategia de ejecución al benchmark.
+
+    `preparar` crea los recursos persistentes (pools, planificadores) fuera de la
+    medición; deben tener un método close() o cerrar(). `referencia` es la
+    estrategia secuencial equivalente, usada para el speedup. Con `solo_rgb` la
+    estrategia no se mide en modo 'L', porque trabaja en RGB aunque la entrada sea gris.
+    Las que no reparten trabajo (`usa_workers=False`) se miden solo con
+    workers=1, y las que no filtran (`usa_sigma=False`) una vez por imagen.
+    """
+    def decorador(ejecutar):
+        ESTRATEGIAS[nombre] = (preparar, ejecutar)
+        REFERENCIAS[nombre] = referencia
+        if not usa_workers:
+            SIN_WORKERS.add(nombre)
+        if solo_rgb:
+            SOLO_RGB.add(nombre)
+        if not usa_sigma:
+            SIN_SIGMA.add(nombre)
+        return ejecutar
+    return decorador
+
+
+def _partes(imagen, workers):
+    return tp1_punto3.split_image(Image.fromarray(imagen), workers)
+
+
+@registrar_estrategia('secuencial')
+def _secuencial(imagen, sigma, workers, recursos):
+    return gaussian_filter(imagen, sigma=(sigma, sigma) + (0,) * (imagen.ndim - 2))
+
+
+@registrar_estrategia('punto2_pool_starmap')
+def _punto2(imagen, sigma, workers, recursos):
+    return tp1_punto2.procesar_imagen_en_paralelo(imagen, num_procesos=workers, sigma=sigma)
+
+
+@registrar_estrategia('punto4_secuencial_por_partes', solo_rgb=True, usa_workers=False)
+def _punto4_secuencial(imagen, sigma, workers, recursos):
+    # Un solo proceso: las partes son fijas, no dependen de los workers
+    partes = tp1_punto4.process_image_parts_sequential(_partes(imagen, PARTES_SECUENCIAL), sigma)
+    return tp1_punto4.combine_image_parts(partes)
+
+
+@registrar_estrategia('punto3_teselas', solo_rgb=True)
+def _punto3(imagen, sigma, workers, recursos):
+    partes = tp1_punto3.process_image_parts(_partes(imagen, workers), sigma, num_workers=workers)
+    return tp1_punto3.combine_image_parts(partes)
+
+
+@registrar_estrategia('punto5_memoria_compartida', solo_rgb=True)
+def _punto5(imagen, sigma, workers, recursos):
+    return tp1_punto5.process_image_parts_with_shared_memory(_partes(imagen, workers), workers, sigma)
+
+
+@registrar_estrategia('teselado_planificador', preparar=PlanificadorTeselas)
+def _teselado(imagen, sigma, workers, recursos):
+    return filtrar_imagen_teselada(imagen, sigma, planificador=recursos)
+
+
+@registrar_estrategia('autoajuste', usa_workers=False)
+def _autoajuste(imagen, sigma, workers, recursos):
+    # Elige secuencial o teselado (y cuántos trabajadores) con el modelo calibrado
+    return filtrar_auto(imagen, sigma)
+
+
+@registrar_estrategia('pool_persistente', preparar=PoolFiltros)
+def _pool_persistente(imagen, sigma, workers, recursos):
+    return tp1_punto2.procesar_imagen_en_paralelo(imagen, num_procesos=workers, sigma=sigma, pool=recursos)
+
+
+def _codificar_partes(imagen, workers, procesos=False):
+    # Siempre las mismas partes, así el speedup solo depende de los trabajadores
+    partes = tp1_punto3.split_image(Image.fromarray(imagen), PARTES_CODIFICACION)
+    with tempfile.TemporaryDirectory() as directorio:
+        base = os.path.join(directorio, 'parte')
+        tp1_punto1.guardar_partes(partes, base, 'png', {'compress_level': 6}, trabajadores=workers,
+                                  procesos=procesos, silencioso=True)
+
+
+# La codificación no usa sigma: solo se barre la cantidad de trabajadores
+@registrar_estrategia('codificar_partes_secuencial', referencia='codificar_partes_secuencial', usa_sigma=False)
+def _codificar_secuencial(imagen, sigma, workers, recursos):
+    _codificar_partes(imagen, 1)
+
+
+@registrar_estrategia('codificar_partes_hilos', referencia='codificar_partes_secuencial', usa_sigma=False)
+def _codificar_hilos(imagen, sigma, workers, recursos):
+    _codificar_partes(imagen, workers)
+
+
+@registrar_estrategia('codificar_partes_procesos', referencia='codificar_partes_secuencial', usa_sigma=False)
+def _codificar_procesos(imagen, sigma, workers, recursos):
+    _codificar_partes(imagen, workers, procesos=True)
+
+
+def _registrar_backend(nombre_backend, operacion, ejecutar):
+    # Cada operación de cada backend, contra la misma operación en 'pil'
+    @registrar_estrategia(f'backend_{nombre_backend}_{operacion}', referencia=f'backend_pil_{operacion}',
+                          usa_workers=False, usa_sigma=operacion in OPERACIONES_CON_SIGMA)
+    def _ejecutar(imagen, sigma, workers, recursos):
+        return ejecutar(backends.obtener_backend(nombre_backend), imagen, sigma)
+
+
+OPERACIONES_CON_SIGMA = {'desenfoque'}
+OPERACIONES_BACKEND = {
+    'grises': lambda backend, imagen, sigma: backend.a_grises(imagen),
+    'redimension': lambda backend, imagen, sigma: backend.redimensionar(
+        imagen, imagen.shape[1] * 7 // 10, imagen.shape[0] * 7 // 10),
+    'desenfoque': lambda backend, imagen, sigma: backend.desenfocar(imagen, sigma),
+}
+for _nombre_backend in backends.disponibles():
+    for _operacion, _ejecutar_operacion in OPERACIONES_BACKEND.items():
+        _registrar_backend(_nombre_backend, _operacion, _ejecutar_operacion)
+
+
+def generar_imagen_sintetica(lado, modo='L', semilla=0):
+    """
+    Imagen de lado x lado con gradientes y ruido, reproducible a partir de la semilla.
+    """
+    rng = np.random.default_rng(semilla)
+    canales = 3 if modo == 'RGB' else 1
+    gradiente = np.linspace(0, 200, lado, dtype=np.float32)
+    imagen = np.empty((lado, lado, canales), dtype=np.uint8)
+    for c in range(canales):
+        ruido = rng.integers(0, 56, size=(lado, lado), dtype=np.uint8)
+        imagen[:, :, c] = (gradiente[None, :] if c % 2 else gradiente[:, None]).astype(np.uint8) + ruido
+    return imagen[:, :, 0] if canales == 1 else imagen
+
+
+def _hijos_directos(pid):
+    hijos = []
+    try:
+        hilos = os.listdir(f'/proc/{pid}/task')
+    except OSError:
+        return hijos
+    for hilo in hilos:
+        try:
+            with open(f'/proc/{pid}/task/{hilo}/children') as f:
+                hijos.extend(int(hijo) for hijo in f.read().split())
+        except OSError:
+            pass
+    return hijos
+
+
+def rss_arbol_kb(pid):
+    """
+    RSS (KiB) de `pid` más el de todos sus descendientes, leído de /proc; None
+    si no hay /proc. Las páginas compartidas (memoria compartida, bibliotecas)
+    cuentan una vez por proceso que las tiene mapeadas: es una cota superior.
+    """
+    if not os.path.isdir('/proc'):
+        return None
+    total = 0
+    pendientes = [pid]
+    while pendientes:
+        actual = pendientes.pop()
+        try:
+            with open(f'/proc/{actual}/statm') as f:
+                total += int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+        except (OSError, IndexError, ValueError):
+            continue
+        pendientes.extend(_hijos_directos(actual))
+    return total
+
+
+class MuestreoRSS:
+    """
+    Hilo que suma el RSS del proceso y sus descendientes cada `intervalo`
+    segundos y se queda con el máximo. ru_maxrss solo da el pico del proceso
+    más grande, no el de todos los trabajadores a la vez.
+    """
+
+    def __init__(self, intervalo=INTERVALO_RSS):
+        self.intervalo = intervalo
+        self.pico_kb = rss_arbol_kb(os.getpid())
+        self._fin = threading.Event()
+        self._hilo = threading.Thread(target=self._muestrear, daemon=True)
+
+    def _muestrear(self):
+        while not self._fin.wait(self.intervalo):
+            self.pico_kb = max(self.pico_kb, rss_arbol_kb(os.getpid()))
+
+    def __enter__(self):
+        if self.pico_kb is not None:
+            self._hilo.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._fin.set()
+        if self._hilo.is_alive():
+            self._hilo.join()
+
+
+def _cerrar(recursos):
+    if recursos is None:
+        return
+    cierre = getattr(recursos, 'close', None) or getattr(recursos, 'cerrar')
+    cierre()
+
+
+def _medir(estrategia, lado, sigma, workers, modo, repeticiones, calentamiento, cola):
+    """
+    Mide una configuración. Corre en un proceso propio para que el pico de RSS y el
+    tiempo de CPU de los hijos correspondan solo a esta configuración.
+    """
+    preparar, ejecutar = ESTRATEGIAS[estrategia]
+    imagen = generar_imagen_sintetica(lado, modo)
+    with MuestreoRSS() as muestreo:
+        cpu_inicio = time.process_time()
+        recursos = preparar(workers) if preparar else None
+        try:
+            for _ in range(calentamiento):
+                ejecutar(imagen, sigma, workers, recursos)
+            cpu_arranque = time.process_time() - cpu_inicio
+
+            tiempos = []
+            cpu_inicio = time.process_time()
+            for _ in range(repeticiones):
+                inicio = time.perf_counter()
+                ejecutar(imagen, sigma, workers, recursos)
+                tiempos.append(time.perf_counter() - inicio)
+            cpu_propio = time.process_time() - cpu_inicio
+        finally:
+            # Cerrar los pools antes de leer el uso de los hijos, así quedan contabilizados
+            _cerrar(recursos)
+
+    hijos = resource.getrusage(resource.RUSAGE_CHILDREN)
+    propio = resource.getrusage(resource.RUSAGE_SELF)
+    cola.put({
+        'tiempos': tiempos,
+        'cpu_propio': cpu_propio,
+        'cpu_propio_arranque': cpu_arranque,
+        'cpu_hijos': hijos.ru_utime + hijos.ru_stime,
+        'rss_pico_propio_kb': propio.ru_maxrss,
+        'rss_pico_hijo_kb': hijos.ru_maxrss,
+        'rss_pico_total_kb': muestreo.pico_kb,
+    })
+
+
+def _ejecutar_medicion(estrategia, lado, sigma, workers, modo, repeticiones, calentamiento):
+    cola = multiprocessing.Queue()
+    p = multiprocessing.Process(
+        target=_medir,
+        args=(estrategia, lado, sigma, workers, modo, repeticiones, calentamiento, cola),
+    )
+    p.start()
+    try:
+        return cola.get()
+    finally:
+        p.join()
+
+
+def _cpu_total(datos):
+    # Lo que corre en el proceso medidor se separa en arranque y repeticiones;
+    # el de los hijos es uno solo y hay que descontarle el arranque
+    return datos['cpu_propio'] + datos['cpu_hijos']
+
+
+def medir_configuracion(estrategia, lado, sigma, workers, modo, repeticiones=3, calentamiento=1):
+    """
+    Ejecuta una configuración en un proceso nuevo y devuelve sus métricas.
+
+    El CPU de los hijos solo se puede leer en total al terminar el proceso, así
+    que la preparación (arranque de pools) y el calentamiento se miden aparte,
+    en otro proceso sin repeticiones, y se descuentan del CPU por repetición.
+    """
+    datos = _ejecutar_medicion(estrategia, lado, sigma, workers, modo, repeticiones, calentamiento)
+    arranque = _ejecutar_medicion(estrategia, lado, sigma, workers, modo, 0, calentamiento)
+
+    tiempos = datos['tiempos']
+    cpu_arranque = arranque['cpu_propio_arranque'] + arranque['cpu_hijos']
+    return {
+        'estrategia': estrategia,
+        'lado': lado,
+        'sigma': sigma,
+        'workers': workers,
+        'modo': modo,
+        'repeticiones': repeticiones,
+        'wall_mediana_s': statistics.median(tiempos),
+        'wall_min_s': min(tiempos),
+        'wall_max_s': max(tiempos),
+        'cpu_s': max(_cpu_total(datos) - arranque['cpu_hijos'], 0.0) / repeticiones,
+        # Preparación, calentamiento y cierre de los recursos, una sola vez
+        'cpu_arranque_s': cpu_arranque,
+        # Pico del proceso medidor, del hijo más grande, y de todo el árbol a la vez (muestreado)
+        'rss_pico_propio_kb': datos['rss_pico_propio_kb'],
+        'rss_pico_hijo_kb': datos['rss_pico_hijo_kb'],
+        'rss_pico_total_kb': datos['rss_pico_total_kb'],
+    }
+
+
+def agregar_aceleracion(resultados):
+    """
+    Agrega speedup y eficiencia respecto de la estrategia de referencia (la
+    secuencial equivalente) con la misma imagen y sigma.
+    """
+    base = {
+        (r['estrategia'], r['lado'], r['sigma'], r['modo']): r['wall_mediana_s']
+        for r in resultados if REFERENCIAS.get(r['estrategia']) == r['estrategia']
+    }
+    for r in resultados:
+        referencia = base.get((REFERENCIAS.get(r['estrategia']), r['lado'], r['sigma'], r['modo']))
+        if referencia is None:
+            continue
+        r['speedup'] = referencia / r['wall_mediana_s']
+        r['eficiencia'] = r['speedup'] / r['workers']
+    return resultados
+
+
+def ejecutar_barrido(estrategias, lados, sigmas, workers, modos, repeticiones=3, calentamiento=1):
+    resultados = []
+    for lado in lados:
+        for modo in modos:
+            for i, sigma in enumerate(sigmas):
+                for estrategia in estrategias:
+                    if modo == 'L' and estrategia in SOLO_RGB:
+                        continue
+                    sigma_estrategia = sigma
+                    if estrategia in SIN_SIGMA:
+                        # Se mide con el primer sigma y queda registrada sin sigma
+                        if i > 0:
+                            continue
+                        sigma_estrategia = None
+                    # Las secuenciales no dependen de la cantidad de workers
+                    secuencial = REFERENCIAS[estrategia] == estrategia or estrategia in SIN_WORKERS
+                    lista_workers = [1] if secuencial else workers
+                    for n in lista_workers:
+                        r = medir_configuracion(estrategia, lado, sigma_estrategia, n, modo, repeticiones,
+                                                calentamiento)
+                        print(f"{estrategia:32} {lado:>6}² {modo:3} sigma={str(sigma_estrategia):<4} "
+                              f"workers={n:<3} {r['wall_mediana_s']:.4f} s")
+                        resultados.append(r)
+    return agregar_aceleracion(resultados)
+
+
+def metadatos():
+    return {
+        'fecha': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'scipy': scipy.__version__,
+        'opencv': backends.cv2.__version__ if backends.cv2 is not None else None,
+        'backend': backends.obtener_backend().nombre,
+        'plataforma': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def comparar(actual, previo, tolerancia=0.10):
+    """
+    Devuelve las configuraciones que empeoraron más que `tolerancia` respecto de un JSON previo.
+    """
+    def clave(r):
+        return (r['estrategia'], r['lado'], r['sigma'], r['workers'], r['modo'])
+
+    previos = {clave(r): r for r in previo['resultados']}
+    regresiones = []
+    for r in actual['resultados']:
+        anterior = previos.get(clave(r))
+        if anterior and r['wall_mediana_s'] > anterior['wall_mediana_s'] * (1 + tolerancia):
+            regresiones.append((clave(r), anterior['wall_mediana_s'], r['wall_mediana_s']))
+    return regresiones
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de las estrategias de filtrado de tp1.")
+    parser.add_argument("--estrategias", nargs="+", default=list(ESTRATEGIAS), choices=list(ESTRATEGIAS))
+    parser.add_argument("--lados", nargs="+", type=int, default=[256, 1024, 4096, 16384],
+                        help="Lados de las imágenes sintéticas (cuadradas)")
+    parser.add_argument("--sigmas", nargs="+", type=float, default=[1.0, 4.0])
+    parser.add_argument("--workers", nargs="+", type=int, default=[1, 2, 4, os.cpu_count() or 1])
+    parser.add_argument("--modos", nargs="+", default=["L", "RGB"], choices=["L", "RGB"])
+    parser.add_argument("--repeticiones", type=int, default=3)
+    parser.add_argument("--calentamiento", type=int, default=1)
+    parser.add_argument("-o", "--salida", default="benchmark_tp1.json", help="Archivo JSON de resultados")
+    parser.add_argument("--comparar", help="JSON de una corrida anterior para detectar regresiones")
+    parser.add_argument("--tolerancia", type=float, default=0.10)
+    args = parser.parse_args(argv)
+
+    workers = sorted(set(args.workers))
+    resultados = ejecutar_barrido(args.estrategias, args.lados, args.sigmas, workers, args.modos,
+                                  args.repeticiones, args.calentamiento)
+    informe = {'meta': metadatos(), 'resultados': resultados}
+    with open(args.salida, 'w') as f:
+        json.dump(informe, f, indent=2)
+    print(f"Resultados guardados en: {args.salida}")
+
+    if args.comparar:
+        with open(args.comparar) as f:
+            previo = json.load(f)
+        regresiones = comparar(informe, previo, args.tolerancia)
+        for clave, antes, ahora in regresiones:
+            print(f"Regresión en {clave}: {antes:.4f} s -> {ahora:.4f} s")
+        return 1 if regresiones else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,360 @@
+import os
+import queue
+import threading
+import multiprocessing
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+
+from tp1.backends import obtener_backend
+from tp1.cancelacion import TokenCancelacion, TrabajoCancelado, verificar
+
+# Mismo valor por defecto que usa scipy.ndimage.gaussian_filter
+TRUNCATE = 4.0
+# Teselas chicas: muchas más que trabajadores para repartir bien la carga
+TAMANO_TESELA = 128
+# Lo que devuelve un trabajador por una tesela que salteó porque el trabajo se canceló
+TESELA_CANCELADA = 'cancelada'
+
+
+class ArrayCompartido:
+    """
+    Array de numpy respaldado por un bloque de multiprocessing.shared_memory.
+
+    Los procesos trabajadores se adjuntan por nombre (ver descriptor()), así que
+    los píxeles nunca se serializan.
+    """
+
+    def __init__(self, shape, dtype, nombre=None):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.propietario = nombre is None
+        if self.propietario:
+            nbytes = max(int(np.prod(self.shape)) * self.dtype.itemsize, 1)
+            self.shm = shared_memory.SharedMemory(create=True, size=nbytes)
+        else:
+            self.shm = _adjuntar_shm(nombre)
+        self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=self.shm.buf)
+
+    @classmethod
+    def desde_array(cls, np_array):
+        """
+        Crea un bloque compartido con el contenido de np_array (una única copia).
+        """
+        compartido = cls(np_array.shape, np_array.dtype)
+        compartido.array[...] = np_array
+        return compartido
+
+    @classmethod
+    def adjuntar(cls, descriptor):
+        """
+        Se adjunta a un bloque existente a partir de su descriptor.
+        """
+        nombre, shape, dtype = descriptor
+        return cls(shape, dtype, nombre=nombre)
+
+    @property
+    def nombre(self):
+        return self.shm.name
+
+    def descriptor(self):
+        """
+        Devuelve una tupla pequeña y serializable que identifica al bloque.
+        """
+        return (self.shm.name, self.shape, self.dtype.str)
+
+    def cerrar(self):
+        """
+        Libera la vista local y, si este proceso creó el bloque, lo elimina.
+        """
+        self.array = None
+        self.shm.close()
+        if self.propietario:
+            self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.cerrar()
+
+
+def _adjuntar_shm(nombre):
+    # En Python >= 3.13 el hijo puede adjuntarse sin registrarse en el
+    # resource_tracker; antes, el registro va al tracker compartido con el padre
+    # (ver PlanificadorTeselas) y se limpia cuando el padre hace unlink.
+    try:
+        return shared_memory.SharedMemory(name=nombre, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=nombre)
+
+
+def calcular_halo(sigma, truncate=TRUNCATE):
+    """
+    Devuelve el radio del núcleo gaussiano que usa scipy para un sigma dado.
+    """
+    return int(truncate * float(sigma) + 0.5)
+
+
+def generar_teselas(alto, ancho, tamano_tesela=TAMANO_TESELA):
+    """
+    Divide la imagen en teselas (top, bottom, left, right) que cubren todos los píxeles.
+    """
+    teselas = []
+    for top in range(0, alto, tamano_tesela):
+        for left in range(0, ancho, tamano_tesela):
+            teselas.append((top, min(top + tamano_tesela, alto), left, min(left + tamano_tesela, ancho)))
+    return teselas
+
+
+def filtrar_tesela(entrada, salida, tesela, sigma=2.0, truncate=TRUNCATE):
+    """
+    Filtra una tesela leyendo un halo alrededor y escribiendo solo su núcleo.
+
+    Como el halo es igual al radio del núcleo gaussiano, cada píxel del núcleo ve
+    exactamente los mismos vecinos que al desenfocar la imagen completa con el mismo backend.
+    """
+    top, bottom, left, right = tesela
+    alto, ancho = entrada.shape[:2]
+    halo = calcular_halo(sigma, truncate)
+
+    h_top, h_bottom = max(top - halo, 0), min(bottom + halo, alto)
+    h_left, h_right = max(left - halo, 0), min(right + halo, ancho)
+
+    region = entrada[h_top:h_bottom, h_left:h_right]
+    filtrada = obtener_backend().desenfocar(region, sigma, truncate=truncate)
+    salida[top:bottom, left:right] = filtrada[top - h_top:bottom - h_top, left - h_left:right - h_left]
+
+
+def _adjuntar_en_cache(adjuntos, descriptor, clase=ArrayCompartido):
+    compartido = adjuntos.get(descriptor[0])
+    if compartido is None:
+        compartido = adjuntos[descriptor[0]] = clase.adjuntar(descriptor)
+    return compartido
+
+
+def _soltar_adjuntos(adjuntos):
+    for compartido in adjuntos.values():
+        compartido.cerrar()
+    adjuntos.clear()
+
+
+def worker_teselas(tareas, hechas):
+    """
+    Función del trabajador: toma teselas de la cola mientras haya y avisa cada una que termina.
+
+    Por la cola solo llegan descriptores de memoria compartida y coordenadas; los
+    bloques se adjuntan una vez y se sueltan cuando la cola queda vacía. Las
+    teselas de un trabajo cancelado se saltean sin filtrarlas.
+    """
+    adjuntos = {}
+    try:
+        while True:
+            tarea = tareas.get()
+            if tarea is None:
+                break
+            id_trabajo, descriptor_entrada, descriptor_salida, tesela, sigma, truncate, descriptor_token = tarea
+            try:
+                if descriptor_token is not None and \
+                        _adjuntar_en_cache(adjuntos, descriptor_token, TokenCancelacion).cancelado:
+                    hechas.put((id_trabajo, TESELA_CANCELADA))
+                else:
+                    entrada = _adjuntar_en_cache(adjuntos, descriptor_entrada)
+                    salida = _adjuntar_en_cache(adjuntos, descriptor_salida)
+                    filtrar_tesela(entrada.array, salida.array, tesela, sigma, truncate)
+                    hechas.put((id_trabajo, None))
+            except Exception as e:
+                hechas.put((id_trabajo, f"{tesela}: {e!r}"))
+            if tareas.empty():
+                _soltar_adjuntos(adjuntos)
+    finally:
+        _soltar_adjuntos(adjuntos)
+
+
+class PlanificadorTeselas:
+    """
+    Procesos trabajadores que se reparten dinámicamente las teselas de una imagen.
+
+    Cada trabajador libre toma la siguiente tesela de la cola, así que un trabajador
+    lento no retrasa al resto. Se puede reutilizar para varias imágenes.
+    """
+
+    def __init__(self, num_procesos=None):
+        self.num_procesos = num_procesos or os.cpu_count() or 1
+        self._tareas = multiprocessing.Queue()
+        self._hechas = multiprocessing.Queue()
+        self._lock = threading.Lock()
+        self._siguiente_trabajo = 0
+        self._procesos = []
+        # Los trabajadores heredan el resource_tracker del padre en lugar de crear
+        # uno propio que eliminaría los bloques al terminar
+        resource_tracker.ensure_running()
+        for _ in range(self.num_procesos):
+            p = multiprocessing.Process(target=worker_teselas, args=(self._tareas, self._hechas), daemon=True)
+            self._procesos.append(p)
+            p.start()
+
+    def filtrar(self, entrada, salida, sigma=2.0, tamano_tesela=TAMANO_TESELA, truncate=TRUNCATE,
+                cancelacion=None):
+        """
+        Filtra entrada en salida (ambos ArrayCompartido) y espera a que terminen todas las teselas.
+
+        Si `cancelacion` (un TokenCancelacion) se cancela o vence, los trabajadores
+        saltean las teselas que falten y se levanta TrabajoCancelado.
+        """
+        verificar(cancelacion)
+        teselas = generar_teselas(entrada.shape[0], entrada.shape[1], tamano_tesela)
+        descriptor_token = cancelacion.descriptor() if cancelacion is not None else None
+        with self._lock:
+            id_trabajo = self._siguiente_trabajo
+            self._siguiente_trabajo += 1
+            for tesela in teselas:
+                self._tareas.put((id_trabajo, entrada.descriptor(), salida.descriptor(), tesela, sigma, truncate,
+                                  descriptor_token))
+
+            errores = []
+            canceladas = 0
+            pendientes = len(teselas)
+            while pendientes:
+                try:
+                    id_hecho, error = self._hechas.get(timeout=1.0)
+                except queue.Empty:
+                    if not all(p.is_alive() for p in self._procesos):
+                        raise RuntimeError("Un proceso trabajador terminó inesperadamente")
+                    continue
+                if id_hecho != id_trabajo:
+                    continue
+                pendientes -= 1
+                if error == TESELA_CANCELADA:
+                    canceladas += 1
+                elif error:
+                    errores.append(error)
+
+        if canceladas:
+            # Con el motivo de la cancelación, o "Venció el plazo" si fue el plazo
+            cancelacion.verificar()
+            raise TrabajoCancelado("Trabajo cancelado")
+        if errores:
+            raise RuntimeError(f"Fallaron {len(errores)} teselas: {errores[0]}")
+
+    def cerrar(self):
+        for _ in self._procesos:
+            self._tareas.put(None)
+        for p in self._procesos:
+            p.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.cerrar()
+
+
+def filtrar_en_memoria_compartida(entrada, salida, sigma=2.0, num_procesos=None,
+                                  tamano_tesela=TAMANO_TESELA, truncate=TRUNCATE, planificador=None,
+                                  cancelacion=None):
+    """
+    Aplica el filtro gaussiano 2D de entrada a salida (ambos ArrayCompartido) en paralelo.
+
+    Si no se pasa un PlanificadorTeselas se crea uno temporal con num_procesos trabajadores.
+    """
+    if planificador is not None:
+        planificador.filtrar(entrada, salida, sigma, tamano_tesela, truncate, cancelacion)
+        return
+    verificar(cancelacion)
+    with PlanificadorTeselas(num_procesos) as planificador:
+        planificador.filtrar(entrada, salida, sigma, tamano_tesela, truncate, cancelacion)
+
+
+def filtrar_imagen_teselada(np_array, sigma=2.0, num_procesos=None,
+                            tamano_tesela=TAMANO_TESELA, truncate=TRUNCATE, planificador=None, cancelacion=None):
+    """
+    Versión en paralelo de obtener_backend().desenfocar(np_array, sigma).
+
+    El resultado es idéntico bit a bit al de un solo proceso.
+    """
+    with ArrayCompartido.desde_array(np_array) as entrada, \
+            ArrayCompartido(np_array.shape, np_array.dtype) as salida:
+        filtrar_en_memoria_compartida(entrada, salida, sigma, num_procesos, tamano_tesela, truncate, planificador,
+                                      cancelacion)
+        return salida.array.copy()
+
+
+def filtrar_partes(partes, sigma=2.0, num_procesos=None, tamano_tesela=TAMANO_TESELA, planificador=None,
+                   cancelacion=None, salida=None):
+    """
+    Filtra franjas horizontales (imágenes PIL) de una misma imagen como si fueran una sola.
+
+    Devuelve una vista de numpy por parte, todas sobre un único buffer de salida.
+    Si se pasa `salida` (un ArrayCompartido de forma forma_partes(partes) que el
+    llamador crea y cierra) las vistas son sobre ese bloque y no se copia nada;
+    hay que terminar de usarlas antes de cerrarlo. Sin `salida` el resultado se
+    copia una vez a memoria propia, porque el bloque temporal se elimina al volver
+    y una vista sobre él quedaría apuntando a memoria liberada.
+    """
+    arrays = [np.asarray(parte.convert('RGB')) for parte in partes]
+    alturas = [array.shape[0] for array in arrays]
+    shape = forma_partes(partes)
+    if salida is not None and (salida.shape != shape or salida.dtype != np.uint8):
+        raise ValueError(f"La salida debe ser uint8 de forma {shape}, no {salida.dtype} {salida.shape}")
+
+    with ArrayCompartido(shape, np.uint8) as entrada:
+        np.concatenate(arrays, out=entrada.array)
+        if salida is not None:
+            filtrar_en_memoria_compartida(entrada, salida, sigma, num_procesos, tamano_tesela, TRUNCATE,
+                                          planificador, cancelacion)
+            resultado = salida.array
+        else:
+            with ArrayCompartido(shape, np.uint8) as temporal:
+                filtrar_en_memoria_compartida(entrada, temporal, sigma, num_procesos, tamano_tesela, TRUNCATE,
+                                              planificador, cancelacion)
+                resultado = temporal.array.copy()
+    return np.split(resultado, np.cumsum(alturas)[:-1])
+
+
+def forma_partes(partes):
+    """
+    Forma (alto, ancho, 3) de la imagen RGB que arman las franjas una debajo de la otra.
+    """
+    return (sum(parte.height for parte in partes), partes[0].width, 3)
+
+
+def partes_con_halo(partes, sigma=2.0, truncate=TRUNCATE):
+    """
+    Franjas horizontales (imágenes PIL) de una misma imagen, en RGB, cada una con
+    las filas vecinas que necesita el desenfoque (como dividir_imagen del punto 2).
+
+    Devuelve las regiones y, para cada una, el rango de filas propias: desenfocar
+    una región y quedarse con ese rango da lo mismo que desenfocar la imagen
+    completa, sin costuras entre partes.
+    """
+    entrada = np.concatenate([np.asarray(parte.convert('RGB')) for parte in partes])
+    halo = calcular_halo(sigma, truncate)
+    regiones, recortes = [], []
+    top = 0
+    for parte in partes:
+        bottom = top + parte.height
+        h_top, h_bottom = max(top - halo, 0), min(bottom + halo, entrada.shape[0])
+        regiones.append(entrada[h_top:h_bottom])
+        recortes.append((top - h_top, bottom - h_top))
+        top = bottom
+    return regiones, recortes
+
+
+def combinar_vistas(partes):
+    """
+    Devuelve el array completo detrás de las partes.
+
+    Si son vistas consecutivas de un mismo buffer (como las de filtrar_partes) no se
+    copia nada; si no, se concatenan.
+    """
+    base = partes[0].base
+    if base is not None and all(parte.base is base for parte in partes):
+        inicio = base.__array_interface__['data'][0]
+        for parte in partes:
+            if parte.__array_interface__['data'][0] != inicio or not parte.flags['C_CONTIGUOUS']:
+                break
+            inicio += parte.nbytes
+        else:
+            if inicio == base.__array_interface__['data'][0] + base.nbytes:
+                return base
+    return np.concatenate(partes)
@@ -0,0 +1,331 @@
+# cadena.py
+#
+# Cadenas de operaciones declarativas ("gray|scale:0.7|blur:2|png") compiladas
+# a un plan que se ejecuta por bandas horizontales: cada banda de la salida
+# pasa por todas las operaciones y se codifica antes de empezar la siguiente,
+# así que no se materializa ninguna imagen intermedia completa.
+
+import io
+import os
+import sys
+import math
+import zlib
+import struct
+from functools import lru_cache
+import numpy as np
+from PIL import Image
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tp1.backends import obtener_backend
+from tp1.blur_teselado import calcular_halo
+from tp1.cancelacion import verificar
+from tp1.pool_persistente import parsear_operaciones
+
+# Último paso de la cadena: formato de salida (por defecto PNG)
+FORMATOS = {'png': 'PNG', 'jpeg': 'JPEG', 'jpg': 'JPEG'}
+EXTENSIONES = {'PNG': '.png', 'JPEG': '.jpg'}
+PASOS_POR_BANDAS = ('gray', 'rgb', 'blur', 'scale')
+# Filas de salida por banda; con halos grandes se agranda para no repetir tanto trabajo
+FILAS_BANDA = 64
+# Radio (en píxeles de entrada al reducir) del filtro bicúbico que usa resize() por defecto
+SOPORTE_ESCALADO = 2.0
+SIGMA_POR_DEFECTO = 2.0
+# Límites para las cadenas que manda un cliente: con sigma 50 el halo es de 200
+# filas; el producto de los factores de escala no puede pasar de MAX_ESCALA
+MAX_SIGMA = 50.0
+MAX_ESCALA = 4.0
+NIVEL_PNG = 6
+CALIDAD_JPEG = 90
+
+
+def _sigma(paso):
+    return float(paso[1]) if len(paso) > 1 else SIGMA_POR_DEFECTO
+
+
+def validar(pasos):
+    """
+    Levanta ValueError si algún paso no se puede ejecutar por bandas o tiene parámetros inválidos.
+    """
+    escala = 1.0
+    for paso in pasos:
+        if paso[0] not in PASOS_POR_BANDAS:
+            raise ValueError(f"La operación {paso[0]} no se puede ejecutar por bandas")
+        if paso[0] == 'scale':
+            if len(paso) < 2 or not paso[1] > 0:
+                raise ValueError("scale necesita un factor positivo (scale:0.7)")
+            escala *= paso[1]
+            if paso[1] > MAX_ESCALA or escala > MAX_ESCALA:
+                raise ValueError(f"La escala total no puede pasar de {MAX_ESCALA:g}")
+        if paso[0] == 'blur' and not 0 <= _sigma(paso) <= MAX_SIGMA:
+            raise ValueError(f"El sigma de blur tiene que estar entre 0 y {MAX_SIGMA:g}")
+
+
+def _reescribir(a, b):
+    """
+    Reemplazo para dos pasos consecutivos, o None si se dejan como están.
+    """
+    if b[0] == 'gray' and a[0] in ('scale', 'blur'):
+        return [b, a]
+    if a[0] == 'blur' and b[0] == 'scale' and b[1] < 1:
+        return [b, ('blur', _sigma(a) * b[1])]
+    if a[0] == b[0] == 'blur':
+        return [('blur', math.hypot(_sigma(a), _sigma(b)))]
+    if a[0] == b[0] and a[0] in ('gray', 'rgb'):
+        return [a]
+    return None
+
+
+def optimizar(pasos):
+    """
+    Reordena y fusiona pasos donde el resultado es el mismo salvo redondeos:
+
+    - gray antes de scale y blur: los dos son lineales y se aplican por canal,
+      así que conmutan con la mezcla de canales, y después se procesa un canal
+      en lugar de tres.
+    - blur:s seguido de scale:f con f < 1 pasa a scale:f seguido de blur:s*f;
+      desenfocar la imagen ya reducida cuesta 1/f² menos (el resultado es
+      aproximado: cambia un poco cerca de los bordes).
+    - blur:a|blur:b es blur:hypot(a, b); gray y rgb repetidos se eliminan.
+
+    Dos scale seguidos no se fusionan: cada uno trunca su tamaño de salida y
+    scale:a*b puede dar una fila o columna más (517x389 con scale:0.7|scale:0.7
+    da 252 filas; con scale:0.49, 253).
+    """
+    pasos = [tuple(paso) for paso in pasos]
+    cambiado = True
+    while cambiado:
+        cambiado = False
+        for i in range(len(pasos) - 1):
+            reemplazo = _reescribir(pasos[i], pasos[i + 1])
+            if reemplazo is not None:
+                pasos[i:i + 2] = reemplazo
+                cambiado = True
+                break
+    return [paso for paso in pasos if not (paso[0] == 'scale' and paso[1] == 1 or
+                                           paso[0] == 'blur' and _sigma(paso) == 0)]
+
+
+class _EscritorPNG:
+    """
+    Codificador PNG incremental: recibe la imagen de a bandas de filas y va
+    escribiendo los bloques IDAT en fp. Usa el filtro "Up" en todas las filas
+    (cada fila menos la anterior), que se calcula con numpy sobre la banda.
+    """
+
+    TIPOS_COLOR = {1: 0, 3: 2, 4: 6}
+
+    def __init__(self, fp, ancho, alto, canales, nivel=NIVEL_PNG):
+        self.fp = fp
+        self.compresor = zlib.compressobj(nivel)
+        self.anterior = np.zeros(ancho * canales, dtype=np.uint8)
+        fp.write(b'\x89PNG\r\n\x1a\n')
+        self._bloque(b'IHDR', struct.pack('>IIBBBBB', ancho, alto, 8, self.TIPOS_COLOR[canales], 0, 0, 0))
+
+    def _bloque(self, tipo, datos):
+        self.fp.write(struct.pack('>I', len(datos)) + tipo)
+        self.fp.write(datos)
+        self.fp.write(struct.pack('>I', zlib.crc32(datos, zlib.crc32(tipo))))
+
+    def filas(self, banda):
+        filas = banda.reshape(banda.shape[0], -1)
+        filtradas = np.empty((filas.shape[0], filas.shape[1] + 1), dtype=np.uint8)
+        filtradas[:, 0] = 2
+        np.subtract(filas[0], self.anterior, out=filtradas[0, 1:])
+        np.subtract(filas[1:], filas[:-1], out=filtradas[1:, 1:])
+        self.anterior = filas[-1].copy()
+        comprimido = self.compresor.compress(filtradas)
+        if comprimido:
+            self._bloque(b'IDAT', comprimido)
+
+    def terminar(self):
+        self._bloque(b'IDAT', self.compresor.flush())
+        self._bloque(b'IEND', b'')
+
+
+class PlanCadena:
+    """
+    Pasos ya optimizados de una cadena y su formato de salida.
+
+    Se ejecuta por bandas de filas de la salida: para cada banda se calcula,
+    de atrás hacia adelante, qué filas necesita cada paso (el halo del blur, el
+    soporte del filtro de scale), se recortan esas filas de la fuente y se
+    pasan por todos los pasos. Los bordes de banda no cambian el resultado: el
+    blur es idéntico bit a bit y scale difiere a lo sumo en 1 nivel por
+    redondeos. scale usa siempre el resize() de PIL, que acepta una región
+    de la fuente; gray y blur pasan por el backend.
+    """
+
+    def __init__(self, pasos, formato='PNG', opciones=None):
+        validar(pasos)
+        self.pasos = list(pasos)
+        self.formato = formato
+        self.opciones = opciones or {}
+
+    @property
+    def canonica(self):
+        """
+        Texto de la cadena ya optimizada (sirve como clave de cache).
+        """
+        pasos = [paso[0] + (':' + ','.join(f"{p:g}" for p in paso[1:]) if len(paso) > 1 else '')
+                 for paso in self.pasos]
+        formato = self.formato.lower() + ''.join(f":{v}" for v in self.opciones.values())
+        return '|'.join(pasos + [formato])
+
+    @property
+    def extension(self):
+        return EXTENSIONES[self.formato]
+
+    def geometria(self, alto, ancho, canales):
+        """
+        (alto, ancho, canales) de la entrada y de la salida de cada paso.
+        """
+        dims = [(alto, ancho, canales)]
+        for paso in self.pasos:
+            if paso[0] == 'gray':
+                canales = 1
+            elif paso[0] == 'rgb':
+                canales = 3
+            elif paso[0] == 'scale':
+                alto, ancho = max(int(alto * paso[1]), 1), max(int(ancho * paso[1]), 1)
+            dims.append((alto, ancho, canales))
+        return dims
+
+    def _filas_banda(self):
+        halo = max([calcular_halo(_sigma(paso)) for paso in self.pasos if paso[0] == 'blur'] or [0])
+        return max(FILAS_BANDA, 4 * halo)
+
+    def _rangos(self, dims, inicio, fin):
+        # De la salida hacia la fuente: filas [a, b) que necesita cada paso
+        rangos = [(inicio, fin)]
+        for paso, (alto, _, _), (alto_salida, _, _) in zip(reversed(self.pasos), reversed(dims[:-1]),
+                                                           reversed(dims[1:])):
+            a, b = rangos[0]
+            if paso[0] == 'blur':
+                halo = calcular_halo(_sigma(paso))
+                a, b = max(a - halo, 0), min(b + halo, alto)
+            elif paso[0] == 'scale':
+                paso_y = alto / alto_salida
+                soporte = SOPORTE_ESCALADO * max(paso_y, 1.0)
+                a = max(math.floor(a * paso_y - soporte) - 1, 0)
+                b = min(math.ceil(b * paso_y + soporte) + 1, alto)
+            rangos.insert(0, (a, b))
+        return rangos
+
+    def _ejecutar_banda(self, fuente, dims, rangos):
+        backend = obtener_backend()
+        banda = fuente[rangos[0][0]:rangos[0][1]]
+        for i, paso in enumerate(self.pasos):
+            (a_entrada, _), (a, b) = rangos[i], rangos[i + 1]
+            if paso[0] == 'gray':
+                banda = backend.a_grises(banda)
+            elif paso[0] == 'rgb':
+                if banda.ndim == 2:
+                    banda = np.repeat(banda[:, :, np.newaxis], 3, axis=2)
+                elif banda.shape[2] != 3:
+                    banda = np.asarray(Image.fromarray(banda).convert('RGB'))
+            elif paso[0] == 'blur':
+                banda = backend.desenfocar(banda, _sigma(paso))[a - a_entrada:b - a_entrada]
+            elif paso[0] == 'scale':
+                (alto, ancho, _), (alto_salida, ancho_salida, _) = dims[i], dims[i + 1]
+                paso_y = alto / alto_salida
+                region = (0, a * paso_y - a_entrada, ancho, b * paso_y - a_entrada)
+                banda = np.asarray(Image.fromarray(np.ascontiguousarray(banda))
+                                   .resize((ancho_salida, b - a), box=region))
+        return banda
+
+    def bandas(self, np_array, filas_banda=None, cancelacion=None):
+        """
+        Genera (fila_inicial, banda) con la salida de a bandas de filas.
+        """
+        canales = np_array.shape[2] if np_array.ndim == 3 else 1
+        dims = self.geometria(np_array.shape[0], np_array.shape[1], canales)
+        alto_salida, ancho_salida, _ = dims[-1]
+        # El mismo límite que usa PIL contra las bombas de descompresión
+        if Image.MAX_IMAGE_PIXELS and alto_salida * ancho_salida > Image.MAX_IMAGE_PIXELS:
+            raise ValueError(f"La salida tendría {alto_salida * ancho_salida} píxeles "
+                             f"(máximo {Image.MAX_IMAGE_PIXELS})")
+        filas_banda = filas_banda or self._filas_banda()
+        for inicio in range(0, alto_salida, filas_banda):
+            verificar(cancelacion)
+            fin = min(inicio + filas_banda, alto_salida)
+            yield inicio, self._ejecutar_banda(np_array, dims, self._rangos(dims, inicio, fin))
+
+    def aplicar(self, np_array, filas_banda=None, cancelacion=None):
+        """
+        Devuelve la salida sin codificar, armada banda por banda sobre un único buffer.
+        """
+        salida = None
+        for inicio, banda in self.bandas(np_array, filas_banda, cancelacion):
+            if salida is None:
+                canales = np_array.shape[2] if np_array.ndim == 3 else 1
+                alto, ancho, _ = self.geometria(np_array.shape[0], np_array.shape[1], canales)[-1]
+                salida = np.empty((alto, ancho) + banda.shape[2:], dtype=banda.dtype)
+            salida[inicio:inicio + banda.shape[0]] = banda
+        return salida
+
+    def ejecutar(self, np_array, fp, filas_banda=None, cancelacion=None):
+        """
+        Ejecuta la cadena y escribe la imagen codificada en fp.
+
+        En PNG cada banda se codifica apenas está lista y la salida completa no
+        llega a existir; JPEG necesita la imagen entera y se codifica al final.
+        """
+        if self.formato != 'PNG':
+            salida = self.aplicar(np_array, filas_banda, cancelacion)
+            Image.fromarray(salida).save(fp, format=self.formato, quality=self.opciones.get('quality', CALIDAD_JPEG))
+            return
+        escritor = None
+        for _, banda in self.bandas(np_array, filas_banda, cancelacion):
+            if escritor is None:
+                canales = np_array.shape[2] if np_array.ndim == 3 else 1
+                alto, ancho, _ = self.geometria(np_array.shape[0], np_array.shape[1], canales)[-1]
+                escritor = _EscritorPNG(fp, ancho, alto, banda.shape[2] if banda.ndim == 3 else 1,
+                                        self.opciones.get('compress_level', NIVEL_PNG))
+            escritor.filas(banda)
+        escritor.terminar()
+
+
+@lru_cache(maxsize=128)
+def _compilar_texto(texto, reordenar):
+    return compilar(texto.split('|'), reordenar)
+
+
+def compilar(ops, reordenar=True):
+    """
+    Compila una cadena ("gray|scale:0.7|blur:2|png" o una lista de pasos) a un
+    PlanCadena. El último paso puede ser el formato de salida: png (png:nivel)
+    o jpeg (jpeg:calidad); si no está, la salida es PNG.
+    """
+    if isinstance(ops, str):
+        return _compilar_texto(ops, reordenar)
+    pasos = [op for op in ops if op]
+    formato, opciones = 'PNG', {}
+    if pasos and isinstance(pasos[-1], str) and pasos[-1].partition(':')[0].lower() in FORMATOS:
+        nombre, _, parametro = pasos.pop().partition(':')
+        formato = FORMATOS[nombre.lower()]
+        if parametro:
+            opciones['quality' if formato == 'JPEG' else 'compress_level'] = int(float(parametro))
+    pasos = parsear_operaciones(pasos)
+    validar(pasos)
+    return PlanCadena(optimizar(pasos) if reordenar else pasos, formato, opciones)
+
+
+def decodificar(data):
+    """
+    Decodifica una imagen comprimida (bytes o la ruta de un archivo) a un array
+    L o RGB, lo que aceptan los pasos.
+    """
+    image = Image.open(data if isinstance(data, str) else io.BytesIO(data))
+    image.load()
+    if image.mode not in ('L', 'RGB'):
+        image = image.convert('RGB')
+    return np.asarray(image)
+
+
+def ejecutar_cadena(ops, data, fp, cancelacion=None):
+    """
+    Decodifica `data`, le aplica la cadena `ops` (texto o PlanCadena) y escribe el resultado en fp.
+    """
+    plan = ops if isinstance(ops, PlanCadena) else compilar(ops)
+    plan.ejecutar(decodificar(data), fp, cancelacion=cancelacion)
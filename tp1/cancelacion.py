@@ -0,0 +1,132 @@
+import time
+import weakref
+from multiprocessing import shared_memory
+
+
+class TrabajoCancelado(RuntimeError):
+    """
+    El trabajo se canceló o venció su plazo antes de terminar.
+    """
+
+
+def _adjuntar_marca(nombre):
+    # Igual que _adjuntar_shm en blur_teselado: sin registrarse en el
+    # resource_tracker cuando la versión de Python lo permite
+    try:
+        return shared_memory.SharedMemory(name=nombre, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=nombre)
+
+
+def _liberar_marca(shm, propietario):
+    shm.close()
+    if propietario:
+        try:
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class TokenCancelacion:
+    """
+    Marca de cancelación que comparten quien pide un trabajo y quienes lo hacen,
+    con un plazo opcional (en segundos de time.monotonic, que es el mismo reloj
+    para todos los procesos de la máquina).
+
+    Mientras se usa en un solo proceso la marca es un byte local. La primera vez
+    que se serializa (para mandarla a un pool o por una cola) pasa a un byte de
+    multiprocessing.shared_memory, y los trabajadores se adjuntan por nombre como
+    con ArrayCompartido: cancelar() en el proceso que la creó se ve en todos.
+
+    Los trabajos la consultan entre pasos (cancelado o verificar()); lo que ya
+    está corriendo dentro de una llamada a C termina esa llamada.
+    """
+
+    def __init__(self, plazo=None, limite=None):
+        if limite is None and plazo is not None:
+            limite = time.monotonic() + plazo
+        self.limite = limite
+        self.motivo = None
+        self._marca = bytearray(1)
+        self._shm = None
+        self._liberar = None
+
+    @classmethod
+    def adjuntar(cls, descriptor):
+        """
+        Se adjunta a la marca de otro proceso a partir de su descriptor.
+        """
+        nombre, limite = descriptor
+        token = cls(limite=limite)
+        token._shm = _adjuntar_marca(nombre)
+        token._marca = token._shm.buf
+        token._liberar = weakref.finalize(token, _liberar_marca, token._shm, False)
+        return token
+
+    def descriptor(self):
+        """
+        Tupla pequeña y serializable que identifica a la marca (ver adjuntar()).
+        """
+        if self._shm is None:
+            self._shm = shared_memory.SharedMemory(create=True, size=1)
+            self._shm.buf[0] = self._marca[0]
+            self._marca = self._shm.buf
+            self._liberar = weakref.finalize(self, _liberar_marca, self._shm, True)
+        return (self._shm.name, self.limite)
+
+    def __reduce__(self):
+        return (TokenCancelacion.adjuntar, (self.descriptor(),))
+
+    @property
+    def vencido(self):
+        return self.limite is not None and time.monotonic() >= self.limite
+
+    @property
+    def cancelado(self):
+        return self._marca[0] != 0 or self.vencido
+
+    def restante(self):
+        """
+        Segundos que quedan del plazo, o None si no tiene.
+        """
+        if self.limite is None:
+            return None
+        return max(0.0, self.limite - time.monotonic())
+
+    def cancelar(self, motivo="Trabajo cancelado"):
+        if self.motivo is None:
+            self.motivo = motivo
+        self._marca[0] = 1
+
+    def verificar(self):
+        """
+        Levanta TrabajoCancelado si se canceló o venció el plazo.
+        """
+        if self._marca[0]:
+            raise TrabajoCancelado(self.motivo or "Trabajo cancelado")
+        if self.vencido:
+            raise TrabajoCancelado("Venció el plazo")
+
+    def cerrar(self):
+        """
+        Suelta la marca compartida (y la elimina si este proceso la creó).
+        """
+        if self._liberar is not None:
+            self._marca = bytearray([self._marca[0]])
+            self._liberar()
+            self._liberar = None
+            self._shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.cerrar()
+
+
+def verificar(cancelacion):
+    """
+    cancelacion.verificar() si hay token; los motores lo aceptan como opcional.
+    """
+    if cancelacion is not None:
+        cancelacion.verificar()
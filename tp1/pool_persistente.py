@@ -0,0 +1,165 @@
+import os
+import atexit
+import multiprocessing
+import numpy as np
+from PIL import Image
+from scipy.ndimage import gaussian_filter
+
+from tp1.backends import obtener_backend
+from tp1.cancelacion import verificar
+
+# Módulos que el forkserver importa una sola vez; cada trabajador nace con ellos cargados
+MODULOS_PRECARGADOS = ['numpy', 'scipy.ndimage', 'PIL.Image', 'tp1.backends', 'tp1.pool_persistente']
+
+_pool_global = None
+
+
+def parsear_operaciones(ops):
+    """
+    Normaliza las operaciones a una lista de tuplas (nombre, *parámetros).
+
+    Acepta una cadena tipo "gray|blur:2" o una lista de tuplas/cadenas.
+    """
+    if isinstance(ops, str):
+        ops = [op for op in ops.split('|') if op]
+    normalizadas = []
+    for op in ops:
+        if isinstance(op, str):
+            nombre, _, parametros = op.partition(':')
+            op = (nombre,) + tuple(float(p) for p in parametros.split(',') if p)
+        if op[0] not in OPERACIONES:
+            raise ValueError(f"Operación desconocida: {op[0]}")
+        normalizadas.append(tuple(op))
+    return normalizadas
+
+
+def _op_gray(np_array):
+    return obtener_backend().a_grises(np_array)
+
+
+def _op_rgb(np_array):
+    if np_array.ndim == 3 and np_array.shape[2] == 3:
+        return np_array
+    return np.asarray(Image.fromarray(np_array).convert('RGB'))
+
+
+def _op_blur(np_array, sigma=2.0):
+    return obtener_backend().desenfocar(np_array, sigma)
+
+
+def _op_scale(np_array, factor):
+    alto, ancho = np_array.shape[:2]
+    return obtener_backend().redimensionar(np_array, max(int(ancho * factor), 1), max(int(alto * factor), 1))
+
+
+OPERACIONES = {
+    'gray': _op_gray,
+    'rgb': _op_rgb,
+    'blur': _op_blur,
+    'scale': _op_scale,
+}
+
+
+def aplicar_operaciones(np_array, ops, cancelacion=None):
+    """
+    Aplica en orden una lista de operaciones ya normalizadas a un array.
+
+    Con un TokenCancelacion, antes de cada operación se verifica que el trabajo
+    siga vigente (si no, levanta TrabajoCancelado).
+    """
+    for nombre, *parametros in ops:
+        verificar(cancelacion)
+        np_array = OPERACIONES[nombre](np_array, *parametros)
+    return np_array
+
+
+def _inicializar_trabajador():
+    """
+    Calienta el trabajador: fuerza la carga de los módulos y de las extensiones en C.
+    """
+    gaussian_filter(np.zeros((8, 8), dtype=np.uint8), sigma=1)
+    obtener_backend().desenfocar(np.zeros((8, 8), dtype=np.uint8), 1)
+    Image.new('L', (1, 1)).convert('RGB')
+
+
+def _trabajo(np_array, ops, como_imagen, cancelacion=None):
+    resultado = aplicar_operaciones(np_array, ops, cancelacion)
+    if como_imagen:
+        return Image.fromarray(resultado)
+    return resultado
+
+
+class PoolFiltros:
+    """
+    Pool de procesos de larga vida para los filtros de tp1.
+
+    Los trabajadores se crean una vez (desde un forkserver con numpy, scipy y PIL
+    precargados) y se reutilizan entre imágenes, así que el costo por imagen es
+    básicamente el de despachar el trabajo.
+    """
+
+    def __init__(self, num_procesos=None, metodo_inicio=None):
+        if metodo_inicio is None:
+            disponibles = multiprocessing.get_all_start_methods()
+            metodo_inicio = 'forkserver' if 'forkserver' in disponibles else 'spawn'
+        contexto = multiprocessing.get_context(metodo_inicio)
+        if metodo_inicio == 'forkserver':
+            contexto.set_forkserver_preload(MODULOS_PRECARGADOS)
+
+        self.num_procesos = num_procesos or os.cpu_count() or 1
+        self._pool = contexto.Pool(processes=self.num_procesos, initializer=_inicializar_trabajador)
+
+    def submit(self, image, ops, cancelacion=None):
+        """
+        Encola una imagen (PIL o numpy) y devuelve un AsyncResult; .get() da el resultado
+        con el mismo tipo que la entrada.
+
+        Si `cancelacion` se cancela, los trabajos que no empezaron se descartan al
+        tomarlos y los que están corriendo paran antes de su próxima operación;
+        .get() levanta TrabajoCancelado.
+        """
+        verificar(cancelacion)
+        como_imagen = isinstance(image, Image.Image)
+        np_array = np.asarray(image)
+        return self._pool.apply_async(_trabajo, (np_array, parsear_operaciones(ops), como_imagen, cancelacion))
+
+    def map(self, images, ops, cancelacion=None):
+        """
+        Procesa varias imágenes con las mismas operaciones y devuelve los resultados en orden.
+        """
+        pendientes = [self.submit(image, ops, cancelacion) for image in images]
+        return [pendiente.get() for pendiente in pendientes]
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+
+    def terminate(self):
+        self._pool.terminate()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def obtener_pool(num_procesos=None):
+    """
+    Devuelve un PoolFiltros compartido por todo el proceso, creándolo la primera vez.
+
+    Sin `num_procesos` sirve el que haya. Si se pide otra cantidad de
+    trabajadores, el pool anterior termina los trabajos que tiene encolados y
+    se reemplaza por uno del tamaño pedido.
+    """
+    global _pool_global
+    if _pool_global is not None and num_procesos and _pool_global.num_procesos != num_procesos:
+        anterior, _pool_global = _pool_global, None
+        atexit.unregister(anterior.terminate)
+        print(f"Pool de filtros: de {anterior.num_procesos} a {num_procesos} trabajadores.")
+        anterior.close()
+    if _pool_global is None:
+        _pool_global = PoolFiltros(num_procesos)
+        atexit.register(_pool_global.terminate)
+    return _pool_global
@@ -0,0 +1,93 @@
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from tp1.autoajuste import PARALELO, SECUENCIAL, TAMANOS_TESELA, Autoajuste, ModeloCosto
+
+# Constantes del orden de las que mide calibrar() en una máquina común
+CALIBRACION = {'px_s': 2e-9, 'tap_s': 1e-10, 'factor_grande': 1.5, 'byte_s': 1e-10,
+               'proceso_s': 0.02, 'tesela_s': 2e-5, 'backend': 'pil'}
+
+
+def autoajuste_calibrado(ruta, cores=4, **opciones):
+    autoajuste = Autoajuste(ruta=str(ruta), backend='pil', cores=cores, **opciones)
+    if autoajuste._estado['calibracion'] is None:
+        # Sin medir: el test no depende de la velocidad de la máquina
+        autoajuste._estado['calibracion'] = dict(CALIBRACION)
+    return autoajuste
+
+
+def test_costo_secuencial_crece_con_la_imagen_y_el_sigma():
+    modelo = ModeloCosto(CALIBRACION, cores=4)
+    chica = modelo.secuencial(256, 256, 1, 2.0)
+    assert modelo.secuencial(512, 512, 1, 2.0) > 4 * chica * 0.99
+    assert modelo.secuencial(256, 256, 3, 2.0) == pytest.approx(3 * chica, rel=0.2)
+    assert modelo.secuencial(256, 256, 1, 8.0) > chica
+
+
+def test_imagen_chica_va_en_un_proceso():
+    plan = ModeloCosto(CALIBRACION, cores=4).elegir(64, 64, 1, 2.0)
+    assert plan.modo == SECUENCIAL and plan.workers == 1
+
+
+def test_imagen_grande_se_reparte():
+    plan = ModeloCosto(CALIBRACION, cores=4).elegir(8192, 8192, 3, 4.0)
+    assert plan.modo == PARALELO
+    assert 2 <= plan.workers <= 4
+    assert plan.tamano_tesela in TAMANOS_TESELA
+
+
+def test_con_un_nucleo_no_se_reparte():
+    assert ModeloCosto(CALIBRACION, cores=1).elegir(8192, 8192, 3, 4.0).modo == SECUENCIAL
+
+
+def test_workers_fijos_y_arranque():
+    modelo = ModeloCosto(CALIBRACION, cores=8)
+    plan = modelo.elegir(8192, 8192, 3, 4.0, workers=3, arrancar=False)
+    assert plan.workers == 3
+    frio = modelo.paralelo(8192, 8192, 3, 4.0, 3, 256, arrancar=True)
+    caliente = modelo.paralelo(8192, 8192, 3, 4.0, 3, 256, arrancar=False)
+    assert frio - caliente == pytest.approx(3 * CALIBRACION['proceso_s'])
+
+
+def test_elegir_no_escribe_el_archivo(tmp_path):
+    ruta = tmp_path / 'autoajuste.json'
+    autoajuste_calibrado(ruta).elegir(4096, 4096, 3, 2.0)
+    assert not ruta.exists()
+
+
+def test_ida_y_vuelta(tmp_path):
+    ruta = tmp_path / 'cache' / 'autoajuste.json'
+    autoajuste = autoajuste_calibrado(ruta)
+    plan = autoajuste.elegir(4096, 4096, 3, 2.0)
+    autoajuste.guardar_si_cambio()
+    assert ruta.exists()
+    # Sin temporales a medio escribir
+    assert os.listdir(ruta.parent) == ['autoajuste.json']
+
+    otra = Autoajuste(ruta=str(ruta), backend='pil', cores=4)
+    assert otra._estado['calibracion'] == CALIBRACION
+    assert otra.elegir(4096, 4096, 3, 2.0) == plan
+    assert not otra._cambios
+
+
+def test_archivo_de_otra_maquina_se_descarta(tmp_path):
+    ruta = tmp_path / 'autoajuste.json'
+    autoajuste = autoajuste_calibrado(ruta, cores=4)
+    autoajuste.elegir(4096, 4096, 3, 2.0)
+    autoajuste.guardar()
+    assert Autoajuste(ruta=str(ruta), backend='pil', cores=2)._estado['calibracion'] is None
+
+
+def test_archivo_corrupto_se_ignora(tmp_path):
+    ruta = tmp_path / 'autoajuste.json'
+    ruta.write_text('{"maquina": ')
+    autoajuste = Autoajuste(ruta=str(ruta), backend='pil', cores=4)
+    assert autoajuste._estado['planes'] == {}
+    autoajuste._estado['calibracion'] = dict(CALIBRACION)
+    autoajuste.guardar()
+    assert json.loads(ruta.read_text())['calibracion'] == CALIBRACION
@@ -0,0 +1,70 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from tp1 import backends
+from tp1.backends import _imagen_de_prueba, obtener_backend, verificar_equivalencia
+
+pytestmark = pytest.mark.skipif(backends.cv2 is None, reason="opencv-python no está instalado")
+
+
+def diferencia(a, b):
+    d = np.abs(a.astype(np.int16) - b.astype(np.int16))
+    return int(d.max()), float(d.mean())
+
+
+@pytest.mark.parametrize("lado", [64, 301, 517])
+@pytest.mark.parametrize("semilla", [0, 1])
+def test_equivalencia_dentro_de_tolerancia(lado, semilla):
+    informe = verificar_equivalencia(lado=lado, semilla=semilla)
+    fuera = {operacion: r for operacion, r in informe.items() if not r['ok']}
+    assert not fuera
+
+
+def test_grises():
+    imagen = _imagen_de_prueba(301, 0)
+    maximo, media = diferencia(obtener_backend('pil').a_grises(imagen), obtener_backend('cv2').a_grises(imagen))
+    assert maximo <= 1
+    assert media <= 0.05
+
+
+@pytest.mark.parametrize("sigma", [0.8, 2.0, 5.0])
+def test_desenfoque(sigma):
+    imagen = _imagen_de_prueba(301, 0)
+    for entrada in (imagen, obtener_backend('pil').a_grises(imagen)):
+        maximo, media = diferencia(obtener_backend('pil').desenfocar(entrada, sigma),
+                                   obtener_backend('cv2').desenfocar(entrada, sigma))
+        assert maximo <= 2
+        assert media <= 1.1
+
+
+def test_desenfoque_no_mezcla_canales():
+    # Un solo canal con valor: si el desenfoque mezclara canales, los otros dejarían de ser 0
+    imagen = np.zeros((64, 64, 3), dtype=np.uint8)
+    imagen[..., 1] = 200
+    for nombre in ('pil', 'cv2'):
+        resultado = obtener_backend(nombre).desenfocar(imagen, 3.0)
+        assert resultado[..., 0].max() == 0
+        assert resultado[..., 2].max() == 0
+
+
+@pytest.mark.parametrize("factor, maximo_esperado", [(0.5, 5), (0.7, 4), (1.5, 3), (2.0, 3)])
+def test_redimension(factor, maximo_esperado):
+    gris = obtener_backend('pil').a_grises(_imagen_de_prueba(301, 0))
+    lado = int(301 * factor)
+    a = obtener_backend('pil').redimensionar(gris, lado, lado)
+    b = obtener_backend('cv2').redimensionar(gris, lado, lado)
+    assert a.shape == b.shape == (lado, lado)
+    maximo, media = diferencia(a, b)
+    assert maximo <= maximo_esperado
+    assert media <= 0.75
+
+
+def test_tolerancias_detectan_regresion():
+    # Con una tolerancia apenas por debajo de lo medido la comparación tiene que fallar
+    informe = verificar_equivalencia(tolerancias={'redimension': (3, 0.75)})
+    assert not informe['redimension']['ok']
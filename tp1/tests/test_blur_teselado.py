@@ -0,0 +1,67 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+from PIL import Image
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from tp1.backends import obtener_backend
+from tp1.blur_teselado import (ArrayCompartido, PlanificadorTeselas, combinar_vistas, filtrar_imagen_teselada,
+                               filtrar_partes, forma_partes)
+
+# Medidas que no son múltiplo de las teselas, así la última fila y columna quedan cortas
+ALTO, ANCHO = 157, 121
+
+
+@pytest.fixture(scope='module')
+def planificador():
+    with PlanificadorTeselas(2) as planificador:
+        yield planificador
+
+
+def imagen_de_prueba(semilla=0):
+    rng = np.random.default_rng(semilla)
+    return rng.integers(0, 256, (ALTO, ANCHO, 3), dtype=np.uint8)
+
+
+def franjas(np_array, cortes):
+    imagen = Image.fromarray(np_array)
+    limites = [0] + list(cortes) + [imagen.height]
+    return [imagen.crop((0, top, imagen.width, bottom)) for top, bottom in zip(limites, limites[1:])]
+
+
+@pytest.mark.parametrize("sigma", [0.5, 2.0, 5.0])
+@pytest.mark.parametrize("tamano_tesela", [16, 50, 128, 512])
+def test_teselado_igual_a_la_imagen_completa(planificador, sigma, tamano_tesela):
+    imagen = imagen_de_prueba()
+    esperada = obtener_backend().desenfocar(imagen, sigma)
+    teselada = filtrar_imagen_teselada(imagen, sigma, tamano_tesela=tamano_tesela, planificador=planificador)
+    assert np.array_equal(teselada, esperada)
+
+
+@pytest.mark.parametrize("cortes", [[40], [1, 80, 150], [30, 60, 90, 120]])
+def test_partes_iguales_a_la_imagen_completa(planificador, cortes):
+    imagen = imagen_de_prueba(1)
+    esperada = obtener_backend().desenfocar(imagen, 3.0)
+    partes = filtrar_partes(franjas(imagen, cortes), 3.0, tamano_tesela=32, planificador=planificador)
+    assert [parte.shape[0] for parte in partes] == [parte.height for parte in franjas(imagen, cortes)]
+    assert np.array_equal(np.concatenate(partes), esperada)
+
+
+def test_partes_son_vistas_sobre_la_salida_del_llamador(planificador):
+    imagen = imagen_de_prueba(2)
+    partes_imagen = franjas(imagen, [50, 100])
+    with ArrayCompartido(forma_partes(partes_imagen), np.uint8) as salida:
+        partes = filtrar_partes(partes_imagen, 2.0, tamano_tesela=64, planificador=planificador, salida=salida)
+        assert all(np.shares_memory(parte, salida.array) for parte in partes)
+        assert combinar_vistas(partes) is salida.array
+        assert np.array_equal(salida.array, obtener_backend().desenfocar(imagen, 2.0))
+
+
+def test_salida_de_otra_forma_se_rechaza(planificador):
+    partes_imagen = franjas(imagen_de_prueba(), [50])
+    with ArrayCompartido((ALTO + 1, ANCHO, 3), np.uint8) as salida:
+        with pytest.raises(ValueError):
+            filtrar_partes(partes_imagen, 2.0, planificador=planificador, salida=salida)
@@ -0,0 +1,129 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+from PIL import Image
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from tp1.tp1_punto1 import LectorMapeado, LectorPNG, abrir_lector, iterar_teselas
+
+# Medidas que no son múltiplo de las teselas, así la última fila y columna quedan cortas
+ALTO, ANCHO = 53, 37
+CANALES = {'L': 1, 'LA': 2, 'RGB': 3, 'RGBA': 4}
+
+
+def imagen_de_prueba(modo, semilla=0):
+    """
+    Gradientes con ruido: PIL elige distintos filtros de fila al guardar en PNG.
+    """
+    rng = np.random.default_rng(semilla)
+    base = np.add.outer(np.arange(ALTO) * 3, np.arange(ANCHO) * 5) % 256
+    if modo == 'P':
+        imagen = Image.fromarray(base.astype(np.uint8)).convert('P', palette=Image.ADAPTIVE, colors=50)
+        imagen.info['transparency'] = 3
+        return imagen
+    capas = [(base + 40 * c + rng.integers(0, 30, base.shape)) % 256 for c in range(CANALES[modo])]
+    arreglo = np.stack(capas, axis=-1).astype(np.uint8)
+    return Image.fromarray(arreglo[:, :, 0] if modo == 'L' else arreglo, modo)
+
+
+def comparar_con_pil(ruta, **opciones):
+    referencia = Image.open(ruta)
+    referencia.load()
+    cajas = []
+    for caja, parte in iterar_teselas(ruta, **opciones):
+        esperada = referencia.crop(caja)
+        assert parte.mode == esperada.mode
+        assert parte.size == esperada.size
+        assert np.array_equal(np.asarray(parte), np.asarray(esperada)), caja
+        cajas.append(caja)
+    # Las teselas cubren la imagen entera, sin huecos ni solapamientos
+    assert sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in cajas) == referencia.width * referencia.height
+
+
+@pytest.mark.parametrize("modo", ['L', 'LA', 'RGB', 'RGBA', 'P'])
+@pytest.mark.parametrize("nivel", [0, 1, 9])
+def test_png_por_bandas(tmp_path, modo, nivel):
+    ruta = str(tmp_path / f'imagen_{modo}.png')
+    imagen_de_prueba(modo).save(ruta, compress_level=nivel)
+    assert isinstance(abrir_lector(ruta), LectorPNG)
+    comparar_con_pil(ruta, alto_tesela=7, ancho_tesela=13)
+    comparar_con_pil(ruta, n_partes=4)
+
+
+def test_png_paleta_conserva_transparencia(tmp_path):
+    ruta = str(tmp_path / 'paleta.png')
+    imagen_de_prueba('P').save(ruta)
+    partes = [parte for _, parte in iterar_teselas(ruta, alto_tesela=10)]
+    assert all(parte.info.get('transparency') == 3 for parte in partes)
+    assert partes[0].getpalette() == Image.open(ruta).getpalette()
+
+
+@pytest.mark.parametrize("modo, extension", [
+    ('RGB', 'bmp'), ('L', 'bmp'), ('RGBA', 'bmp'),
+    ('RGB', 'ppm'), ('L', 'pgm'),
+    ('RGB', 'tif'), ('L', 'tif'), ('RGBA', 'tif'),
+])
+def test_formatos_sin_comprimir_mapeados(tmp_path, modo, extension):
+    ruta = str(tmp_path / f'imagen_{modo}.{extension}')
+    imagen_de_prueba(modo).save(ruta)
+    assert isinstance(abrir_lector(ruta), LectorMapeado)
+    comparar_con_pil(ruta, alto_tesela=7, ancho_tesela=13)
+    comparar_con_pil(ruta, n_partes=3)
+
+
+def test_crudo_con_offset(tmp_path):
+    arreglo = np.asarray(imagen_de_prueba('RGB'))
+    ruta = str(tmp_path / 'imagen.raw')
+    with open(ruta, 'wb') as f:
+        f.write(b'cabecera')
+        f.write(arreglo.tobytes())
+    lector = abrir_lector(ruta, dimensiones_raw=(ANCHO, ALTO, 'RGB', len(b'cabecera')))
+    assert isinstance(lector, LectorMapeado)
+    assert np.array_equal(lector.leer(5, 11, 30, 40), arreglo[11:40, 5:30])
+
+
+def test_tiff_comprimido_no_se_mapea(tmp_path):
+    ruta = str(tmp_path / 'comprimida.tif')
+    imagen_de_prueba('RGB').save(ruta, compression='tiff_deflate')
+    assert not isinstance(abrir_lector(ruta), LectorMapeado)
+    comparar_con_pil(ruta, alto_tesela=7, ancho_tesela=13)
+
+
+def png_truncado(tmp_path, corte, imagen=None):
+    ruta = tmp_path / 'imagen.png'
+    (imagen or imagen_de_prueba('RGB')).save(ruta, compress_level=0)
+    contenido = ruta.read_bytes()
+    truncada = tmp_path / 'truncada.png'
+    truncada.write_bytes(contenido[:corte(contenido)])
+    return str(truncada)
+
+
+@pytest.mark.parametrize("corte", [
+    lambda contenido: 12,                               # en la cabecera de IHDR
+    lambda contenido: 20,                               # en los datos de IHDR
+    lambda contenido: contenido.index(b'IDAT') - 2,     # en la cabecera de IDAT
+])
+def test_png_truncado_antes_de_los_datos(tmp_path, corte):
+    with pytest.raises(ValueError, match="truncado"):
+        LectorPNG(png_truncado(tmp_path, corte))
+
+
+def test_png_truncado_en_los_datos(tmp_path):
+    lector = LectorPNG(png_truncado(tmp_path, lambda contenido: len(contenido) // 2))
+    with pytest.raises(ValueError, match="truncado"):
+        for _ in lector.bandas([(fila, fila + 1) for fila in range(ALTO)]):
+            pass
+
+
+def test_png_truncado_entre_chunks_idat(tmp_path):
+    # Sin comprimir, PIL reparte los datos en varios chunks IDAT; se corta en la cabecera del segundo
+    imagen = Image.fromarray(np.random.default_rng(0).integers(0, 256, (200, 200, 3), dtype=np.uint8))
+    ruta = png_truncado(tmp_path, lambda contenido: contenido.index(b'IDAT', contenido.index(b'IDAT') + 4) - 2,
+                        imagen)
+    lector = LectorPNG(ruta)
+    with pytest.raises(ValueError, match="cabecera"):
+        for _ in lector.bandas([(fila, fila + 10) for fila in range(0, 200, 10)]):
+            pass
@@ -1,34 +1,367 @@
 from PIL import Image
+import numpy as np
+import struct
+import zlib
+import io
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+FIRMA_PNG = b'\x89PNG\r\n\x1a\n'
+TAMANO_LECTURA = 1024 * 1024
+
+# formato -> (formato de PIL, extensión); None guarda el array con np.save
+FORMATOS = {
+    'png': ('PNG', '.png'),
+    'jpeg': ('JPEG', '.jpg'),
+    'webp': ('WEBP', '.webp'),
+    'npy': (None, '.npy'),
+}
+
+# Modos crudos que se pueden mapear con numpy: modo de salida, bytes por píxel y
+# canales a tomar (None = todos, en orden)
+MODOS_CRUDOS = {
+    'L': ('L', 1, None),
+    'RGB': ('RGB', 3, None),
+    'RGBA': ('RGBA', 4, None),
+    'RGBX': ('RGB', 4, [0, 1, 2]),
+    'BGR': ('RGB', 3, [2, 1, 0]),
+    'BGRX': ('RGB', 4, [2, 1, 0]),
+    'BGRA': ('RGBA', 4, [2, 1, 0, 3]),
+}
+
+
+def limites(total, tamano=None, n_partes=None):
+    """
+    Devuelve los intervalos [inicio, fin) que cubren `total`: de a `tamano`, o en
+    `n_partes` iguales con el resto en la última.
+    """
+    if tamano is None:
+        n_partes = n_partes or 1
+        paso = total // n_partes
+        return [(i * paso, (i + 1) * paso if i < n_partes - 1 else total) for i in range(n_partes)]
+    return [(inicio, min(inicio + tamano, total)) for inicio in range(0, total, tamano)]
+
+
+class LectorMapeado:
+    """
+    Lee regiones de una imagen sin comprimir directamente del archivo con np.memmap.
+
+    `fuentes` es una lista de (caja, offset, modo crudo, stride, orientación), una
+    por tira o tesela del archivo. Leer una región solo toca las páginas de las
+    fuentes que la cruzan.
+    """
+
+    def __init__(self, ruta, ancho, alto, fuentes):
+        self.ruta = ruta
+        self.ancho = ancho
+        self.alto = alto
+        self.fuentes = fuentes
+        self.modo, _, _ = MODOS_CRUDOS[fuentes[0][2]]
+
+    def leer(self, izquierda, arriba, derecha, abajo):
+        canales = len(self.modo)
+        salida = np.empty((abajo - arriba, derecha - izquierda, canales), dtype=np.uint8)
+        for (x0, y0, x1, y1), offset, modo_crudo, stride, orientacion in self.fuentes:
+            ax, ay, bx, by = max(x0, izquierda), max(y0, arriba), min(x1, derecha), min(y1, abajo)
+            if ax >= bx or ay >= by:
+                continue
+            _, bpp, indices = MODOS_CRUDOS[modo_crudo]
+            stride = stride or (x1 - x0) * bpp
+            mapa = np.memmap(self.ruta, dtype=np.uint8, mode='r', offset=offset, shape=(y1 - y0, stride))
+            if orientacion < 0:
+                # Filas guardadas de abajo hacia arriba (BMP)
+                filas = mapa[(y1 - y0) - (by - y0):(y1 - y0) - (ay - y0)][::-1]
+            else:
+                filas = mapa[ay - y0:by - y0]
+            pixeles = filas[:, (ax - x0) * bpp:(bx - x0) * bpp].reshape(by - ay, bx - ax, bpp)
+            if indices is not None:
+                pixeles = pixeles[:, :, indices]
+            salida[ay - arriba:by - arriba, ax - izquierda:bx - izquierda] = pixeles
+            del mapa
+        return salida[:, :, 0] if canales == 1 else salida
+
+
+class LectorNpy:
+    """
+    Lee regiones de un .npy mapeado en memoria (alto x ancho [x canales]).
+    """
+
+    def __init__(self, ruta):
+        self.array = np.load(ruta, mmap_mode='r')
+        self.alto, self.ancho = self.array.shape[:2]
+
+    def leer(self, izquierda, arriba, derecha, abajo):
+        return np.ascontiguousarray(self.array[arriba:abajo, izquierda:derecha])
+
+
+class LectorPNG:
+    """
+    Decodifica un PNG de a bandas horizontales, sin tener nunca la imagen entera.
+
+    Descomprime el flujo IDAT a medida que lo necesita y, para cada banda, arma un
+    PNG chico con esas filas (precedidas por la última fila ya decodificada, que
+    los filtros Sub/Up/Average/Paeth usan como referencia) y lo decodifica con PIL.
+    Solo sirve para PNG sin entrelazar de 8 bits por canal.
+    """
+
+    CANALES = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self.auxiliares = []
+        self.ihdr = None
+        with open(ruta, 'rb') as f:
+            if f.read(8) != FIRMA_PNG:
+                raise ValueError("No es un PNG")
+            while True:
+                largo, tipo = self._leer_cabecera(f)
+                if tipo == b'IDAT':
+                    self.inicio_idat = f.tell() - 8
+                    break
+                datos = f.read(largo)
+                if len(datos) < largo:
+                    raise ValueError(f"PNG truncado: al chunk {tipo!r} le faltan {largo - len(datos)} bytes")
+                f.read(4)
+                if tipo == b'IHDR':
+                    self.ihdr = datos
+                elif tipo in (b'PLTE', b'tRNS'):
+                    self.auxiliares.append((tipo, datos))
+        if self.ihdr is None or len(self.ihdr) != 13:
+            raise ValueError("PNG inválido: falta el chunk IHDR o está mal formado")
+        (self.ancho, self.alto, profundidad, tipo_color,
+         _, _, entrelazado) = struct.unpack('!IIBBBBB', self.ihdr)
+        if profundidad != 8 or entrelazado:
+            raise ValueError("Solo PNG de 8 bits sin entrelazar")
+        self.bytes_fila = self.ancho * self.CANALES[tipo_color]
+
+    @staticmethod
+    def _leer_cabecera(f):
+        """
+        Lee el largo y el tipo del próximo chunk.
+        """
+        cabecera = f.read(8)
+        if len(cabecera) < 8:
+            raise ValueError(f"PNG truncado: se esperaba la cabecera de un chunk en el byte {f.tell() - len(cabecera)}")
+        return struct.unpack('!I4s', cabecera)
+
+    @staticmethod
+    def _chunk(tipo, datos):
+        return struct.pack('!I', len(datos)) + tipo + datos + struct.pack('!I', zlib.crc32(tipo + datos))
+
+    def _idat(self):
+        """
+        Genera los bytes comprimidos del flujo IDAT, de a bloques.
+        """
+        with open(self.ruta, 'rb') as f:
+            f.seek(self.inicio_idat)
+            while True:
+                largo, tipo = self._leer_cabecera(f)
+                if tipo == b'IEND':
+                    return
+                if tipo != b'IDAT':
+                    f.seek(largo + 4, io.SEEK_CUR)
+                    continue
+                restante = largo
+                while restante:
+                    bloque = f.read(min(TAMANO_LECTURA, restante))
+                    if not bloque:
+                        raise ValueError("PNG truncado")
+                    restante -= len(bloque)
+                    yield bloque
+                f.read(4)
+
+    def bandas(self, filas):
+        """
+        Genera una imagen PIL por cada intervalo de filas de `filas` (en orden).
+        """
+        descompresor = zlib.decompressobj()
+        comprimido = self._idat()
+        pendiente = bytearray()
+        anterior = None
+        largo_fila = 1 + self.bytes_fila
+        for arriba, abajo in filas:
+            necesarios = (abajo - arriba) * largo_fila
+            while len(pendiente) < necesarios:
+                if descompresor.unconsumed_tail:
+                    entrada = descompresor.unconsumed_tail
+                else:
+                    entrada = next(comprimido, None)
+                    if entrada is None:
+                        raise ValueError("PNG truncado")
+                pendiente += descompresor.decompress(entrada, TAMANO_LECTURA)
+            datos = bytes(pendiente[:necesarios])
+            del pendiente[:necesarios]
+
+            alto_banda = abajo - arriba
+            if anterior is not None:
+                datos = b'\x00' + anterior + datos
+                alto_banda += 1
+            ihdr = struct.pack('!II', self.ancho, alto_banda) + self.ihdr[8:]
+            png = (FIRMA_PNG + self._chunk(b'IHDR', ihdr)
+                   + b''.join(self._chunk(tipo, contenido) for tipo, contenido in self.auxiliares)
+                   + self._chunk(b'IDAT', zlib.compress(datos, 0)) + self._chunk(b'IEND', b''))
+            banda = Image.open(io.BytesIO(png))
+            banda.load()
+            anterior = banda.crop((0, alto_banda - 1, self.ancho, alto_banda)).tobytes()
+            yield banda.crop((0, 1, self.ancho, alto_banda)) if alto_banda > abajo - arriba else banda
+
+
+class LectorPIL:
+    """
+    Último recurso: PIL decodifica la imagen entera y se recorta de a bandas.
+
+    Para JPEG, `reduccion` (2, 4 u 8) usa draft() para decodificar ya reducida.
+    """
+
+    def __init__(self, imagen, reduccion=1):
+        if reduccion > 1 and imagen.format == 'JPEG':
+            imagen.draft(imagen.mode, (imagen.width // reduccion, imagen.height // reduccion))
+        self.imagen = imagen
+        self.ancho, self.alto = imagen.size
+
+    def bandas(self, filas):
+        for arriba, abajo in filas:
+            yield self.imagen.crop((0, arriba, self.ancho, abajo))
+
+
+def _fuentes_crudas(imagen):
+    """
+    Si todas las tiras/teselas del archivo están sin comprimir en un modo que numpy
+    puede leer, devuelve su descripción para LectorMapeado; si no, None.
+    """
+    fuentes = []
+    for decodificador, caja, offset, argumentos in imagen.tile:
+        if decodificador != 'raw':
+            return None
+        if isinstance(argumentos, str):
+            argumentos = (argumentos, 0, 1)
+        modo_crudo, stride, orientacion = (tuple(argumentos) + (0, 1))[:3]
+        if modo_crudo not in MODOS_CRUDOS or MODOS_CRUDOS[modo_crudo][0] != imagen.mode:
+            return None
+        fuentes.append((caja, offset, modo_crudo, stride, orientacion))
+    modos = {MODOS_CRUDOS[f[2]][0] for f in fuentes}
+    return fuentes if len(modos) == 1 else None
+
+
+def abrir_lector(ruta_imagen, reduccion=1, dimensiones_raw=None):
+    """
+    Elige la forma más barata de leer la imagen de a partes:
+
+    - .npy: memmap.
+    - `dimensiones_raw=(ancho, alto, modo[, offset])`: archivo crudo sin cabecera, memmap.
+    - BMP, PPM y TIFF sin comprimir (en tiras o teselas): memmap de los píxeles.
+    - PNG de 8 bits sin entrelazar: decodificación de a bandas.
+    - Cualquier otro formato: PIL decodifica la imagen entera.
+    """
+    if dimensiones_raw is not None:
+        ancho, alto, modo = dimensiones_raw[:3]
+        offset = dimensiones_raw[3] if len(dimensiones_raw) > 3 else 0
+        return LectorMapeado(ruta_imagen, ancho, alto, [((0, 0, ancho, alto), offset, modo, 0, 1)])
+    if ruta_imagen.endswith('.npy'):
+        return LectorNpy(ruta_imagen)
 
-def cargar_y_dividir_imagen(ruta_imagen, n_partes):
     imagen = Image.open(ruta_imagen)
-    ancho, alto = imagen.size
-    altura_parte = alto // n_partes
-    partes = []
+    if imagen.format == 'PNG':
+        try:
+            return LectorPNG(ruta_imagen)
+        except ValueError:
+            pass
+    fuentes = _fuentes_crudas(imagen) if reduccion == 1 else None
+    if fuentes:
+        return LectorMapeado(ruta_imagen, imagen.width, imagen.height, fuentes)
+    return LectorPIL(imagen, reduccion)
+
 
-    for i in range(n_partes):
-        top = i * altura_parte
-        bottom = (i + 1) * altura_parte if i < n_partes - 1 else alto
-        parte = imagen.crop((0, top, ancho, bottom))
-        partes.append(parte)
+def iterar_teselas(ruta_imagen, alto_tesela=None, ancho_tesela=None, n_partes=None, reduccion=1,
+                   dimensiones_raw=None):
+    """
+    Genera (caja, parte) recorriendo la imagen de arriba hacia abajo y de
+    izquierda a derecha, sin cargarla entera cuando el formato lo permite.
 
-    return partes
+    Las filas se cortan cada `alto_tesela` píxeles (o en `n_partes` bandas) y las
+    columnas cada `ancho_tesela` (por defecto, el ancho completo). Con lectores
+    mapeados la memoria es la de una tesela; con PNG, la de una banda.
+    """
+    lector = abrir_lector(ruta_imagen, reduccion, dimensiones_raw)
+    filas = limites(lector.alto, alto_tesela, n_partes)
+    columnas = limites(lector.ancho, ancho_tesela)
 
-def guardar_partes(partes, ruta_salida_base):
-  
-    for i, parte in enumerate(partes):
-        ruta_salida = f'{ruta_salida_base}_parte_{i + 1}.png'
-        parte.save(ruta_salida)
-        print(f'Parte {i + 1} guardada en: {ruta_salida}')
+    if hasattr(lector, 'leer'):
+        for arriba, abajo in filas:
+            for izquierda, derecha in columnas:
+                caja = (izquierda, arriba, derecha, abajo)
+                yield caja, Image.fromarray(lector.leer(*caja))
+        return
+
+    for (arriba, abajo), banda in zip(filas, lector.bandas(filas)):
+        for izquierda, derecha in columnas:
+            caja = (izquierda, arriba, derecha, abajo)
+            yield caja, banda if len(columnas) == 1 else banda.crop((izquierda, 0, derecha, abajo - arriba))
+
+
+def cargar_y_dividir_imagen(ruta_imagen, n_partes):
+    return [parte for _, parte in iterar_teselas(ruta_imagen, n_partes=n_partes)]
+
+def guardar_parte(parte, ruta_salida, formato='png', opciones=None):
+    """
+    Codifica una parte en `formato` con las opciones del codificador de PIL
+    (compress_level para PNG, quality para JPEG/WebP, lossless para WebP...).
+    """
+    formato_pil, _ = FORMATOS[formato]
+    if formato_pil is None:
+        np.save(ruta_salida, np.asarray(parte))
+        return ruta_salida
+    if formato_pil == 'JPEG' and parte.mode not in ('L', 'RGB', 'CMYK'):
+        parte = parte.convert('RGB')
+    parte.save(ruta_salida, format=formato_pil, **(opciones or {}))
+    return ruta_salida
+
+def guardar_partes(partes, ruta_salida_base, formato='png', opciones=None, trabajadores=1, procesos=False,
+                   silencioso=False):
+    """
+    Guarda cada parte a medida que llega; `partes` puede ser un generador.
+
+    Con `trabajadores` > 1 las partes se codifican en paralelo en un pool de hilos
+    (los codificadores de PIL liberan el GIL) o de procesos si `procesos`. Nunca
+    hay más de dos partes por trabajador esperando, así un generador no se
+    consume entero antes de tiempo. Devuelve las rutas en orden. Con
+    `silencioso` no se informa cada parte guardada.
+    """
+    extension = FORMATOS[formato][1]
+    rutas = []
+
+    def terminada(i, ruta_salida):
+        rutas.append(ruta_salida)
+        if not silencioso:
+            print(f'Parte {i + 1} guardada en: {ruta_salida}')
+
+    if trabajadores <= 1:
+        for i, parte in enumerate(partes):
+            terminada(i, guardar_parte(parte, f'{ruta_salida_base}_parte_{i + 1}{extension}', formato, opciones))
+        return rutas
+
+    pool = ProcessPoolExecutor if procesos else ThreadPoolExecutor
+    with pool(max_workers=trabajadores) as ejecutor:
+        pendientes = deque()
+        for i, parte in enumerate(partes):
+            ruta_salida = f'{ruta_salida_base}_parte_{i + 1}{extension}'
+            pendientes.append((i, ejecutor.submit(guardar_parte, parte, ruta_salida, formato, opciones)))
+            while len(pendientes) >= 2 * trabajadores:
+                j, futuro = pendientes.popleft()
+                terminada(j, futuro.result())
+        while pendientes:
+            j, futuro = pendientes.popleft()
+            terminada(j, futuro.result())
+    return rutas
 
 if __name__ == "__main__":
     try:
         ruta_imagen = "/home/luciano/Escritorio/compu2/TPS/tp1/um_logo.png"
-        
+
         n_partes = int(input('Ingrese el número de partes que quiera: '))
-        partes = cargar_y_dividir_imagen(ruta_imagen, n_partes)
-        
+        partes = (parte for _, parte in iterar_teselas(ruta_imagen, n_partes=n_partes))
+
         ruta_salida_base = 'parte_imagen'
         guardar_partes(partes, ruta_salida_base)
     except Exception as e:
-        print(f"Ocurrió un error: {e}")
\ No newline at end of file
+        print(f"Ocurrió un error: {e}")
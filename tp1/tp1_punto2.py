@@ -1,49 +1,83 @@
-from scipy.ndimage import gaussian_filter
 from PIL import Image
 import numpy as np
 import multiprocessing
+import sys
+import os
 
-def procesar_imagen_desde_ruta(ruta_imagen, ruta_salida='imagen_filtrada.jpg', num_procesos=4, sigma=1):
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tp1.autoajuste import SECUENCIAL, configurar_autoajuste, obtener_autoajuste
+from tp1.backends import obtener_backend
+from tp1.cancelacion import verificar
+from tp1.blur_teselado import calcular_halo
+
+def procesar_imagen_desde_ruta(ruta_imagen, ruta_salida='imagen_filtrada.jpg', num_procesos=None, sigma=1, pool=None):
     
     # Cargar la imagen
     imagen = Image.open(ruta_imagen).convert('L')  # Convertir a escala de grises
     array_imagen = np.array(imagen)
 
     # Aplicar el filtro en paralelo
-    imagen_filtrada = procesar_imagen_en_paralelo(array_imagen, num_procesos=num_procesos, sigma=sigma)
+    imagen_filtrada = procesar_imagen_en_paralelo(array_imagen, num_procesos=num_procesos, sigma=sigma, pool=pool)
 
     # Convertir el array filtrado de nuevo a una imagen y guardarla
     imagen_filtrada_pil = Image.fromarray(imagen_filtrada)
     imagen_filtrada_pil.save(ruta_salida)
 
-def aplicar_filtro(parte_imagen, sigma=1):
-  
-    return gaussian_filter(parte_imagen, sigma=sigma)
+def aplicar_filtro(parte_imagen, sigma=1, cancelacion=None):
+    verificar(cancelacion)
+    return obtener_backend().desenfocar(parte_imagen, sigma)
+
+def dividir_imagen(imagen, num_partes, halo=0):
+    """
+    Divide la imagen en franjas horizontales que se solapan `halo` filas con sus vecinas.
 
-def dividir_imagen(imagen, num_partes):
-    altura, ancho = imagen.shape
+    Devuelve las franjas y, para cada una, el rango de filas propias (sin el halo).
+    """
+    altura = imagen.shape[0]
     altura_parte = altura // num_partes
-    partes = [imagen[i * altura_parte:(i + 1) * altura_parte] for i in range(num_partes)]
-    return partes
+    partes = []
+    recortes = []
+    for i in range(num_partes):
+        top = i * altura_parte
+        bottom = (i + 1) * altura_parte if i < num_partes - 1 else altura
+        h_top, h_bottom = max(top - halo, 0), min(bottom + halo, altura)
+        partes.append(imagen[h_top:h_bottom])
+        recortes.append((top - h_top, bottom - h_top))
+    return partes, recortes
 
-def procesar_imagen_en_paralelo(imagen, num_procesos=4, sigma=1):
-    # Dividir la imagen en partes
-    partes_imagen = dividir_imagen(imagen, num_procesos)
+def procesar_imagen_en_paralelo(imagen, num_procesos=None, sigma=1, pool=None, cancelacion=None):
+    # Sin num_procesos lo elige el autoajuste; si paralelizar no conviene, se filtra acá mismo
+    if num_procesos is None:
+        workers = pool.num_procesos if pool is not None else None
+        plan = obtener_autoajuste().elegir_para(imagen, sigma, workers, arrancar=pool is None)
+        if plan.modo == SECUENCIAL:
+            return aplicar_filtro(imagen, sigma, cancelacion)
+        num_procesos = plan.workers
 
-    
-    with multiprocessing.Pool(processes=num_procesos) as pool:
-        
-        partes_filtradas = pool.starmap(aplicar_filtro, [(parte, sigma) for parte in partes_imagen])
+    # Dividir la imagen en partes con un halo del tamaño del núcleo gaussiano,
+    # así el resultado no tiene costuras entre franjas
+    partes_imagen, recortes = dividir_imagen(imagen, num_procesos, halo=calcular_halo(sigma))
+
+    if pool is not None:
+        # Reutilizar un PoolFiltros ya caliente en lugar de crear procesos nuevos
+        partes_filtradas = pool.map(partes_imagen, [('blur', sigma)], cancelacion)
+    else:
+        verificar(cancelacion)
+        with multiprocessing.Pool(processes=num_procesos) as pool:
+            partes_filtradas = pool.starmap(aplicar_filtro, [(parte, sigma, cancelacion) for parte in partes_imagen])
 
-    # Combinar las partes filtradas
-    imagen_filtrada = np.vstack(partes_filtradas)
+    # Combinar las partes filtradas descartando el halo
+    imagen_filtrada = np.vstack([parte[inicio:fin] for parte, (inicio, fin) in zip(partes_filtradas, recortes)])
 
     return imagen_filtrada
 
 if __name__ == "__main__":
     ruta_imagen = "/home/luciano/Escritorio/compu2/TPS/tp1/um_logo.png"
-    num_procesos = 4
+    num_procesos = None  # None: lo elige el autoajuste
     sigma = 1
     ruta_salida = 'imagen_filtrada.jpg'
 
+    # Como programa, la calibración y los planes nuevos se guardan al salir
+    configurar_autoajuste(persistir=True)
     procesar_imagen_desde_ruta(ruta_imagen, ruta_salida, num_procesos, sigma)
\ No newline at end of file
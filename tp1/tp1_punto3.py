@@ -1,13 +1,16 @@
 import sys
 import os
 import numpy as np
-import multiprocessing
 from PIL import Image
-from scipy.ndimage import gaussian_filter
 
 # Agregar el directorio raíz al path (esto puede ser opcional dependiendo de tu estructura de directorios)
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+from tp1.backends import obtener_backend
+from tp1.pool_persistente import obtener_pool
+from tp1.blur_teselado import (TAMANO_TESELA, ArrayCompartido, filtrar_partes, forma_partes, combinar_vistas,
+                               partes_con_halo)
+
 def load_image(image_path):
     
     return Image.open(image_path)
@@ -24,52 +27,51 @@ def split_image(image, num_parts):
         parts.append(part)
     return parts
 
-def apply_filter_to_part(part, sigma=2.0):
+def apply_filter_to_part(part, sigma=2.0, recorte=None):
     """
     Aplica un filtro de desenfoque (filtro gaussiano) a una parte de la imagen.
+
+    El desenfoque es solo espacial, como en el pool y en filtrar_partes: los
+    canales no se mezclan. `part` puede ser una región de partes_con_halo; en
+    ese caso `recorte` indica sus filas propias.
     """
-    np_array = np.array(part)
-    filtered_array = gaussian_filter(np_array, sigma=sigma)
-    filtered_image = Image.fromarray(np.uint8(filtered_array))
-    if filtered_image.mode != 'RGB':
-        filtered_image = filtered_image.convert('RGB')
-    return filtered_image
-
-def worker_function(part, sigma, pipe_send):
-    """
-    Función del trabajador que procesa una parte de la imagen y envía el resultado a través del pipe.
-    """
-    filtered_part = apply_filter_to_part(part, sigma)
-    pipe_send.send(filtered_part)
-    pipe_send.close()
+    np_array = np.asarray(part.convert('RGB')) if isinstance(part, Image.Image) else part
+    filtered_array = obtener_backend().desenfocar(np_array, sigma)
+    if recorte is not None:
+        filtered_array = filtered_array[recorte[0]:recorte[1]]
+    return Image.fromarray(filtered_array)
 
-def process_image_parts(image_parts, sigma=2.0):
+def process_image_parts(image_parts, sigma=2.0, pool=None, num_workers=None, tamano_tesela=TAMANO_TESELA,
+                        salida=None):
     """
-    Procesa cada parte de la imagen en paralelo aplicando un filtro y usa Pipes para la comunicación.
+    Procesa la imagen en paralelo repartiendo teselas pequeñas entre los trabajadores.
+
+    Por la cola solo viajan descriptores de memoria compartida y coordenadas de
+    teselas; ningún píxel se serializa. Devuelve una vista por parte sobre el mismo
+    buffer de salida: `salida` (un ArrayCompartido, ver filtrar_partes) si se pasa.
+
+    Si se pasa un PoolFiltros, las partes (con el halo de sus vecinas) se
+    despachan a sus trabajadores ya creados en lugar de lanzar procesos nuevos;
+    el resultado es el mismo. En ese caso trabajan los procesos del pool y
+    `num_workers` no se usa.
     """
-    pipes = [multiprocessing.Pipe() for _ in range(len(image_parts))]
-    processes = []
-    
-    for i, (part, (pipe_recv, pipe_send)) in enumerate(zip(image_parts, pipes)):
-        p = multiprocessing.Process(target=worker_function, args=(part, sigma, pipe_send))
-        processes.append(p)
-        p.start()
-    
-    filtered_parts = []
-    for pipe_recv, _ in pipes:
-        filtered_part = pipe_recv.recv()
-        filtered_parts.append(filtered_part)
-        pipe_recv.close()
-    
-    for p in processes:
-        p.join()
-    
-    return filtered_parts
+    if pool is not None:
+        regiones, recortes = partes_con_halo(image_parts, sigma)
+        filtradas = pool.map(regiones, [('blur', sigma)])
+        return [filtrada[inicio:fin] for filtrada, (inicio, fin) in zip(filtradas, recortes)]
+
+    return filtrar_partes(image_parts, sigma, num_workers or len(image_parts), tamano_tesela, salida=salida)
 
 def combine_image_parts(filtered_parts):
     """
     Combina las partes filtradas en una sola imagen.
+
+    Si las partes son vistas sobre el buffer de salida compartido, no hay que pegar
+    nada: la imagen se arma directamente sobre ese buffer.
     """
+    if isinstance(filtered_parts[0], np.ndarray):
+        return Image.fromarray(combinar_vistas(filtered_parts))
+
     widths, heights = zip(*(i.size for i in filtered_parts))
     total_height = sum(heights)
     
@@ -81,21 +83,25 @@ def combine_image_parts(filtered_parts):
     
     return combined_image
 
-def procesar_imagen_con_comunicacion(ruta_imagen, ruta_salida='imagen_filtrada.jpg', num_procesos=4, sigma=2.0):
+def procesar_imagen_con_comunicacion(ruta_imagen, ruta_salida='imagen_filtrada.jpg', num_procesos=4, sigma=2.0, pool=None):
   
     imagen = load_image(ruta_imagen)
     
     partes_imagen = split_image(imagen, num_procesos)
 
-    partes_filtradas = process_image_parts(partes_imagen, sigma)
+    if pool is not None:
+        partes_filtradas = process_image_parts(partes_imagen, sigma, pool)
+        combine_image_parts(partes_filtradas).save(ruta_salida)
+        return
 
-    imagen_combinada = combine_image_parts(partes_filtradas)
-    
-    imagen_combinada.save(ruta_salida)
+    # Las partes son vistas sobre este bloque: se guarda la imagen antes de liberarlo
+    with ArrayCompartido(forma_partes(partes_imagen), np.uint8) as salida:
+        partes_filtradas = process_image_parts(partes_imagen, sigma, salida=salida)
+        combine_image_parts(partes_filtradas).save(ruta_salida)
 
 if __name__ == "__main__":
     ruta_imagen = "/home/luciano/Escritorio/compu2/TPS/tp1/um_logo.png"
     num_procesos = 2
     sigma = 2.0
     ruta_salida = 'imagen_filtrada.jpg'
-    procesar_imagen_con_comunicacion(ruta_imagen, ruta_salida, num_procesos, sigma)
\ No newline at end of file
+    procesar_imagen_con_comunicacion(ruta_imagen, ruta_salida, num_procesos, sigma, pool=obtener_pool(num_procesos))
\ No newline at end of file
@@ -1,19 +1,28 @@
+import sys
+import os
 import signal
 import time
-import multiprocessing
 from PIL import Image
 import numpy as np
-from scipy.ndimage import gaussian_filter
 
-interrupted = False
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tp1.autoajuste import SECUENCIAL, configurar_autoajuste, obtener_autoajuste
+from tp1.backends import obtener_backend
+from tp1.blur_teselado import (TAMANO_TESELA, ArrayCompartido, filtrar_partes, forma_partes, combinar_vistas,
+                               partes_con_halo)
+from tp1.cancelacion import TokenCancelacion, TrabajoCancelado
+
+# Token de la corrida en curso: SIGINT lo cancela y lo ven también los
+# trabajadores, que dejan de procesar partes y teselas
+cancelacion = TokenCancelacion()
 
 def signal_handler(sig, frame):
     """
     Maneja la señal de interrupción (SIGINT) para permitir una interrupción controlada.
     """
-    global interrupted
     print('Interrupción recibida. Finalizando...')
-    interrupted = True
+    cancelacion.cancelar('Interrupción recibida')
 
 def load_image(image_path):
    
@@ -31,76 +40,85 @@ def split_image(image, num_parts):
         parts.append(part)
     return parts
 
-def apply_filter_to_part(part, sigma=2.0):
+def apply_filter_to_part(part, sigma=2.0, recorte=None):
     """
     Aplica un filtro de desenfoque (filtro gaussiano) a una parte de la imagen.
+
+    El desenfoque es solo espacial, como en el pool y en filtrar_partes: los
+    canales no se mezclan. `part` puede ser una región de partes_con_halo; en
+    ese caso `recorte` indica sus filas propias.
     """
-    np_array = np.array(part)
-    filtered_array = gaussian_filter(np_array, sigma=sigma)
-    filtered_image = Image.fromarray(np.uint8(filtered_array))
-    if filtered_image.mode != 'RGB':
-        filtered_image = filtered_image.convert('RGB')
-    return filtered_image
-
-def worker_function(part, sigma, pipe_send):
+    np_array = np.asarray(part.convert('RGB')) if isinstance(part, Image.Image) else part
+    filtered_array = obtener_backend().desenfocar(np_array, sigma)
+    if recorte is not None:
+        filtered_array = filtered_array[recorte[0]:recorte[1]]
+    return Image.fromarray(filtered_array)
+
+def process_image_parts_parallel(image_parts, sigma=2.0, pool=None, num_workers=None, tamano_tesela=TAMANO_TESELA,
+                                 token=None, salida=None):
     """
-    Función del trabajador que procesa una parte de la imagen y envía el resultado a través del pipe.
+    Procesa la imagen en paralelo repartiendo teselas pequeñas entre los trabajadores.
+
+    Por la cola solo viajan descriptores de memoria compartida y coordenadas de
+    teselas; ningún píxel se serializa. Devuelve una vista por parte sobre el mismo
+    buffer de salida: `salida` (un ArrayCompartido, ver filtrar_partes) si se pasa.
+
+    Si se pasa un PoolFiltros, las partes (con el halo de sus vecinas) se
+    despachan a sus trabajadores ya creados en lugar de lanzar un proceso nuevo
+    por parte; el resultado es el mismo. En ese caso trabajan los procesos del
+    pool y `num_workers` no se usa.
+
+    Si se cancela `token` (por defecto el de la corrida), devuelve las partes que
+    ya estaban terminadas; las demás no se procesan.
     """
+    token = token or cancelacion
+    if pool is not None:
+        regiones, recortes = partes_con_halo(image_parts, sigma)
+        pendientes = []
+        for region in regiones:
+            if token.cancelado:
+                break
+            pendientes.append(pool.submit(region, [('blur', sigma)], token))
+        filtered_parts = []
+        for pendiente, (inicio, fin) in zip(pendientes, recortes):
+            try:
+                filtered_parts.append(pendiente.get()[inicio:fin])
+            except TrabajoCancelado:
+                break
+        return filtered_parts
+
     try:
-        filtered_part = apply_filter_to_part(part, sigma)
-        pipe_send.send(filtered_part)
-    except Exception as e:
-        print(f"Error en proceso trabajador: {e}")
-    finally:
-        pipe_send.close()
-
-def process_image_parts_parallel(image_parts, sigma=2.0):
-    """
-    Procesa cada parte de la imagen en paralelo aplicando un filtro y usa Pipes para la comunicación.
-    """
-    pipes = [multiprocessing.Pipe() for _ in range(len(image_parts))]
-    processes = []
-    
-    for i, (part, (pipe_recv, pipe_send)) in enumerate(zip(image_parts, pipes)):
-        if interrupted:
-            break
-        p = multiprocessing.Process(target=worker_function, args=(part, sigma, pipe_send))
-        processes.append(p)
-        p.start()
-    
-    filtered_parts = []
-    for pipe_recv, _ in pipes:
-        if interrupted:
-            break
-        try:
-            filtered_part = pipe_recv.recv()
-            filtered_parts.append(filtered_part)
-        except EOFError:
-            print("Error en la recepción de datos.")
-        finally:
-            pipe_recv.close()
-    
-    for p in processes:
-        p.join()
-    
-    return filtered_parts
+        return filtrar_partes(image_parts, sigma, num_workers or len(image_parts), tamano_tesela, cancelacion=token,
+                              salida=salida)
+    except TrabajoCancelado:
+        return []
 
-def process_image_parts_sequential(image_parts, sigma=2.0):
+def process_image_parts_sequential(image_parts, sigma=2.0, token=None):
     """
     Procesa cada parte de la imagen de manera secuencial aplicando un filtro.
+
+    Cada parte se filtra con el halo de sus vecinas, así el resultado es el
+    mismo que el de process_image_parts_parallel.
     """
+    token = token or cancelacion
     filtered_parts = []
-    for part in image_parts:
-        if interrupted:
+    for region, recorte in zip(*partes_con_halo(image_parts, sigma)):
+        if token.cancelado:
             break
-        filtered_part = apply_filter_to_part(part, sigma)
+        filtered_part = apply_filter_to_part(region, sigma, recorte)
         filtered_parts.append(filtered_part)
     return filtered_parts
 
 def combine_image_parts(filtered_parts):
     """
     Combina las partes filtradas en una sola imagen.
+
+    Si las partes son vistas sobre el buffer de salida compartido, no hay que pegar
+    nada: la imagen se arma directamente sobre ese buffer.
     """
+    if isinstance(filtered_parts[0], np.ndarray):
+        return Image.fromarray(combinar_vistas(filtered_parts))
+
     widths, heights = zip(*(i.size for i in filtered_parts))
     total_height = sum(heights)
     
@@ -112,20 +130,44 @@ def combine_image_parts(filtered_parts):
     
     return combined_image
 
-def main(image_path, num_parts, sigma=2.0):
+def partes_completas(filtered_parts, image_parts, fase):
+    """
+    Indica si se filtraron todas las partes. Si la corrida se canceló, avisa
+    cuántas se terminaron: con partes faltantes no hay imagen que combinar.
+    """
+    if len(filtered_parts) == len(image_parts):
+        return True
+    print(f"Procesamiento {fase} interrumpido: {len(filtered_parts)} de {len(image_parts)} partes terminadas; "
+          f"no se guarda la imagen.")
+    return False
+
+def main(image_path, num_parts=None, sigma=2.0, pool=None):
     """
     Función principal para medir el rendimiento del procesamiento secuencial y paralelo.
+
+    Sin num_parts, el autoajuste elige partes, trabajadores y tesela para la
+    imagen; si estima que paralelizar no conviene (imágenes chicas), la fase
+    "paralela" también se hace en un solo proceso.
     """
-    global interrupted
+    global cancelacion
 
     # Cargar la imagen
     image = load_image(image_path)
+    plan = None
+    if num_parts is None:
+        workers = pool.num_procesos if pool is not None else None
+        plan = obtener_autoajuste().elegir(image.height, image.width, 3, sigma, workers, arrancar=pool is None)
+        num_parts = plan.workers
+        print(f"Autoajuste: {plan.modo}, {plan.workers} trabajadores, tesela {plan.tamano_tesela} "
+              f"(estimado {plan.estimado_s:.3f} s)")
     image_parts = split_image(image, num_parts)
 
     # Procesamiento Secuencial
-    interrupted = False 
+    cancelacion = TokenCancelacion()
     start_time = time.time()
     filtered_parts_sequential = process_image_parts_sequential(image_parts, sigma)
+    if not partes_completas(filtered_parts_sequential, image_parts, 'secuencial'):
+        return
     combined_image_sequential = combine_image_parts(filtered_parts_sequential)
     end_time = time.time()
     sec_time = end_time - start_time
@@ -135,10 +177,22 @@ def main(image_path, num_parts, sigma=2.0):
     combined_image_sequential.save('imagen_secuencial.jpg')
 
     # Procesamiento Paralelo
-    interrupted = False  
+    cancelacion = TokenCancelacion()
     start_time = time.time()
-    filtered_parts_parallel = process_image_parts_parallel(image_parts, sigma)
-    combined_image_parallel = combine_image_parts(filtered_parts_parallel)
+    if plan is not None and plan.modo == SECUENCIAL:
+        filtered_parts_parallel = process_image_parts_sequential(image_parts, sigma)
+        if not partes_completas(filtered_parts_parallel, image_parts, 'paralelo'):
+            return
+        combined_image_parallel = combine_image_parts(filtered_parts_parallel)
+    else:
+        workers, tamano_tesela = (plan.workers, plan.tamano_tesela) if plan is not None else (None, TAMANO_TESELA)
+        # Sin pool, las partes son vistas sobre este bloque: se combinan antes de liberarlo
+        with ArrayCompartido(forma_partes(image_parts), np.uint8) as salida:
+            filtered_parts_parallel = process_image_parts_parallel(image_parts, sigma, pool, workers, tamano_tesela,
+                                                                   salida=salida)
+            if not partes_completas(filtered_parts_parallel, image_parts, 'paralelo'):
+                return
+            combined_image_parallel = combine_image_parts(filtered_parts_parallel)
     end_time = time.time()
     par_time = end_time - start_time
     print(f"Tiempo de procesamiento paralelo: {par_time:.2f} segundos")
@@ -152,6 +206,8 @@ signal.signal(signal.SIGINT, signal_handler)
 
 if __name__ == "__main__":
     image_path = "/home/luciano/Escritorio/compu2/TPS/tp1/um_logo.png"
-    num_parts = 2  # Número de partes en las que se dividirá la imagen
+    num_parts = None  # Número de partes en las que se dividirá la imagen (None: lo elige el autoajuste)
     sigma = 2.0  # Parámetro del filtro gaussiano
+    # Como programa, la calibración y los planes nuevos se guardan al salir
+    configurar_autoajuste(persistir=True)
     main(image_path, num_parts, sigma)
\ No newline at end of file
@@ -1,9 +1,11 @@
+import sys
+import os
 from PIL import Image
 import numpy as np
-from scipy.ndimage import gaussian_filter
-import multiprocessing
-from multiprocessing import Array
-import ctypes
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tp1.blur_teselado import ArrayCompartido, TAMANO_TESELA, filtrar_en_memoria_compartida
 
 def load_image(image_path):
    
@@ -21,55 +23,29 @@ def split_image(image, num_parts):
         parts.append(part)
     return parts
 
-def apply_filter_to_array(np_array, sigma=2.0):
+def process_image_parts_with_shared_memory(image_parts, num_parts, sigma=2.0, tamano_tesela=TAMANO_TESELA):
     """
-    Aplica un filtro de desenfoque (filtro gaussiano) a una parte de la imagen en formato numpy array.
-    """
-    filtered_array = gaussian_filter(np_array, sigma=sigma)
-    return np.uint8(filtered_array)
+    Procesa la imagen en paralelo utilizando memoria compartida.
 
-def worker_function(start_row, end_row, shared_array, width, height, sigma):
-    """
-    Función del trabajador que procesa una parte de la imagen y almacena el resultado en un array compartido.
+    Las partes se copian una sola vez a un bloque de shared_memory; cada proceso
+    filtra teselas 2D leyendo un halo de ese bloque y escribe solo el núcleo en
+    el bloque de salida, así que no quedan costuras entre partes.
     """
-    # Convertir el array compartido a un numpy array
-    np_array_shared = np.frombuffer(shared_array.get_obj(), dtype=np.uint8).reshape((height, width, 3))
-    
-    # Procesar la parte correspondiente de la imagen
-    for row in range(start_row, end_row):
-        np_array_shared[row, :, :] = apply_filter_to_array(np_array_shared[row, :, :], sigma)
+    width = image_parts[0].size[0]
+    height = sum(part.size[1] for part in image_parts)
 
-def process_image_parts_with_shared_memory(image_parts, num_parts, sigma=2.0):
-    """
-    Procesa cada parte de la imagen en paralelo utilizando memoria compartida.
-    """
-    width, height = image_parts[0].size
-    # Crear un array compartido para almacenar los resultados
-    shared_array = Array(ctypes.c_uint8, width * height * 3)  # Ajustar el tamaño del array compartido
-    
-    # Convertir las partes de la imagen a un array numpy y copiar al array compartido
-    np_array_shared = np.frombuffer(shared_array.get_obj(), dtype=np.uint8).reshape((height, width, 3))
-    for i, part in enumerate(image_parts):
-        part_np = np.array(part.convert('RGB'))  
-        start_row = i * (height // num_parts)
-        end_row = (i + 1) * (height // num_parts) if i != num_parts - 1 else height
-        np_array_shared[start_row:end_row, :, :] = part_np[:end_row - start_row, :, :]  # Asegúrate de que las dimensiones coincidan
-    
-    processes = []
-    rows_per_process = height // num_parts
-    for i in range(num_parts):
-        start_row = i * rows_per_process
-        end_row = (i + 1) * rows_per_process if i != num_parts - 1 else height
-        p = multiprocessing.Process(target=worker_function, args=(start_row, end_row, shared_array, width, height, sigma))
-        processes.append(p)
-        p.start()
-    
-    for p in processes:
-        p.join()
-    
-    # Crear una imagen final combinando los resultados procesados
-    np_array_final = np.frombuffer(shared_array.get_obj(), dtype=np.uint8).reshape((height, width, 3))
-    combined_image = Image.fromarray(np_array_final)
+    with ArrayCompartido((height, width, 3), np.uint8) as entrada, \
+            ArrayCompartido((height, width, 3), np.uint8) as salida:
+        start_row = 0
+        for part in image_parts:
+            part_np = np.asarray(part.convert('RGB'))
+            entrada.array[start_row:start_row + part_np.shape[0]] = part_np
+            start_row += part_np.shape[0]
+
+        filtrar_en_memoria_compartida(entrada, salida, sigma, num_parts, tamano_tesela)
+
+        # Crear una imagen final a partir del bloque de salida
+        combined_image = Image.fromarray(salida.array.copy())
     return combined_image
 
 def main(image_path, num_parts, sigma=2.0):
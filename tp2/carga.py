@@ -0,0 +1,324 @@
+import os
+import sys
+import json
+import math
+import time
+import random
+import asyncio
+import argparse
+import platform
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tp2.protocolo import DATOS, ERROR, FIN, OCUPADO, SOLICITUD, empaquetar_cabecera, leer_trama
+
+EXTENSIONES = ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tif', '.tiff', '.webp')
+# Los últimos bytes de un PNG completo (chunk IEND y su CRC)
+FIN_PNG = b'IEND\xaeB`\x82'
+
+
+def cargar_corpus(rutas):
+    """
+    Lee en memoria las imágenes a reenviar; las rutas pueden ser archivos o directorios.
+    """
+    corpus = []
+    for ruta in rutas:
+        if os.path.isdir(ruta):
+            archivos = sorted(os.path.join(ruta, nombre) for nombre in os.listdir(ruta)
+                              if nombre.lower().endswith(EXTENSIONES))
+        else:
+            archivos = [ruta]
+        for archivo in archivos:
+            with open(archivo, 'rb') as f:
+                corpus.append((archivo, f.read()))
+    if not corpus:
+        raise ValueError("El corpus de imágenes está vacío")
+    return corpus
+
+
+async def solicitar(reader, writer, id_solicitud, data, parametros, inicio=None, sin_cache=False):
+    """
+    Envía una imagen por una conexión v2 y espera la respuesta completa.
+
+    Devuelve un dict con el estado ('ok', 'error', 'vencida', 'ocupado' o 'truncada'), la latencia, el
+    tiempo hasta el primer bloque y los bytes enviados y recibidos. `inicio` es el
+    instante desde el que se mide la latencia (por defecto, ahora). Con
+    `sin_cache` la solicitud lleva un 'nonce' nuevo, que entra en la clave de
+    la cache de resultados del servidor: nunca es un acierto.
+    """
+    inicio = time.perf_counter() if inicio is None else inicio
+    if sin_cache:
+        parametros = dict(parametros, nonce=os.urandom(8).hex())
+    writer.write(empaquetar_cabecera(SOLICITUD, id_solicitud, parametros, len(data)))
+    writer.write(data)
+    await writer.drain()
+
+    resultado = {'estado': 'truncada', 'bytes_enviados': len(data), 'bytes_recibidos': 0, 'ttfb_s': None}
+    final = b''
+    while True:
+        trama = await leer_trama(reader)
+        if trama is None:
+            break
+        if trama.id != id_solicitud:
+            continue
+        if trama.tipo == DATOS:
+            if resultado['ttfb_s'] is None:
+                resultado['ttfb_s'] = time.perf_counter() - inicio
+            resultado['bytes_recibidos'] += len(trama.payload)
+            final = (final + trama.payload)[-len(FIN_PNG):]
+        elif trama.tipo == FIN:
+            resultado['estado'] = 'ok' if final == FIN_PNG else 'truncada'
+            break
+        elif trama.tipo in (ERROR, OCUPADO):
+            resultado['estado'] = 'error' if trama.tipo == ERROR else 'ocupado'
+            if trama.parametros.get('plazo_vencido'):
+                resultado['estado'] = 'vencida'
+            resultado['error'] = trama.parametros.get('error')
+            break
+    resultado['latencia_s'] = time.perf_counter() - inicio
+    return resultado
+
+
+def _fallo_conexion(error, inicio, data):
+    return {'estado': 'conexion', 'error': str(error), 'bytes_enviados': 0, 'bytes_recibidos': 0,
+            'ttfb_s': None, 'latencia_s': time.perf_counter() - inicio, 'tamano': len(data)}
+
+
+async def carga_concurrente(host, port, corpus, parametros, concurrencia, fin, nueva_conexion=False,
+                            sin_cache=False):
+    """
+    Lazo cerrado: `concurrencia` clientes, cada uno con su conexión, mandan una
+    imagen, esperan la respuesta y mandan la siguiente hasta `fin` (perf_counter).
+    """
+    resultados = []
+
+    async def cliente(numero):
+        rnd = random.Random(numero)
+        reader = writer = None
+        id_solicitud = 0
+        while time.perf_counter() < fin:
+            _, data = rnd.choice(corpus)
+            inicio = time.perf_counter()
+            try:
+                if writer is None:
+                    reader, writer = await asyncio.open_connection(host, port)
+                resultado = await solicitar(reader, writer, id_solicitud, data, parametros, inicio, sin_cache)
+            except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+                resultado = _fallo_conexion(e, inicio, data)
+            resultado['tamano'] = len(data)
+            resultados.append(resultado)
+            id_solicitud += 1
+            reutilizable = resultado['estado'] in ('ok', 'ocupado', 'vencida')
+            if writer is not None and (nueva_conexion or not reutilizable):
+                writer.close()
+                reader = writer = None
+        if writer is not None:
+            writer.close()
+
+    await asyncio.gather(*(cliente(i) for i in range(concurrencia)))
+    return resultados
+
+
+async def carga_por_tasa(host, port, corpus, parametros, rps, fin, max_en_vuelo=1000, sin_cache=False):
+    """
+    Lazo abierto: arranca solicitudes a `rps` por segundo, cada una en una conexión
+    nueva, sin esperar a que terminen las anteriores.
+
+    La latencia se mide desde el instante en que la solicitud debía salir, así las
+    demoras del servidor no esconden la cola que se forma.
+    """
+    resultados = []
+    limite = asyncio.Semaphore(max_en_vuelo)
+    rnd = random.Random(0)
+
+    async def una(programada, data):
+        async with limite:
+            try:
+                reader, writer = await asyncio.open_connection(host, port)
+            except OSError as e:
+                resultados.append(_fallo_conexion(e, programada, data))
+                return
+            try:
+                resultado = await solicitar(reader, writer, 0, data, parametros, programada, sin_cache)
+            except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+                resultado = _fallo_conexion(e, programada, data)
+            finally:
+                writer.close()
+            resultado['tamano'] = len(data)
+            resultados.append(resultado)
+
+    tareas = []
+    arranque = time.perf_counter()
+    n = 0
+    while True:
+        programada = arranque + n / rps
+        if programada >= fin:
+            break
+        await asyncio.sleep(max(0.0, programada - time.perf_counter()))
+        tareas.append(asyncio.create_task(una(programada, rnd.choice(corpus)[1])))
+        n += 1
+    await asyncio.gather(*tareas)
+    return resultados
+
+
+def percentil(valores, p):
+    """
+    Percentil por rango más cercano sobre una lista ordenada.
+    """
+    if not valores:
+        return None
+    indice = max(0, min(len(valores) - 1, math.ceil(p / 100 * len(valores)) - 1))
+    return valores[indice]
+
+
+def distribucion(valores):
+    valores = sorted(v for v in valores if v is not None)
+    if not valores:
+        return None
+    return {
+        'p50': percentil(valores, 50),
+        'p95': percentil(valores, 95),
+        'p99': percentil(valores, 99),
+        'max': valores[-1],
+        'media': sum(valores) / len(valores),
+    }
+
+
+def resumir(resultados, duracion):
+    correctas = [r for r in resultados if r['estado'] == 'ok']
+    enviados = sum(r['bytes_enviados'] for r in resultados)
+    recibidos = sum(r['bytes_recibidos'] for r in resultados)
+    return {
+        'solicitudes': len(resultados),
+        'ok': len(correctas),
+        'errores': sum(r['estado'] == 'error' for r in resultados),
+        'ocupado': sum(r['estado'] == 'ocupado' for r in resultados),
+        'vencidas': sum(r['estado'] == 'vencida' for r in resultados),
+        'truncadas': sum(r['estado'] == 'truncada' for r in resultados),
+        'fallos_conexion': sum(r['estado'] == 'conexion' for r in resultados),
+        'duracion_s': duracion,
+        'rps': len(correctas) / duracion if duracion else 0.0,
+        'latencia_s': distribucion(r['latencia_s'] for r in correctas),
+        'ttfb_s': distribucion(r['ttfb_s'] for r in correctas),
+        'bytes_enviados': enviados,
+        'bytes_recibidos': recibidos,
+        'bytes_por_s_enviados': enviados / duracion if duracion else 0.0,
+        'bytes_por_s_recibidos': recibidos / duracion if duracion else 0.0,
+    }
+
+
+async def ejecutar_carga(host, port, corpus, parametros, duracion, concurrencia=None, rps=None,
+                         nueva_conexion=False, max_en_vuelo=1000, sin_cache=False):
+    """
+    Corre la carga durante `duracion` segundos, a concurrencia fija o a tasa fija, y
+    devuelve el resumen.
+    """
+    inicio = time.perf_counter()
+    fin = inicio + duracion
+    if rps:
+        resultados = await carga_por_tasa(host, port, corpus, parametros, rps, fin, max_en_vuelo, sin_cache)
+    else:
+        resultados = await carga_concurrente(host, port, corpus, parametros, concurrencia or 1, fin,
+                                             nueva_conexion, sin_cache)
+    return resumir(resultados, time.perf_counter() - inicio)
+
+
+def metadatos():
+    return {
+        'fecha': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'plataforma': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def comparar(actual, previo, tolerancia=0.10):
+    """
+    Devuelve las métricas que empeoraron más que `tolerancia` respecto de un JSON previo.
+    """
+    regresiones = []
+    if previo['configuracion'].get('cache_activa', True) != actual['configuracion']['cache_activa']:
+        print("Aviso: una corrida usó la cache de resultados y la otra no; los números no son comparables.")
+    antes, ahora = previo['resumen'], actual['resumen']
+    if ahora['rps'] < antes['rps'] * (1 - tolerancia):
+        regresiones.append(('rps', antes['rps'], ahora['rps']))
+    if antes['latencia_s'] and ahora['latencia_s']:
+        for clave in ('p50', 'p95', 'p99'):
+            if ahora['latencia_s'][clave] > antes['latencia_s'][clave] * (1 + tolerancia):
+                regresiones.append((f'latencia {clave}', antes['latencia_s'][clave], ahora['latencia_s'][clave]))
+    return regresiones
+
+
+def parsear_escala(valor):
+    return None if valor.lower() in ('none', 'no', 'sin') else float(valor)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generador de carga para server_asinc (protocolo v2).")
+    parser.add_argument("imagenes", nargs="+", help="Imágenes o directorios con las imágenes a reenviar")
+    parser.add_argument("-i", "--ip", default="127.0.0.1")
+    parser.add_argument("-p", "--port", type=int, default=8888)
+    modo = parser.add_mutually_exclusive_group()
+    modo.add_argument("-c", "--concurrencia", type=int, default=8, help="Clientes simultáneos (lazo cerrado)")
+    modo.add_argument("--rps", type=float, help="Solicitudes por segundo (lazo abierto)")
+    parser.add_argument("-d", "--duracion", type=float, default=10.0, help="Segundos de carga")
+    parser.add_argument("--escala", type=parsear_escala, default=0.7,
+                        help="Factor de escala, o 'none' para no pasar por el servidor de escalado")
+    parser.add_argument("--nueva-conexion", action="store_true",
+                        help="Con --concurrencia, abrir una conexión por solicitud")
+    parser.add_argument("--plazo-ms", type=int, help="Plazo de cada solicitud; el servidor abandona las que no llegan")
+    parser.add_argument("--sin-cache", action="store_true",
+                        help="Mandar un nonce por solicitud para que la cache de resultados del servidor nunca acierte")
+    parser.add_argument("--max-en-vuelo", type=int, default=1000, help="Con --rps, solicitudes abiertas como máximo")
+    parser.add_argument("-o", "--salida", default="carga_tp2.json", help="Archivo JSON de resultados")
+    parser.add_argument("--comparar", help="JSON de una corrida anterior para detectar regresiones")
+    parser.add_argument("--tolerancia", type=float, default=0.10)
+    args = parser.parse_args(argv)
+
+    corpus = cargar_corpus(args.imagenes)
+    parametros = {'escala': args.escala}
+    if args.plazo_ms is not None:
+        parametros['plazo_ms'] = args.plazo_ms
+    resumen = asyncio.run(ejecutar_carga(args.ip, args.port, corpus, parametros, args.duracion,
+                                         concurrencia=args.concurrencia, rps=args.rps,
+                                         nueva_conexion=args.nueva_conexion, max_en_vuelo=args.max_en_vuelo,
+                                         sin_cache=args.sin_cache))
+    informe = {
+        'meta': metadatos(),
+        'configuracion': {
+            'destino': f"{args.ip}:{args.port}",
+            'modo': 'tasa' if args.rps else 'concurrencia',
+            'rps_objetivo': args.rps,
+            'concurrencia': None if args.rps else args.concurrencia,
+            'duracion_s': args.duracion,
+            'escala': args.escala,
+            'plazo_ms': args.plazo_ms,
+            # Con la cache activa (la del servidor está prendida por defecto), desde la segunda
+            # pasada por el corpus se mide la búsqueda en cache y no el procesamiento
+            'cache_activa': not args.sin_cache,
+            'corpus': [{'ruta': ruta, 'bytes': len(data)} for ruta, data in corpus],
+        },
+        'resumen': resumen,
+    }
+    with open(args.salida, 'w') as f:
+        json.dump(informe, f, indent=2)
+
+    latencia = resumen['latencia_s'] or {}
+    print(f"{resumen['ok']}/{resumen['solicitudes']} correctas, {resumen['rps']:.1f} rps, "
+          f"p50 {latencia.get('p50') or 0:.4f} s, p99 {latencia.get('p99') or 0:.4f} s, "
+          f"{resumen['errores']} errores, {resumen['vencidas']} vencidas, {resumen['ocupado']} ocupado, "
+          f"{resumen['truncadas']} truncadas, {resumen['fallos_conexion']} fallos de conexión")
+    print(f"Resultados guardados en: {args.salida}")
+
+    if args.comparar:
+        with open(args.comparar) as f:
+            previo = json.load(f)
+        regresiones = comparar(informe, previo, args.tolerancia)
+        for clave, antes, ahora in regresiones:
+            print(f"Regresión en {clave}: {antes:.4f} -> {ahora:.4f}")
+        return 1 if regresiones else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,26 +1,264 @@
 import socket
 import os
+import sys
+import time
+import queue
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-def send_image(image_path, server_ip, server_port):
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tp1.cadena import compilar
+from tp2.protocolo import DATOS, ERROR, FIN, OCUPADO, SOLICITUD, empaquetar_cabecera, leer_trama_socket
+
+EXTENSIONES = ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tif', '.tiff', '.webp', '.ppm', '.pgm')
+VENTANA = 32
+# Veces que se reenvía una imagen rechazada con OCUPADO antes de darla por perdida
+REINTENTOS_OCUPADO = 5
+
+def enviar_solicitud(sock, id_solicitud, image_path, parametros=None):
+    """
+    Envía una solicitud con la imagen leída directamente del archivo (sendfile).
+    """
+    with open(image_path, "rb") as f:
+        data_size = os.fstat(f.fileno()).st_size
+        sock.sendall(empaquetar_cabecera(SOLICITUD, id_solicitud, parametros, data_size))
+        sock.sendfile(f)
+
+def send_images(image_paths, server_ip, server_port, output_paths=None, parametros=None):
+    """
+    Envía varias imágenes seguidas sobre una sola conexión (pipelining) y guarda
+    cada respuesta a medida que llegan sus bloques.
+
+    La conexión no se cierra para escritura después de enviar: para el servidor
+    un EOF quiere decir que el cliente se fue y cancela lo pendiente.
+    """
+    if output_paths is None:
+        output_paths = ["output.png"] if len(image_paths) == 1 else \
+            [f"output_{i + 1}.png" for i in range(len(image_paths))]
+
+    resultados = {}
+    with socket.create_connection((server_ip, server_port)) as sock:
+        # Enviar todas las solicitudes sin esperar las respuestas
+        try:
+            for id_solicitud, image_path in enumerate(image_paths):
+                enviar_solicitud(sock, id_solicitud, image_path, parametros)
+        except (BrokenPipeError, ConnectionResetError):
+            # El servidor cortó (por ejemplo, una imagen demasiado grande): leer lo que haya respondido
+            pass
+
+        # Recibir las imágenes procesadas
+        archivos = {}
+        try:
+            while len(resultados) < len(image_paths):
+                trama = leer_trama_socket(sock)
+                if trama is None:
+                    raise ConnectionError("El servidor cerró la conexión antes de responder todo")
+                if trama.tipo == DATOS:
+                    if trama.id not in archivos:
+                        archivos[trama.id] = open(output_paths[trama.id], "wb")
+                    archivos[trama.id].write(trama.payload)
+                elif trama.tipo == FIN:
+                    f = archivos.pop(trama.id, None) or open(output_paths[trama.id], "wb")
+                    f.close()
+                    resultados[trama.id] = output_paths[trama.id]
+                    print(f"Imagen procesada recibida y guardada como '{output_paths[trama.id]}'.")
+                elif trama.tipo in (ERROR, OCUPADO):
+                    parcial = archivos.pop(trama.id, None)
+                    if parcial is not None:
+                        parcial.close()
+                        os.remove(output_paths[trama.id])
+                    resultados[trama.id] = None
+                    motivo = "Servidor ocupado" if trama.tipo == OCUPADO else "Error del servidor"
+                    print(f"{motivo} con '{image_paths[trama.id]}': {trama.parametros.get('error')}")
+        finally:
+            for f in archivos.values():
+                f.close()
+    return [resultados.get(i) for i in range(len(image_paths))]
+
+def send_image(image_path, server_ip, server_port, output_path="output.png", parametros=None):
     try:
-        with open(image_path, "rb") as f:
-            image_data = f.read()
-        
-        # Preparar conexión y enviar tamaño de la imagen como encabezado (4 bytes)
-        data_size = len(image_data)
-        with socket.create_connection((server_ip, server_port)) as sock:
-            sock.sendall(data_size.to_bytes(4, byteorder='big'))
-            sock.sendall(image_data)  # Enviar datos de la imagen
-            
-            # Recibir la imagen procesada
-            result = sock.recv(1024 * 1024)
-            with open("output.png", "wb") as f_out:
-                f_out.write(result)
-            print("Imagen procesada recibida y guardada como 'output.png'.")
+        return send_images([image_path], server_ip, server_port, [output_path], parametros)[0]
     except FileNotFoundError:
         print(f"No se encontró la imagen en la ruta especificada: {image_path}")
 
+def listar_imagenes(directorio):
+    return sorted(os.path.join(directorio, nombre) for nombre in os.listdir(directorio)
+                  if nombre.lower().endswith(EXTENSIONES) and os.path.isfile(os.path.join(directorio, nombre)))
+
+def extension_salida(parametros):
+    """
+    Extensión del archivo que devuelve el servidor: la del formato final de la
+    cadena de operaciones si se pide una, o .png.
+    """
+    if parametros and parametros.get('ops'):
+        return compilar(parametros['ops']).extension
+    return '.png'
+
+def rutas_de_salida(image_paths, directorio_salida, salida='.png'):
+    """
+    Una ruta por imagen con la extensión `salida`; si dos imágenes comparten
+    nombre base, la segunda conserva su extensión original en el nombre.
+    """
+    rutas, usadas = [], set()
+    for image_path in image_paths:
+        base, extension = os.path.splitext(os.path.basename(image_path))
+        nombre = f"{base}{salida}" if base not in usadas else f"{base}_{extension[1:]}{salida}"
+        usadas.add(base)
+        rutas.append(os.path.join(directorio_salida, nombre))
+    return rutas
+
+def guardar_salida(output_path, bloques):
+    with open(output_path, "wb") as f:
+        f.writelines(bloques)
+
+class VentanaAdaptable:
+    """
+    Imágenes sin responder que se permite el cliente en modo lote: crece en uno
+    con cada respuesta y se reduce a la mitad con cada OCUPADO (como el control
+    de congestión de TCP), sin pasar la ventana que acordó el servidor.
+    """
+
+    def __init__(self, maximo):
+        self.maximo = maximo
+        self.limite = maximo
+        self.en_vuelo = 0
+        self.condicion = threading.Condition()
+
+    def tomar(self):
+        with self.condicion:
+            self.condicion.wait_for(lambda: self.en_vuelo < self.limite)
+            self.en_vuelo += 1
+
+    def devolver(self, ocupado=False):
+        with self.condicion:
+            self.en_vuelo -= 1
+            self.limite = max(1, self.limite // 2) if ocupado else min(self.maximo, self.limite + 1)
+            self.condicion.notify_all()
+
+def enviar_lote(directorio, server_ip, server_port, directorio_salida="salida", ventana=VENTANA,
+                escritores=4, parametros=None, reintentos=REINTENTOS_OCUPADO):
+    """
+    Procesa todas las imágenes de `directorio` por una sola conexión en modo lote.
+
+    Un hilo envía las imágenes (hasta `ventana` sin responder) mientras este
+    recibe las respuestas, que llegan en el orden en que terminan. Cada imagen
+    completa se escribe en `directorio_salida` desde un pool de `escritores`
+    hilos. Las rechazadas con OCUPADO achican la ventana y se reenvían después
+    de la espera que sugiere el servidor, duplicándola en cada intento.
+
+    Devuelve un resumen con las rutas de salida (None para las que fallaron) y
+    el throughput total.
+    """
+    image_paths = listar_imagenes(directorio)
+    os.makedirs(directorio_salida, exist_ok=True)
+    output_paths = rutas_de_salida(image_paths, directorio_salida, extension_salida(parametros))
+    pendientes = queue.Queue()
+    for id_solicitud in range(len(image_paths)):
+        pendientes.put(id_solicitud)
+    intentos = [0] * len(image_paths)
+    resultados = {}
+    bytes_entrada = bytes_salida = 0
+    inicio = time.perf_counter()
+
+    with socket.create_connection((server_ip, server_port)) as sock, \
+            ThreadPoolExecutor(max_workers=escritores) as escritura:
+        # El id del lote no se usa para ninguna imagen
+        sock.sendall(empaquetar_cabecera(SOLICITUD, len(image_paths), {'op': 'lote', 'ventana': ventana}, 0))
+        confirmacion = leer_trama_socket(sock)
+        if confirmacion is None or confirmacion.tipo != FIN:
+            motivo = confirmacion.parametros.get('error') if confirmacion else "conexión cerrada"
+            raise ConnectionError(f"El servidor no aceptó el modo lote: {motivo}")
+        libres = VentanaAdaptable(confirmacion.parametros.get('ventana', ventana))
+        print(f"Modo lote: {len(image_paths)} imágenes, ventana {confirmacion.parametros.get('ventana')}.")
+
+        def enviar():
+            nonlocal bytes_entrada
+            try:
+                while True:
+                    id_solicitud = pendientes.get()
+                    if id_solicitud is None:
+                        break
+                    libres.tomar()
+                    enviar_solicitud(sock, id_solicitud, image_paths[id_solicitud], parametros)
+                    bytes_entrada += os.path.getsize(image_paths[id_solicitud])
+            except OSError:
+                # El servidor cortó la conexión: el que recibe se entera al leer
+                pass
+
+        emisor = threading.Thread(target=enviar, daemon=True)
+        emisor.start()
+        bloques = {}
+        guardados = []
+        try:
+            while len(resultados) < len(image_paths):
+                trama = leer_trama_socket(sock)
+                if trama is None:
+                    raise ConnectionError("El servidor cerró la conexión antes de responder todo")
+                if trama.tipo == DATOS:
+                    bloques.setdefault(trama.id, []).append(trama.payload)
+                    bytes_salida += len(trama.payload)
+                    continue
+                libres.devolver(ocupado=trama.tipo == OCUPADO)
+                recibidos = bloques.pop(trama.id, [])
+                if trama.tipo == FIN:
+                    guardados.append(escritura.submit(guardar_salida, output_paths[trama.id], recibidos))
+                    resultados[trama.id] = output_paths[trama.id]
+                elif trama.tipo == OCUPADO and intentos[trama.id] < reintentos:
+                    espera = trama.parametros.get('reintentar_ms', 100) / 1000 * 2 ** intentos[trama.id]
+                    intentos[trama.id] += 1
+                    threading.Timer(espera, pendientes.put, (trama.id,)).start()
+                else:
+                    resultados[trama.id] = None
+                    motivo = "Servidor ocupado" if trama.tipo == OCUPADO else "Error del servidor"
+                    print(f"{motivo} con '{image_paths[trama.id]}': {trama.parametros.get('error')}")
+        finally:
+            pendientes.put(None)
+        emisor.join()
+        for guardado in guardados:
+            guardado.result()
+
+    duracion = time.perf_counter() - inicio
+    correctas = sum(1 for ruta in resultados.values() if ruta is not None)
+    print(f"{correctas}/{len(image_paths)} imágenes en {duracion:.2f} s: {correctas / duracion:.1f} imágenes/s, "
+          f"{bytes_entrada / duracion / 1e6:.1f} MB/s enviados, {bytes_salida / duracion / 1e6:.1f} MB/s recibidos.")
+    return {
+        'salidas': [resultados.get(i) for i in range(len(image_paths))],
+        'correctas': correctas,
+        'fallidas': len(image_paths) - correctas,
+        'reintentos': sum(intentos),
+        'duracion_s': duracion,
+        'imagenes_por_s': correctas / duracion,
+        'bytes_enviados': bytes_entrada,
+        'bytes_recibidos': bytes_salida,
+    }
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cliente del servidor de procesamiento de imágenes.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("-p", "--port", type=int, default=8888)
+    parser.add_argument("--lote", metavar="DIRECTORIO", help="Procesar todas las imágenes del directorio")
+    parser.add_argument("-o", "--salida", default="salida", help="Directorio de salida del modo lote")
+    parser.add_argument("--ventana", type=int, default=VENTANA, help="Imágenes sin responder a la vez (modo lote)")
+    parser.add_argument("--escritores", type=int, default=4, help="Hilos que escriben las salidas (modo lote)")
+    parser.add_argument("--escala", type=float, default=None, help="Factor de escala (por defecto el del servidor)")
+    parser.add_argument("--ops", default=None,
+                        help="Cadena de operaciones, por ejemplo 'gray|scale:0.7|blur:2|png' (reemplaza a --escala)")
+    args = parser.parse_args()
+    parametros = {'escala': args.escala} if args.escala is not None else None
+    if args.ops:
+        # Se valida acá para no mandar una cadena que el servidor va a rechazar
+        try:
+            compilar(args.ops)
+        except ValueError as e:
+            parser.error(str(e))
+        parametros = {'ops': args.ops}
+
+    if args.lote:
+        resumen = enviar_lote(args.lote, args.host, args.port, args.salida, args.ventana, args.escritores, parametros)
+        sys.exit(0 if resumen['fallidas'] == 0 else 1)
+
     # Solicitar la ruta de la imagen al usuario
     image_path = input("Por favor ingresa la ruta de la imagen que deseas procesar: ")
-    send_image(image_path, "127.0.0.1", 8888)
\ No newline at end of file
+    send_image(image_path, args.host, args.port, f"output{extension_salida(parametros)}", parametros)
@@ -0,0 +1,257 @@
+# metricas.py
+#
+# Métricas de bajo costo para los dos servidores: histogramas de duración por
+# etapa (buckets fijos, como Prometheus), contadores y valores instantáneos
+# (en vuelo, profundidad de cola). Todo es seguro entre hilos.
+
+import os
+import sys
+import json
+import time
+import bisect
+import argparse
+import threading
+from contextlib import contextmanager
+
+# Límites superiores de los buckets, en segundos: de 100 µs a ~52 s
+BUCKETS = tuple(0.0001 * 2 ** i for i in range(20))
+
+_metricas = {}
+
+
+class Histograma:
+    """
+    Cuenta observaciones en buckets fijos; guarda también la suma y la cantidad.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.conteos = [0] * (len(buckets) + 1)
+        self.suma = 0.0
+        self.cantidad = 0
+
+    def observar(self, valor):
+        self.conteos[bisect.bisect_left(self.buckets, valor)] += 1
+        self.suma += valor
+        self.cantidad += 1
+
+    def percentil(self, p):
+        """
+        Estimación del percentil: el límite superior del bucket donde cae.
+        """
+        if not self.cantidad:
+            return None
+        objetivo = p / 100 * self.cantidad
+        acumulado = 0
+        for limite, conteo in zip(self.buckets, self.conteos):
+            acumulado += conteo
+            if acumulado >= objetivo:
+                return limite
+        return float('inf')
+
+
+class Traza:
+    """
+    Duraciones de las etapas de una solicitud.
+
+    Las etapas que se repiten (por ejemplo el envío de cada bloque) se suman, y
+    todo se vuelca a los histogramas una sola vez, al terminar.
+    """
+
+    def __init__(self, metricas):
+        self.metricas = metricas
+        self.inicio = time.perf_counter()
+        self.etapas = {}
+
+    def agregar(self, etapa, segundos):
+        self.etapas[etapa] = self.etapas.get(etapa, 0.0) + segundos
+
+    @contextmanager
+    def etapa(self, nombre):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.agregar(nombre, time.perf_counter() - inicio)
+
+    def terminar(self):
+        self.agregar('total', time.perf_counter() - self.inicio)
+        self.metricas.observar_varias(self.etapas)
+
+
+class Metricas:
+    """
+    Registro de métricas de un proceso. `prefijo` encabeza los nombres en el
+    formato de texto de Prometheus.
+    """
+
+    def __init__(self, prefijo):
+        self.prefijo = prefijo
+        self.lock = threading.Lock()
+        self.etapas = {}
+        self.contadores = {}
+        self.valores = {}
+
+    def incrementar(self, nombre, valor=1):
+        with self.lock:
+            self.contadores[nombre] = self.contadores.get(nombre, 0) + valor
+
+    def ajustar(self, nombre, delta):
+        with self.lock:
+            self.valores[nombre] = self.valores.get(nombre, 0) + delta
+
+    @contextmanager
+    def en_curso(self, nombre):
+        self.ajustar(nombre, 1)
+        try:
+            yield
+        finally:
+            self.ajustar(nombre, -1)
+
+    def observar(self, etapa, segundos):
+        with self.lock:
+            self._observar(etapa, segundos)
+
+    def observar_varias(self, etapas):
+        with self.lock:
+            for etapa, segundos in etapas.items():
+                self._observar(etapa, segundos)
+
+    def _observar(self, etapa, segundos):
+        histograma = self.etapas.get(etapa)
+        if histograma is None:
+            histograma = self.etapas[etapa] = Histograma()
+        histograma.observar(segundos)
+
+    @contextmanager
+    def medir(self, etapa):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar(etapa, time.perf_counter() - inicio)
+
+    def traza(self):
+        return Traza(self)
+
+    def instantanea(self):
+        """
+        Estado actual como dict serializable a JSON.
+        """
+        with self.lock:
+            return {
+                'pid': os.getpid(),
+                'contadores': dict(self.contadores),
+                'valores': dict(self.valores),
+                'etapas': {
+                    etapa: {
+                        'cantidad': h.cantidad,
+                        'suma_s': h.suma,
+                        'media_s': h.suma / h.cantidad if h.cantidad else None,
+                        'p50_s': h.percentil(50),
+                        'p95_s': h.percentil(95),
+                        'p99_s': h.percentil(99),
+                    }
+                    for etapa, h in self.etapas.items()
+                },
+            }
+
+    def texto_prometheus(self):
+        """
+        Estado actual en el formato de texto de Prometheus (versión 0.0.4).
+        """
+        p = self.prefijo
+        lineas = []
+        with self.lock:
+            for nombre, valor in sorted(self.contadores.items()):
+                lineas.append(f"# TYPE {p}_{nombre}_total counter")
+                lineas.append(f"{p}_{nombre}_total {valor}")
+            for nombre, valor in sorted(self.valores.items()):
+                lineas.append(f"# TYPE {p}_{nombre} gauge")
+                lineas.append(f"{p}_{nombre} {valor}")
+            if self.etapas:
+                lineas.append(f"# TYPE {p}_etapa_segundos histogram")
+            for etapa, h in sorted(self.etapas.items()):
+                acumulado = 0
+                for limite, conteo in zip(h.buckets, h.conteos):
+                    acumulado += conteo
+                    lineas.append(f'{p}_etapa_segundos_bucket{{etapa="{etapa}",le="{limite:g}"}} {acumulado}')
+                lineas.append(f'{p}_etapa_segundos_bucket{{etapa="{etapa}",le="+Inf"}} {h.cantidad}')
+                lineas.append(f'{p}_etapa_segundos_sum{{etapa="{etapa}"}} {h.suma}')
+                lineas.append(f'{p}_etapa_segundos_count{{etapa="{etapa}"}} {h.cantidad}')
+        return "\n".join(lineas) + "\n"
+
+
+def obtener_metricas(prefijo):
+    """
+    Devuelve el registro de métricas del proceso para `prefijo`, creándolo la primera vez.
+    """
+    metricas = _metricas.get(prefijo)
+    if metricas is None:
+        metricas = _metricas.setdefault(prefijo, Metricas(prefijo))
+    return metricas
+
+
+async def iniciar_servidor_estadisticas(metricas, host='127.0.0.1', port=9100, extras=None):
+    """
+    Levanta un endpoint HTTP local con aiohttp:
+
+    - /metrics: texto de Prometheus.
+    - /stats: JSON con la instantánea, más lo que devuelva extras() (si se pasa).
+
+    Devuelve el AppRunner; hay que llamar a cleanup() al terminar.
+    """
+    from aiohttp import web
+
+    async def prometheus(request):
+        return web.Response(text=metricas.texto_prometheus(), content_type='text/plain', charset='utf-8')
+
+    async def estadisticas(request):
+        datos = metricas.instantanea()
+        if extras is not None:
+            datos.update(extras())
+        return web.json_response(datos)
+
+    app = web.Application()
+    app.router.add_get('/metrics', prometheus)
+    app.router.add_get('/stats', estadisticas)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+def consultar_escalado(host, port, formato='prometheus'):
+    """
+    Pide las métricas a un servidor de escalado con la operación 'estadisticas'.
+
+    Con varios procesos trabajadores responde el que atienda la conexión.
+    """
+    import socket
+    from tp2.protocolo import DATOS, ERROR, SOLICITUD, enviar_trama_socket, leer_trama_socket
+
+    with socket.create_connection((host, port)) as sock:
+        enviar_trama_socket(sock, SOLICITUD, 0, {'op': 'estadisticas', 'formato': formato})
+        bloques = []
+        while True:
+            trama = leer_trama_socket(sock)
+            if trama is None:
+                raise ConnectionError("El servidor de escalado cerró la conexión")
+            if trama.tipo == ERROR:
+                raise RuntimeError(trama.parametros.get('error'))
+            bloques.append(bytes(trama.payload))
+            if trama.tipo != DATOS:
+                break
+    texto = b''.join(bloques).decode()
+    return json.loads(texto) if formato == 'json' else texto
+
+
+if __name__ == "__main__":
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    parser = argparse.ArgumentParser(description="Muestra las métricas de un servidor de escalado.")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("-p", "--port", type=int, default=9999)
+    parser.add_argument("--json", action="store_true", help="Instantánea en JSON en lugar de Prometheus")
+    args = parser.parse_args()
+    resultado = consultar_escalado(args.host, args.port, 'json' if args.json else 'prometheus')
+    print(json.dumps(resultado, indent=2) if args.json else resultado, end="")
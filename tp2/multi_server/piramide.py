@@ -0,0 +1,162 @@
+# piramide.py
+#
+# Pirámides de resolución (mipmaps) de las imágenes fuente del servidor de
+# escalado: cada nivel es el anterior reducido a la mitad. Una solicitud se
+# resuelve redimensionando desde el nivel más chico que todavía es al menos
+# tan grande como la salida, así que el costo depende del tamaño pedido y no
+# del de la fuente.
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+from tp1.backends import redimensionar_pil
+
+MAX_BYTES = 512 * 1024 * 1024
+# No se generan niveles con un lado menor a este
+LADO_MINIMO = 32
+# Con paleta o de 1 bit, resize() usa el vecino más cercano: esas imágenes quedan con un solo nivel
+MODOS_REDUCIBLES = ('L', 'LA', 'La', 'RGB', 'RGBA', 'RGBa', 'RGBX', 'CMYK', 'I', 'F')
+
+_piramides = None
+
+
+def tamano_imagen(image):
+    """
+    Bytes que ocupa una imagen PIL decodificada.
+    """
+    por_pixel = 4 if image.mode in ('I', 'F', 'RGBX', 'CMYK') else len(image.getbands())
+    return image.width * image.height * por_pixel
+
+
+def clave_fuente(payload, cabecera=''):
+    """
+    Identifica la imagen fuente por un hash del payload. `cabecera` separa las
+    fuentes con los mismos bytes y distinto formato de entrada (raw y PNG).
+
+    No se aceptan ids del cliente: dos imágenes distintas con el mismo id se
+    devolverían los píxeles de la otra, y el primer servidor guardaría ese
+    resultado en su cache bajo el hash correcto.
+    """
+    return f"{cabecera}:{hashlib.blake2b(payload, digest_size=20).hexdigest()}"
+
+
+class Piramide:
+    """
+    Niveles de una imagen, del original (nivel 0) hacia abajo, cada uno de la
+    mitad de ancho y alto que el anterior.
+
+    Los niveles se reducen con el mismo filtro que el escalado directo, así que
+    pedir la mitad da lo mismo que escalar desde el original; el resto de las
+    escalas difiere en redondeos (un nivel de gris en promedio).
+    """
+
+    def __init__(self, image, lado_minimo=LADO_MINIMO):
+        self.niveles = [image]
+        if image.mode in MODOS_REDUCIBLES:
+            while min(image.width, image.height) // 2 >= lado_minimo:
+                image = redimensionar_pil(image, (image.width // 2, image.height // 2))
+                self.niveles.append(image)
+        self.tamano = sum(tamano_imagen(nivel) for nivel in self.niveles)
+
+    @property
+    def original(self):
+        return self.niveles[0]
+
+    def nivel_para(self, ancho, alto):
+        """
+        Índice del nivel más chico con al menos `ancho` x `alto` píxeles.
+        """
+        indice = 0
+        for i, nivel in enumerate(self.niveles):
+            if nivel.width < ancho or nivel.height < alto:
+                break
+            indice = i
+        return indice
+
+    def escalar(self, ancho, alto):
+        nivel = self.niveles[self.nivel_para(ancho, alto)]
+        if nivel.size == (ancho, alto):
+            return nivel
+        return redimensionar_pil(nivel, (ancho, alto))
+
+
+class CachePiramides:
+    """
+    Pirámides de las últimas fuentes escaladas, LRU limitado a `max_bytes`.
+
+    La usan a la vez los hilos del pool de un proceso: si dos solicitudes de la
+    misma fuente llegan juntas, la segunda espera la pirámide que arma la
+    primera en lugar de decodificar y reducir de nuevo.
+    """
+
+    def __init__(self, max_bytes=MAX_BYTES, lado_minimo=LADO_MINIMO):
+        self.max_bytes = max_bytes
+        self.lado_minimo = lado_minimo
+        self.lock = threading.Lock()
+        self._piramides = OrderedDict()
+        self._bytes = 0
+        self._en_curso = {}
+        self.contadores = {'aciertos': 0, 'fallos': 0, 'colapsadas': 0, 'desalojos': 0}
+
+    def estadisticas(self):
+        with self.lock:
+            return dict(self.contadores, bytes=self._bytes, entradas=len(self._piramides))
+
+    def obtener(self, clave, decodificar):
+        """
+        Devuelve la pirámide de `clave`; si no está, la arma con la imagen PIL
+        que devuelve decodificar(). El segundo valor indica si ya estaba.
+        """
+        while True:
+            with self.lock:
+                piramide = self._piramides.get(clave)
+                if piramide is not None:
+                    self._piramides.move_to_end(clave)
+                    self.contadores['aciertos'] += 1
+                    return piramide, True
+                evento = self._en_curso.get(clave)
+                if evento is None:
+                    evento = self._en_curso[clave] = threading.Event()
+                    self.contadores['fallos'] += 1
+                    break
+            evento.wait()
+            with self.lock:
+                self.contadores['colapsadas'] += 1
+            # Si la que la armaba falló (o no entraba en la cache), se vuelve a intentar
+
+        try:
+            piramide = Piramide(decodificar(), self.lado_minimo)
+            self._guardar(clave, piramide)
+            return piramide, False
+        finally:
+            with self.lock:
+                self._en_curso.pop(clave, None)
+            evento.set()
+
+    def _guardar(self, clave, piramide):
+        with self.lock:
+            if piramide.tamano > self.max_bytes:
+                return
+            self._piramides[clave] = piramide
+            self._bytes += piramide.tamano
+            while self._bytes > self.max_bytes:
+                _, desalojada = self._piramides.popitem(last=False)
+                self._bytes -= desalojada.tamano
+                self.contadores['desalojos'] += 1
+
+
+def configurar_piramides(**opciones):
+    """
+    Reemplaza la cache de pirámides del proceso por una nueva con estas opciones.
+    """
+    global _piramides
+    _piramides = CachePiramides(**opciones)
+    return _piramides
+
+
+def obtener_piramides():
+    """
+    Devuelve la cache de pirámides del proceso, o None si no se configuró.
+    """
+    return _piramides
@@ -1,55 +1,378 @@
 # scale_server.py
 
+import os
+import sys
+import signal
+import socket
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from multiprocessing import Process
-from socketserver import BaseRequestHandler, TCPServer
+from socketserver import BaseRequestHandler, TCPServer, ThreadingMixIn
 from PIL import Image
 import io
+import json
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from tp1.backends import configurar_backend, disponibles, redimensionar_pil
+from tp1.cadena import compilar, decodificar
+from tp1.cancelacion import TokenCancelacion, TrabajoCancelado, verificar
+from tp2.metricas import obtener_metricas
+from tp2.multi_server.piramide import LADO_MINIMO, clave_fuente, configurar_piramides, obtener_piramides
+from tp2.protocolo import (DATOS, ERROR, FIN, SOLICITUD, EscritorTramas, desempaquetar_raw, empaquetar_raw,
+                           enviar_trama_socket, leer_trama_socket, recibir_exacto)
+
+metricas = obtener_metricas('escalado')
+
+def _escalar(decodificar, scale_factor, traza, piramides=None, clave=None, cancelacion=None):
+    """
+    Devuelve la imagen que entrega decodificar() redimensionada por scale_factor.
+
+    Con cache de pirámides, la fuente se decodifica una sola vez y cada
+    solicitud redimensiona desde el nivel más cercano al tamaño pedido.
+    Entre etapas consulta `cancelacion` (TokenCancelacion, opcional).
+    """
+    piramide = None
+    if piramides is None:
+        with traza.etapa('decodificacion'):
+            image = decodificar()
+    else:
+        with traza.etapa('piramide'):
+            piramide, acierto = piramides.obtener(clave, decodificar)
+        metricas.incrementar('piramide_aciertos' if acierto else 'piramide_fallos')
+        image = piramide.original
+    verificar(cancelacion)
+    if not scale_factor > 0:
+        raise ValueError(f"El factor de escala tiene que ser positivo: {scale_factor}")
+    # Como _op_scale de pool_persistente: nunca menos de un píxel por lado
+    new_size = (max(int(image.width * scale_factor), 1), max(int(image.height * scale_factor), 1))
+    with traza.etapa('redimension'):
+        if piramide is not None:
+            return piramide.escalar(*new_size)
+        return redimensionar_pil(image, new_size)
+
+def escalar_imagen(image_data, scale_factor, fp, formato="PNG", traza=None, piramides=None, clave=None,
+                   cancelacion=None):
+    """
+    Decodifica la imagen, la redimensiona por scale_factor y la codifica en fp.
+    """
+    traza = traza or metricas.traza()
+
+    def decodificar():
+        image = Image.open(io.BytesIO(image_data))
+        image.load()
+        return image
+
+    image = _escalar(decodificar, scale_factor, traza, piramides, clave, cancelacion)
+    verificar(cancelacion)
+    # Incluye el envío: los bloques salen por fp mientras se codifica
+    with traza.etapa('codificacion'):
+        image.save(fp, format=formato)
+
+def escalar_raw(payload, scale_factor, traza=None, piramides=None, clave=None, cancelacion=None):
+    """
+    Redimensiona píxeles sin comprimir; devuelve la cabecera raw y los píxeles escalados.
+    """
+    traza = traza or metricas.traza()
+    modo, ancho, alto, stride, pixeles = desempaquetar_raw(payload)
+    image = _escalar(lambda: Image.frombuffer(modo, (ancho, alto), pixeles, 'raw', modo, stride, 1),
+                     scale_factor, traza, piramides, clave, cancelacion)
+    verificar(cancelacion)
+    with traza.etapa('redimension'):
+        datos = image.tobytes()
+    return empaquetar_raw(image.mode, image.width, image.height, len(datos) // image.height), datos
+
+def ejecutar_ops(image_data, ops, fp, traza=None, cancelacion=None):
+    """
+    Ejecuta una cadena de operaciones completa ("gray|scale:0.7|blur:2|png")
+    sobre la imagen y escribe el resultado en fp, banda por banda.
+
+    Devuelve el texto de la cadena ya compilada.
+    """
+    traza = traza or metricas.traza()
+    plan = compilar(ops)
+    with traza.etapa('decodificacion'):
+        np_array = decodificar(image_data)
+    # Incluye el envío, como la codificación de escalar_imagen
+    with traza.etapa('cadena'):
+        plan.ejecutar(np_array, fp, cancelacion=cancelacion)
+    return plan.canonica
 
 class ScaleHandler(BaseRequestHandler):
+    """
+    Atiende una conexión persistente del primer servidor.
+
+    Lee solicitudes sin esperar a que terminen las anteriores, las procesa en el
+    pool del servidor y responde cada una con su id en cuanto está lista.
+
+    Cada solicitud tiene un TokenCancelacion con su plazo ('plazo_ms'); el primer
+    servidor lo cancela con una SOLICITUD {'op': 'cancelar'} del mismo id, y se
+    cancelan todas si se cae la conexión.
+    """
+
+    def setup(self):
+        self.lock_envio = threading.Lock()
+        self.tokens = {}
+
     def handle(self):
+        pendientes = []
+        with metricas.en_curso('conexiones'):
+            while True:
+                try:
+                    # El primer byte marca el fin de la espera entre solicitudes
+                    inicio = recibir_exacto(self.request, 1)
+                    if inicio is None:
+                        break
+                    traza = metricas.traza()
+                    with traza.etapa('recepcion'):
+                        trama = leer_trama_socket(self.request, bytes(inicio))
+                except (ConnectionError, OSError, ValueError) as e:
+                    print(f"Error en ScaleHandler: {e}")
+                    break
+
+                if trama.tipo != SOLICITUD:
+                    print(f"Trama inesperada de tipo {trama.tipo}; se ignora.")
+                    continue
+                if trama.parametros.get('op') == 'ping':
+                    # Chequeo de salud: responder enseguida, sin pasar por el pool
+                    with self.lock_envio:
+                        enviar_trama_socket(self.request, FIN, trama.id)
+                    continue
+                if trama.parametros.get('op') == 'estadisticas':
+                    self.enviar_estadisticas(trama.id, trama.parametros.get('formato', 'prometheus'))
+                    continue
+                if trama.parametros.get('op') == 'cancelar':
+                    token = self.tokens.get(trama.id)
+                    if token is not None:
+                        token.cancelar("Solicitud cancelada por el cliente")
+                    continue
+                metricas.incrementar('bytes_entrada', len(trama.payload))
+                metricas.ajustar('en_cola', 1)
+                plazo_ms = trama.parametros.get('plazo_ms')
+                token = self.tokens[trama.id] = TokenCancelacion(None if plazo_ms is None else plazo_ms / 1000)
+                pendientes = [f for f in pendientes if not f.done()]
+                pendientes.append(self.server.enviar_trabajo(self.procesar, trama.id, trama.parametros,
+                                                             trama.payload, traza, token))
+
+            # Nadie va a leer las respuestas pendientes: lo que no empezó no empieza
+            for token in list(self.tokens.values()):
+                token.cancelar("Se cerró la conexión")
+            # No cerrar la conexión con respuestas todavía en curso
+            for futuro in pendientes:
+                futuro.result()
+
+    def enviar_estadisticas(self, id_solicitud, formato):
+        if formato == 'json':
+            instantanea = metricas.instantanea()
+            piramides = obtener_piramides()
+            if piramides is not None:
+                instantanea['piramides'] = piramides.estadisticas()
+            datos = json.dumps(instantanea).encode()
+        else:
+            datos = metricas.texto_prometheus().encode()
         try:
-            # Leer los primeros 4 bytes que representan la longitud de la imagen
-            image_length_bytes = self.request.recv(4)
-            if not image_length_bytes:
-                print("Error: No se recibió la longitud de la imagen.")
-                return
-
-            image_length = int.from_bytes(image_length_bytes, byteorder='big')
-            print(f"Tamaño de la imagen recibido: {image_length} bytes")
-            
-            # Leer los datos de la imagen completos en fragmentos
-            image_data = b""
-            while len(image_data) < image_length:
-                packet = self.request.recv(image_length - len(image_data))
-                if not packet:
-                    print("Error: Conexión cerrada antes de recibir todos los datos de la imagen.")
+            with self.lock_envio:
+                enviar_trama_socket(self.request, DATOS, id_solicitud, None, datos)
+                enviar_trama_socket(self.request, FIN, id_solicitud)
+        except OSError as e:
+            print(f"Error al enviar las estadísticas: {e}")
+
+    def procesar(self, id_solicitud, parametros, image_data, traza=None, cancelacion=None):
+        traza = traza or metricas.traza()
+        traza.agregar('espera', time.perf_counter() - traza.inicio - traza.etapas.get('recepcion', 0.0))
+        metricas.ajustar('en_cola', -1)
+        # La imagen escalada sale por el socket en bloques a medida que se codifica
+        escritor = EscritorTramas(self.request, id_solicitud, self.lock_envio)
+        try:
+            verificar(cancelacion)
+            with metricas.en_curso('en_vuelo'):
+                if parametros.get('ops') is not None:
+                    # Toda la cadena en este servidor, sin volver al primero entre pasos
+                    canonica = ejecutar_ops(image_data, parametros['ops'], escritor, traza, cancelacion)
+                    with traza.etapa('envio'):
+                        escritor.terminar()
+                    traza.terminar()
+                    metricas.incrementar('solicitudes')
+                    metricas.incrementar('bytes_salida', escritor.enviados)
+                    print(f"Solicitud {id_solicitud}: cadena {canonica} ({escritor.enviados} bytes).")
                     return
-                image_data += packet
-            
-            # Leer el resto de los datos como factor de escala
-            scale_factor_data = self.request.recv(1024)  # Tamaño máximo esperado para el factor de escala
-            scale_factor = float(scale_factor_data.decode())
-            print(f"Factor de escala recibido: {scale_factor}")
-            
-            # Escalar la imagen
-            image = Image.open(io.BytesIO(image_data))
-            new_size = (int(image.width * scale_factor), int(image.height * scale_factor))
-            image = image.resize(new_size)
-            
-            # Enviar la imagen escalada al primer servidor
-            output = io.BytesIO()
-            image.save(output, format="PNG")
-            self.request.sendall(output.getvalue())
-            print("Imagen escalada y enviada al primer servidor.")
-        
+                scale_factor = float(parametros['escala'])
+                formato = parametros.get('formato', 'PNG')
+                piramides = obtener_piramides()
+                clave = None
+                if piramides is not None:
+                    with traza.etapa('piramide'):
+                        clave = clave_fuente(image_data, 'raw' if formato == 'raw' else 'imagen')
+                if formato == 'raw':
+                    # Entrada y salida sin comprimir: cabecera y píxeles salen con sendmsg, sin copias
+                    cabecera_raw, pixeles = escalar_raw(image_data, scale_factor, traza, piramides, clave,
+                                                        cancelacion)
+                    with traza.etapa('envio'), self.lock_envio:
+                        enviar_trama_socket(self.request, DATOS, id_solicitud, None, cabecera_raw, pixeles)
+                    escritor.enviados = len(cabecera_raw) + len(pixeles)
+                else:
+                    escalar_imagen(image_data, scale_factor, escritor, formato, traza, piramides, clave,
+                                   cancelacion)
+                with traza.etapa('envio'):
+                    escritor.terminar()
+            traza.terminar()
+            metricas.incrementar('solicitudes')
+            metricas.incrementar('bytes_salida', escritor.enviados)
+            print(f"Solicitud {id_solicitud}: imagen escalada por {scale_factor} ({escritor.enviados} bytes).")
+        except TrabajoCancelado as e:
+            metricas.incrementar('plazos_vencidos' if cancelacion.vencido else 'canceladas')
+            print(f"Solicitud {id_solicitud} abandonada: {e}")
+            self.responder_error(id_solicitud, {'error': str(e), 'cancelada': True,
+                                                'plazo_vencido': cancelacion.vencido})
         except Exception as e:
-            print(f"Error en ScaleHandler: {e}")
+            metricas.incrementar('errores')
+            print(f"Error en ScaleHandler (solicitud {id_solicitud}): {e}")
+            self.responder_error(id_solicitud, {'error': str(e)})
+        finally:
+            self.tokens.pop(id_solicitud, None)
 
-def run_scale_server(host, port):
-    with TCPServer((host, port), ScaleHandler) as server:
-        print(f"Servidor de escalado escuchando en {host}:{port}")
-        server.serve_forever()
+    def responder_error(self, id_solicitud, parametros):
+        try:
+            with self.lock_envio:
+                enviar_trama_socket(self.request, ERROR, id_solicitud, parametros)
+        except OSError as e:
+            print(f"Error al responder la solicitud {id_solicitud}: {e}")
+
+class PoolTCPServer(ThreadingMixIn, TCPServer):
+    """
+    TCPServer con un hilo liviano por conexión, que solo lee tramas, y un pool
+    acotado de `hilos` que hace el trabajo de imagen.
+
+    PIL libera el GIL al decodificar, redimensionar y codificar, así que varios
+    hilos por proceso también aprovechan núcleos.
+
+    Mientras los `hilos` están ocupados el proceso no acepta conexiones nuevas:
+    quedan en la cola del socket compartido y las toma un proceso libre, en
+    lugar de esperar detrás de una imagen grande.
+    """
+    allow_reuse_address = True
+    daemon_threads = True
+    block_on_close = False
+
+    def __init__(self, server_address, RequestHandlerClass, hilos=1, bind_and_activate=True):
+        super().__init__(server_address, RequestHandlerClass, bind_and_activate)
+        self.hilos = hilos
+        self.executor = ThreadPoolExecutor(max_workers=hilos)
+        self.en_vuelo = 0
+        self.cupo = threading.Condition()
+
+    def enviar_trabajo(self, fn, *args):
+        """
+        executor.submit() contando los trabajos en vuelo del proceso.
+        """
+        with self.cupo:
+            self.en_vuelo += 1
+        futuro = self.executor.submit(fn, *args)
+        futuro.add_done_callback(self._trabajo_terminado)
+        return futuro
+
+    def _trabajo_terminado(self, futuro):
+        with self.cupo:
+            self.en_vuelo -= 1
+            self.cupo.notify_all()
+
+    def get_request(self):
+        with self.cupo:
+            while self.en_vuelo >= self.hilos:
+                self.cupo.wait()
+        # Si mientras tanto otro proceso tomó la conexión, accept() levanta
+        # BlockingIOError y serve_forever vuelve a esperar
+        request, client_address = self.socket.accept()
+        # El socket de escucha es no bloqueante; las conexiones aceptadas no
+        request.setblocking(True)
+        return request, client_address
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=True)
+
+
+def crear_socket_escucha(host, port, backlog=128):
+    """
+    Crea el socket de escucha que comparten todos los procesos trabajadores.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    # No bloqueante: si varios procesos despiertan por la misma conexión, los que
+    # pierden el accept() vuelven a esperar en lugar de quedar bloqueados
+    sock.setblocking(False)
+    return sock
+
+
+def worker_scale_server(sock, hilos=1):
+    """
+    Proceso trabajador: atiende conexiones aceptadas sobre el socket heredado.
+    """
+    with PoolTCPServer(sock.getsockname(), ScaleHandler, hilos, bind_and_activate=False) as server:
+        server.socket.close()
+        server.socket = sock
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+def run_scale_server(host, port, workers=1, hilos=1):
+    """
+    Levanta el servidor de escalado con `workers` procesos pre-forkeados y `hilos`
+    imágenes en proceso simultáneas por cada uno, todos aceptando en el mismo socket.
+    """
+    sock = crear_socket_escucha(host, port)
+    print(f"Servidor de escalado escuchando en {host}:{port} ({workers} procesos x {hilos} hilos)")
+
+    if workers <= 1:
+        worker_scale_server(sock, hilos)
+        return
+
+    processes = []
+    for _ in range(workers):
+        p = Process(target=worker_scale_server, args=(sock, hilos))
+        processes.append(p)
+        p.start()
+    sock.close()
+
+    # SIGTERM en el padre también baja a los trabajadores
+    signal.signal(signal.SIGTERM, lambda sig, frame: sys.exit(0))
+    try:
+        for p in processes:
+            p.join()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        for p in processes:
+            p.terminate()
+        for p in processes:
+            p.join()
 
 if __name__ == "__main__":
-    p = Process(target=run_scale_server, args=("localhost", 9999))
-    p.start()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Servidor de escalado de imágenes.")
+    parser.add_argument("--host", type=str, default="localhost", help="Dirección IP de escucha")
+    parser.add_argument("-p", "--port", type=int, default=9999, help="Puerto de escucha")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count() or 1,
+                        help="Cantidad de procesos trabajadores")
+    parser.add_argument("-t", "--hilos", type=int, default=1,
+                        help="Imágenes procesadas en simultáneo por cada proceso")
+    parser.add_argument("--backend", choices=disponibles(), default=None,
+                        help="Backend de imágenes (por defecto el de TP_BACKEND, o 'pil')")
+    parser.add_argument("--piramide", type=int, default=0, metavar="MIB",
+                        help="MiB por proceso para cachear pirámides de resolución de las fuentes (0: sin cache)")
+    parser.add_argument("--lado-minimo", type=int, default=LADO_MINIMO,
+                        help="Lado mínimo del nivel más chico de cada pirámide")
+    args = parser.parse_args()
+
+    if args.backend:
+        configurar_backend(args.backend)
+    if args.piramide > 0:
+        # Antes de forkear: cada trabajador hereda su propia cache, vacía
+        configurar_piramides(max_bytes=args.piramide * 1024 * 1024, lado_minimo=args.lado_minimo)
+
+    run_scale_server(args.host, args.port, args.workers, args.hilos)
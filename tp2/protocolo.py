@@ -0,0 +1,294 @@
+# protocolo.py
+#
+# Protocolo binario versión 2, usado entre cliente y server_asinc y entre
+# server_asinc y el servidor de escalado. Cada trama es:
+#
+#   cabecera: magia b'IP' | versión u8 | tipo u8 | id de solicitud u32 |
+#             largo de parámetros u16 | largo del payload u64
+#   parámetros (JSON en UTF-8)
+#   payload
+#
+# Una solicitud es una trama SOLICITUD. La respuesta llega en cero o más tramas
+# DATOS con el mismo id (bloques de la imagen a medida que se codifica) y termina
+# con una trama FIN, o con una trama ERROR cuyos parámetros traen el mensaje.
+# Si el servidor no tiene capacidad responde OCUPADO en lugar de procesarla; el
+# cliente puede reintentar más tarde.
+# El id permite enviar varias solicitudes seguidas sobre la misma conexión y
+# emparejar cada respuesta con su solicitud.
+
+import io
+import json
+import struct
+import asyncio
+import threading
+from collections import namedtuple
+
+MAGIA = b'IP'
+VERSION = 2
+
+SOLICITUD = 1
+DATOS = 2
+FIN = 3
+ERROR = 4
+OCUPADO = 5
+
+CABECERA = struct.Struct('!2sBBIHQ')
+# Píxeles sin comprimir entre server_asinc y el servidor de escalado:
+# modo PIL (ASCII, relleno con espacios) | ancho u32 | alto u32 | bytes por fila u32
+CABECERA_RAW = struct.Struct('!4sIII')
+MAX_ID = 2 ** 32
+TAMANO_BLOQUE = 64 * 1024
+# Al recibir en un archivo, se junta esta cantidad de bytes antes de cada escritura
+TAMANO_ESCRITURA = 1024 * 1024
+
+Trama = namedtuple('Trama', 'tipo id parametros payload')
+
+
+class ErrorProtocolo(ValueError):
+    pass
+
+
+def empaquetar_cabecera(tipo, id_solicitud, parametros, largo_payload):
+    """
+    Devuelve la cabecera y los parámetros codificados, listos para enviar antes del payload.
+    """
+    datos_parametros = json.dumps(parametros, separators=(',', ':')).encode() if parametros else b''
+    cabecera = CABECERA.pack(MAGIA, VERSION, tipo, id_solicitud, len(datos_parametros), largo_payload)
+    return cabecera + datos_parametros
+
+
+def desempaquetar_cabecera(cabecera):
+    """
+    Valida la cabecera y devuelve (tipo, id, largo de parámetros, largo del payload).
+    """
+    magia, version, tipo, id_solicitud, largo_parametros, largo_payload = CABECERA.unpack(cabecera)
+    if magia != MAGIA:
+        raise ErrorProtocolo(f"Magia inválida: {magia!r}")
+    if version != VERSION:
+        raise ErrorProtocolo(f"Versión de protocolo no soportada: {version}")
+    return tipo, id_solicitud, largo_parametros, largo_payload
+
+
+async def leer_encabezado(reader, inicio=b''):
+    """
+    Lee la cabecera y los parámetros de una trama, sin el payload.
+
+    `inicio` son bytes de la cabecera ya consumidos por quien llama. Devuelve
+    (tipo, id, parámetros, largo del payload) o None si la conexión se cerró
+    entre tramas. Sirve para decidir qué hacer con el payload antes de leerlo.
+    """
+    try:
+        cabecera = inicio + await reader.readexactly(CABECERA.size - len(inicio))
+    except asyncio.IncompleteReadError as e:
+        if e.partial or inicio:
+            raise ConnectionError("Conexión cerrada en medio de una cabecera") from e
+        return None
+    tipo, id_solicitud, largo_parametros, largo_payload = desempaquetar_cabecera(cabecera)
+    parametros = json.loads(await reader.readexactly(largo_parametros)) if largo_parametros else {}
+    return tipo, id_solicitud, parametros, largo_payload
+
+
+async def leer_trama(reader, inicio=b''):
+    """
+    Lee una trama completa de un asyncio.StreamReader.
+
+    Devuelve una Trama o None si la conexión se cerró entre tramas.
+    """
+    encabezado = await leer_encabezado(reader, inicio)
+    if encabezado is None:
+        return None
+    tipo, id_solicitud, parametros, largo_payload = encabezado
+    payload = await reader.readexactly(largo_payload) if largo_payload else b''
+    return Trama(tipo, id_solicitud, parametros, payload)
+
+
+async def leer_en_buffer(reader, n, destino=None, tamano_bloque=TAMANO_BLOQUE, tamano_escritura=TAMANO_ESCRITURA):
+    """
+    Lee exactamente n bytes de un StreamReader.
+
+    Sin destino, los guarda en un bytearray preasignado y lo devuelve. Con
+    destino (un archivo), junta `tamano_escritura` bytes y los escribe en un
+    hilo, sin bloquear el event loop, mientras sigue leyendo los siguientes. En
+    ambos casos el buffer del StreamReader no crece más allá de su límite.
+    """
+    buffer = bytearray(n) if destino is None else None
+    vista = memoryview(buffer) if buffer is not None else None
+    pendiente = bytearray()
+    escritura = None
+    recibidos = 0
+    try:
+        while recibidos < n:
+            bloque = await reader.read(min(tamano_bloque, n - recibidos))
+            if not bloque:
+                raise asyncio.IncompleteReadError(b'', n)
+            if destino is None:
+                vista[recibidos:recibidos + len(bloque)] = bloque
+            else:
+                pendiente += bloque
+                if len(pendiente) >= tamano_escritura:
+                    # Una sola escritura en curso a la vez, así el archivo queda en orden
+                    if escritura is not None:
+                        await escritura
+                    escritura = asyncio.ensure_future(asyncio.to_thread(destino.write, pendiente))
+                    pendiente = bytearray()
+            recibidos += len(bloque)
+        if escritura is not None:
+            await escritura
+        if pendiente:
+            await asyncio.to_thread(destino.write, pendiente)
+    finally:
+        # Quien llama cierra el archivo al volver: no dejar un hilo escribiendo en él
+        if escritura is not None and not escritura.done():
+            await asyncio.wait([escritura])
+    return buffer
+
+
+async def descartar(reader, n, tamano_bloque=TAMANO_BLOQUE):
+    """
+    Consume y descarta n bytes de un StreamReader, de a bloques.
+    """
+    while n > 0:
+        bloque = await reader.read(min(tamano_bloque, n))
+        if not bloque:
+            raise asyncio.IncompleteReadError(b'', n)
+        n -= len(bloque)
+
+
+def escribir_trama(writer, tipo, id_solicitud, parametros=None, *payload):
+    """
+    Encola una trama en un asyncio.StreamWriter (hay que hacer drain() después).
+
+    El payload puede venir en varias partes; se pasan al transporte sin concatenarlas.
+    """
+    largo_payload = sum(memoryview(parte).nbytes for parte in payload)
+    writer.writelines([empaquetar_cabecera(tipo, id_solicitud, parametros, largo_payload),
+                       *(parte for parte in payload if len(parte))])
+
+
+def recibir_exacto(sock, n):
+    """
+    Recibe exactamente n bytes de un socket bloqueante en un buffer preasignado.
+
+    Devuelve None si la conexión se cerró antes de empezar a recibir.
+    """
+    buffer = bytearray(n)
+    vista = memoryview(buffer)
+    recibidos = 0
+    while recibidos < n:
+        leidos = sock.recv_into(vista[recibidos:])
+        if not leidos:
+            if recibidos == 0:
+                return None
+            raise ConnectionError("Conexión cerrada antes de recibir todos los datos")
+        recibidos += leidos
+    return buffer
+
+
+def leer_trama_socket(sock, inicio=b''):
+    """
+    Versión bloqueante de leer_trama.
+    """
+    cabecera = recibir_exacto(sock, CABECERA.size - len(inicio))
+    if cabecera is None:
+        if inicio:
+            raise ConnectionError("Conexión cerrada en medio de una cabecera")
+        return None
+    cabecera = inicio + cabecera
+    tipo, id_solicitud, largo_parametros, largo_payload = desempaquetar_cabecera(cabecera)
+    parametros = {}
+    if largo_parametros:
+        datos_parametros = recibir_exacto(sock, largo_parametros)
+        if datos_parametros is None:
+            raise ConnectionError("Conexión cerrada antes de recibir los parámetros")
+        parametros = json.loads(datos_parametros)
+    payload = bytearray()
+    if largo_payload:
+        payload = recibir_exacto(sock, largo_payload)
+        if payload is None:
+            raise ConnectionError("Conexión cerrada antes de recibir el payload")
+    return Trama(tipo, id_solicitud, parametros, payload)
+
+
+def empaquetar_raw(modo, ancho, alto, stride):
+    return CABECERA_RAW.pack(modo.encode().ljust(4), ancho, alto, stride)
+
+
+def desempaquetar_raw(payload):
+    """
+    Devuelve (modo, ancho, alto, stride, píxeles); los píxeles son una vista sin copia.
+
+    Levanta ErrorProtocolo si el payload no alcanza para la cabecera o los píxeles.
+    """
+    if len(payload) < CABECERA_RAW.size:
+        raise ErrorProtocolo(f"Imagen raw truncada: {len(payload)} bytes, la cabecera ocupa {CABECERA_RAW.size}")
+    modo, ancho, alto, stride = CABECERA_RAW.unpack_from(payload)
+    pixeles = memoryview(payload)[CABECERA_RAW.size:]
+    if len(pixeles) < stride * alto:
+        raise ErrorProtocolo(f"Faltan píxeles: {len(pixeles)} bytes para {ancho}x{alto} con stride {stride}")
+    return modo.decode().strip(), ancho, alto, stride, pixeles
+
+
+def enviar_todo(sock, partes):
+    """
+    Envía varios buffers con sendmsg (scatter-gather), sin concatenarlos antes.
+    """
+    partes = [vista for vista in (memoryview(parte).cast('B') for parte in partes) if len(vista)]
+    while partes:
+        enviados = sock.sendmsg(partes)
+        while partes and enviados >= len(partes[0]):
+            enviados -= len(partes[0])
+            partes.pop(0)
+        if enviados:
+            partes[0] = partes[0][enviados:]
+
+
+def enviar_trama_socket(sock, tipo, id_solicitud, parametros=None, *payload):
+    """
+    Envía una trama; el payload puede venir en varias partes (por ejemplo una
+    cabecera raw y los píxeles) que salen juntas sin copiarse.
+    """
+    largo_payload = sum(memoryview(parte).nbytes for parte in payload)
+    enviar_todo(sock, [empaquetar_cabecera(tipo, id_solicitud, parametros, largo_payload), *payload])
+
+
+class EscritorTramas(io.RawIOBase):
+    """
+    Archivo de solo escritura que envía lo escrito como tramas DATOS de un id.
+
+    Sirve para pasarlo a Image.save(): cada bloque sale por el socket en cuanto
+    el codificador lo produce, sin armar la imagen completa en memoria.
+    """
+
+    def __init__(self, sock, id_solicitud, lock=None, tamano_bloque=TAMANO_BLOQUE):
+        super().__init__()
+        self.sock = sock
+        self.id_solicitud = id_solicitud
+        self.lock = lock or threading.Lock()
+        self.tamano_bloque = tamano_bloque
+        self.buffer = bytearray()
+        self.enviados = 0
+
+    def writable(self):
+        return True
+
+    def write(self, datos):
+        self.buffer += datos
+        if len(self.buffer) >= self.tamano_bloque:
+            self._enviar()
+        return len(datos)
+
+    def _enviar(self):
+        if not self.buffer:
+            return
+        with self.lock:
+            enviar_trama_socket(self.sock, DATOS, self.id_solicitud, None, self.buffer)
+        self.enviados += len(self.buffer)
+        self.buffer = bytearray()
+
+    def terminar(self, parametros=None):
+        """
+        Envía lo que quede en el buffer y la trama FIN.
+        """
+        self._enviar()
+        with self.lock:
+            enviar_trama_socket(self.sock, FIN, self.id_solicitud, parametros)
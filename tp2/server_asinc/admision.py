@@ -0,0 +1,170 @@
+# admision.py
+
+import os
+import tempfile
+
+from tp2.protocolo import leer_en_buffer
+
+MAX_PAYLOAD = 256 * 1024 * 1024
+PRESUPUESTO_BYTES = 1024 * 1024 * 1024
+MAX_CONCURRENTES = 64
+UMBRAL_DISCO = 16 * 1024 * 1024
+VENTANA_LOTE = 32
+
+_admision = None
+
+
+class PayloadDemasiadoGrande(ValueError):
+    """
+    El payload declarado supera el máximo configurado.
+    """
+
+
+class SinCapacidad(RuntimeError):
+    """
+    Aceptar la solicitud superaría el presupuesto de bytes o de solicitudes en curso.
+    """
+
+
+class Reserva:
+    """
+    Capacidad tomada por una solicitud admitida; se devuelve con liberar().
+
+    La reserva es dueña del payload de la solicitud (`payload`, si se lo
+    asigna). Si otro trabajo lo sigue usando después de que termine la
+    solicitud (un cálculo compartido de la cache), lo retiene con retener() y lo
+    suelta con liberar(): con el último liberar() vuelve la capacidad y se
+    borra el payload en disco.
+    """
+
+    def __init__(self, control, tamano):
+        self.control = control
+        self.tamano = tamano
+        self.payload = None
+        self.liberada = False
+        self._usos = 1
+
+    def retener(self):
+        if self.liberada:
+            raise RuntimeError("La reserva ya se liberó")
+        self._usos += 1
+
+    def liberar(self):
+        if self.liberada:
+            return
+        self._usos -= 1
+        if self._usos == 0:
+            self.liberada = True
+            self.control._devolver(self.tamano)
+            descartar_payload(self.payload)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.liberar()
+
+
+class ControlAdmision:
+    """
+    Decide, con la cabecera de la solicitud y antes de leer el payload, si se la
+    puede atender:
+
+    - ningún payload puede superar `max_payload` bytes;
+    - la suma de los payloads en curso no puede superar `presupuesto_bytes`;
+    - no puede haber más de `max_concurrentes` solicitudes en curso.
+
+    Una solicitud sigue en curso mientras algún cálculo use su payload, aunque
+    ya se haya respondido (ver Reserva.retener).
+
+    No hay espera: si no hay lugar, se rechaza enseguida y el cliente decide
+    cuándo reintentar. Los payloads de más de `umbral_disco` bytes se reciben
+    en un archivo temporal en lugar de en memoria.
+
+    Una conexión en modo lote no procesa más de `max_ventana_lote` solicitudes
+    a la vez: mientras tiene la ventana llena no se leen solicitudes nuevas.
+
+    Solo se usa desde el event loop, así que no necesita locks.
+    """
+
+    def __init__(self, max_payload=MAX_PAYLOAD, presupuesto_bytes=PRESUPUESTO_BYTES,
+                 max_concurrentes=MAX_CONCURRENTES, umbral_disco=UMBRAL_DISCO, directorio_temporal=None,
+                 max_ventana_lote=VENTANA_LOTE):
+        self.max_payload = max_payload
+        self.presupuesto_bytes = presupuesto_bytes
+        self.max_concurrentes = max_concurrentes
+        self.umbral_disco = umbral_disco
+        self.directorio_temporal = directorio_temporal
+        self.max_ventana_lote = max_ventana_lote
+        self.bytes_en_curso = 0
+        self.en_curso = 0
+
+    def admitir(self, tamano):
+        """
+        Toma capacidad para un payload de `tamano` bytes y devuelve la Reserva.
+        """
+        if tamano > self.max_payload:
+            raise PayloadDemasiadoGrande(f"El payload de {tamano} bytes supera el máximo de {self.max_payload}")
+        if self.en_curso >= self.max_concurrentes:
+            raise SinCapacidad(f"Hay {self.en_curso} solicitudes en curso")
+        if self.bytes_en_curso + tamano > self.presupuesto_bytes:
+            raise SinCapacidad(f"No hay presupuesto para {tamano} bytes más")
+        self.en_curso += 1
+        self.bytes_en_curso += tamano
+        return Reserva(self, tamano)
+
+    def _devolver(self, tamano):
+        self.en_curso -= 1
+        self.bytes_en_curso -= tamano
+
+    async def recibir(self, reader, tamano):
+        """
+        Lee el payload: en un bytearray preasignado, o en un archivo temporal si
+        supera `umbral_disco`. En ese caso devuelve la ruta: se asigna a
+        Reserva.payload y se borra con el último liberar() de la reserva.
+        """
+        if tamano <= self.umbral_disco:
+            return await leer_en_buffer(reader, tamano)
+
+        descriptor, ruta = tempfile.mkstemp(prefix='tp2-', suffix='.img', dir=self.directorio_temporal)
+        try:
+            with os.fdopen(descriptor, 'wb') as f:
+                await leer_en_buffer(reader, tamano, f)
+        except BaseException:
+            os.remove(ruta)
+            raise
+        return ruta
+
+
+def tamano_payload(data):
+    """
+    Tamaño en bytes de un payload en memoria o en un archivo temporal.
+    """
+    return os.path.getsize(data) if isinstance(data, str) else len(data)
+
+
+def descartar_payload(data):
+    if isinstance(data, str):
+        try:
+            os.remove(data)
+        except FileNotFoundError:
+            pass
+
+
+def configurar_admision(**opciones):
+    """
+    Reemplaza el control de admisión del proceso por uno nuevo con estas opciones.
+    """
+    global _admision
+    _admision = ControlAdmision(**opciones)
+    return _admision
+
+
+def obtener_admision():
+    """
+    Devuelve el control de admisión del proceso, creándolo la primera vez.
+    """
+    global _admision
+    if _admision is None:
+        _admision = ControlAdmision()
+    return _admision
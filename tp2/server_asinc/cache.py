@@ -0,0 +1,297 @@
+# cache.py
+
+import os
+import json
+import asyncio
+import hashlib
+from collections import OrderedDict
+from contextlib import aclosing
+
+TAMANO_BLOQUE = 64 * 1024
+
+_cache = None
+
+
+def calcular_clave(data, parametros):
+    """
+    Clave de contenido: hash de los bytes de entrada más los parámetros de la operación.
+
+    `data` puede ser la ruta de un archivo con los bytes; se lee de a bloques.
+    """
+    h = hashlib.blake2b(digest_size=20)
+    if isinstance(data, str):
+        with open(data, 'rb') as f:
+            for bloque in iter(lambda: f.read(1024 * 1024), b''):
+                h.update(bloque)
+    else:
+        h.update(data)
+    h.update(json.dumps(parametros, sort_keys=True, separators=(',', ':')).encode())
+    return h.hexdigest()
+
+
+class _Produccion:
+    """
+    Un resultado que se está calculando. Una tarea propia lo produce y cada
+    solicitud idéntica lee los bloques a su ritmo: un cliente lento no frena
+    a los demás. Si todos los lectores se van antes de terminar, se cancela.
+    """
+
+    def __init__(self):
+        self.bloques = []
+        self.terminado = False
+        self.error = None
+        self.lectores = 0
+        self.tarea = None
+        self._novedad = asyncio.Event()
+
+    def agregar(self, bloque):
+        self.bloques.append(bloque)
+        self._avisar()
+
+    def terminar(self, error=None):
+        self.terminado = True
+        self.error = error
+        self._avisar()
+
+    def _avisar(self):
+        self._novedad.set()
+        self._novedad = asyncio.Event()
+
+    async def leer(self):
+        """
+        Bloques del resultado desde el principio; relanza el error del cálculo si falló.
+        """
+        i = 0
+        while True:
+            while i < len(self.bloques):
+                yield self.bloques[i]
+                i += 1
+            if self.terminado:
+                break
+            await self._novedad.wait()
+        if self.error is not None:
+            raise self.error
+
+
+class CacheResultados:
+    """
+    Cache de resultados direccionada por contenido, con dos niveles.
+
+    - Memoria: LRU limitado a `max_bytes_memoria`.
+    - Disco (opcional, si se pasa `directorio`): un archivo por resultado, limitado
+      a `max_bytes_disco`; se desaloja el menos usado recientemente.
+
+    Las solicitudes idénticas que llegan mientras una se está calculando esperan
+    ese mismo cálculo en lugar de repetirlo (single-flight).
+    """
+
+    def __init__(self, max_bytes_memoria=256 * 1024 * 1024, directorio=None, max_bytes_disco=2 * 1024 ** 3):
+        self.max_bytes_memoria = max_bytes_memoria
+        self.directorio = directorio
+        self.max_bytes_disco = max_bytes_disco
+        self._memoria = OrderedDict()
+        self._bytes_memoria = 0
+        self._disco = OrderedDict()
+        self._bytes_disco = 0
+        self._en_curso = {}
+        self.contadores = {
+            'aciertos_memoria': 0,
+            'aciertos_disco': 0,
+            'fallos': 0,
+            'colapsadas': 0,
+            'desalojos_memoria': 0,
+            'desalojos_disco': 0,
+        }
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+            self._cargar_indice_disco()
+
+    def estadisticas(self):
+        return dict(self.contadores,
+                    bytes_memoria=self._bytes_memoria, entradas_memoria=len(self._memoria),
+                    bytes_disco=self._bytes_disco, entradas_disco=len(self._disco))
+
+    # Memoria
+
+    def _guardar_memoria(self, clave, valor):
+        if len(valor) > self.max_bytes_memoria:
+            return
+        if clave in self._memoria:
+            self._bytes_memoria -= len(self._memoria.pop(clave))
+        self._memoria[clave] = valor
+        self._bytes_memoria += len(valor)
+        while self._bytes_memoria > self.max_bytes_memoria:
+            _, desalojado = self._memoria.popitem(last=False)
+            self._bytes_memoria -= len(desalojado)
+            self.contadores['desalojos_memoria'] += 1
+
+    # Disco
+
+    def _ruta(self, clave):
+        return os.path.join(self.directorio, clave)
+
+    def _cargar_indice_disco(self):
+        entradas = []
+        for nombre in os.listdir(self.directorio):
+            if nombre.endswith('.tmp'):
+                os.remove(os.path.join(self.directorio, nombre))
+                continue
+            info = os.stat(os.path.join(self.directorio, nombre))
+            entradas.append((info.st_mtime, nombre, info.st_size))
+        for _, nombre, tamano in sorted(entradas):
+            self._disco[nombre] = tamano
+            self._bytes_disco += tamano
+
+    def _leer_disco(self, clave):
+        ruta = self._ruta(clave)
+        with open(ruta, 'rb') as f:
+            valor = f.read()
+        os.utime(ruta)
+        return valor
+
+    def _escribir_disco(self, clave, valor):
+        temporal = self._ruta(clave) + '.tmp'
+        with open(temporal, 'wb') as f:
+            f.write(valor)
+        os.replace(temporal, self._ruta(clave))
+
+    def _borrar_disco(self, claves):
+        for clave in claves:
+            try:
+                os.remove(self._ruta(clave))
+            except FileNotFoundError:
+                pass
+
+    async def _guardar_disco(self, clave, valor):
+        if not self.directorio or len(valor) > self.max_bytes_disco or clave in self._disco:
+            return
+        await asyncio.to_thread(self._escribir_disco, clave, valor)
+        self._disco[clave] = len(valor)
+        self._bytes_disco += len(valor)
+        desalojadas = []
+        while self._bytes_disco > self.max_bytes_disco:
+            desalojada, tamano = self._disco.popitem(last=False)
+            self._bytes_disco -= tamano
+            desalojadas.append(desalojada)
+            self.contadores['desalojos_disco'] += 1
+        if desalojadas:
+            await asyncio.to_thread(self._borrar_disco, desalojadas)
+
+    async def _buscar(self, clave):
+        valor = self._memoria.get(clave)
+        if valor is not None:
+            self._memoria.move_to_end(clave)
+            self.contadores['aciertos_memoria'] += 1
+            return valor
+        if clave in self._disco:
+            try:
+                valor = await asyncio.to_thread(self._leer_disco, clave)
+            except FileNotFoundError:
+                self._bytes_disco -= self._disco.pop(clave, 0)
+                return None
+            if clave in self._disco:
+                self._disco.move_to_end(clave)
+            self.contadores['aciertos_disco'] += 1
+            self._guardar_memoria(clave, valor)
+            return valor
+        return None
+
+    async def servir(self, clave, producir, recursos=None):
+        """
+        Devuelve los bloques del resultado para `clave`.
+
+        Si no está en cache y nadie lo está calculando, lanza una tarea que
+        consume producir() (un iterador asíncrono de bloques) y guarda el
+        resultado completo al terminar. Quien lo lanzó y las solicitudes
+        idénticas que llegan mientras tanto reciben los bloques a medida que se
+        producen, cada una a su ritmo.
+
+        La tarea puede seguir después de que termine la solicitud que la lanzó
+        (si se va su cliente o le vence el plazo, las demás siguen leyendo):
+        `recursos` (con retener() y liberar()) es lo que producir() usa de esa
+        solicitud, como su payload; la tarea lo retiene hasta terminar.
+        producir() no debería depender del plazo de ninguna solicitud: cada
+        una aplica el suyo mientras lee.
+        """
+        while True:
+            valor = await self._buscar(clave)
+            if valor is not None:
+                for inicio in range(0, len(valor), TAMANO_BLOQUE):
+                    yield valor[inicio:inicio + TAMANO_BLOQUE]
+                return
+
+            produccion = self._en_curso.get(clave)
+            propia = produccion is None
+            if propia:
+                self.contadores['fallos'] += 1
+                produccion = _Produccion()
+                self._en_curso[clave] = produccion
+                if recursos is not None:
+                    recursos.retener()
+                produccion.tarea = asyncio.create_task(self._producir(clave, produccion, producir))
+                # En un callback y no en un finally: corre aunque la tarea se cancele antes de empezar
+                produccion.tarea.add_done_callback(lambda _, p=produccion: self._terminada(p, recursos))
+            else:
+                self.contadores['colapsadas'] += 1
+
+            enviados = 0
+            produccion.lectores += 1
+            try:
+                async for bloque in produccion.leer():
+                    enviados += 1
+                    yield bloque
+                return
+            except Exception:
+                # Si falló el cálculo de otra solicitud y todavía no se envió
+                # nada, volver a intentar; si no, el error es de esta respuesta
+                if propia or enviados:
+                    raise
+            finally:
+                produccion.lectores -= 1
+                if produccion.lectores == 0 and not produccion.terminado:
+                    # Nadie espera el resultado: no tiene sentido seguir calculándolo
+                    self._abandonar(clave, produccion)
+
+    def _abandonar(self, clave, produccion):
+        if self._en_curso.get(clave) is produccion:
+            del self._en_curso[clave]
+        produccion.tarea.cancel()
+
+    @staticmethod
+    def _terminada(produccion, recursos):
+        if not produccion.terminado:
+            produccion.terminar(ConnectionError("El cálculo se interrumpió"))
+        if recursos is not None:
+            recursos.liberar()
+
+    async def _producir(self, clave, produccion, producir):
+        try:
+            async with aclosing(producir()) as bloques:
+                async for bloque in bloques:
+                    produccion.agregar(bloque)
+            valor = b''.join(produccion.bloques)
+            self._guardar_memoria(clave, valor)
+        except Exception as e:
+            produccion.terminar(e)
+            return
+        finally:
+            if self._en_curso.get(clave) is produccion:
+                del self._en_curso[clave]
+        produccion.terminar()
+        await self._guardar_disco(clave, valor)
+
+
+def configurar_cache(**opciones):
+    """
+    Reemplaza la cache del proceso por una nueva con estas opciones.
+    """
+    global _cache
+    _cache = CacheResultados(**opciones)
+    return _cache
+
+
+def obtener_cache():
+    """
+    Devuelve la cache del proceso, o None si no se configuró.
+    """
+    return _cache
@@ -0,0 +1,237 @@
+# ejecutores.py
+
+import io
+import os
+import time
+import signal
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from PIL import Image
+
+from tp1.backends import a_grises_pil
+from tp1.cancelacion import TokenCancelacion
+
+# Imágenes de este tamaño o más se procesan en el pool de procesos
+UMBRAL_PROCESO = 1024 * 1024
+TAMANO_BLOQUE = 64 * 1024
+
+MODULOS_PRECARGADOS = ['PIL.Image', 'PIL.PngImagePlugin', 'tp1.backends', 'tp2.server_asinc.ejecutores']
+
+_ejecutores = None
+
+
+def decodificar_a_grises(data):
+    """
+    Decodifica la imagen y la convierte a escala de grises.
+
+    Devuelve (modo, ancho, alto, stride, píxeles) sin comprimir, listo para el
+    servidor de escalado, y los segundos que llevó cada etapa (puede correr en
+    otro proceso, así que los tiempos vuelven con el resultado). `data` puede ser
+    la ruta de un archivo con la imagen.
+    """
+    inicio = time.perf_counter()
+    image = Image.open(data if isinstance(data, str) else io.BytesIO(data))
+    image.load()
+    decodificado = time.perf_counter()
+    image = a_grises_pil(image)
+    pixeles = image.tobytes()
+    tiempos = {'decodificacion': decodificado - inicio, 'conversion': time.perf_counter() - decodificado}
+    return (image.mode, image.width, image.height, len(pixeles) // max(image.height, 1), pixeles), tiempos
+
+
+def codificar(modo, ancho, alto, stride, pixeles, formato, fp):
+    """
+    Codifica píxeles sin comprimir en fp con el formato pedido (PNG, JPEG, ...).
+    """
+    Image.frombuffer(modo, (ancho, alto), pixeles, 'raw', modo, stride, 1).save(fp, format=formato)
+
+
+class _EscritorCola(io.RawIOBase):
+    """
+    Archivo de solo escritura, usado desde un hilo, que pasa bloques a una asyncio.Queue.
+
+    Si se cancela `cancelacion`, la siguiente escritura levanta TrabajoCancelado
+    y el codificador se detiene ahí.
+    """
+
+    def __init__(self, loop, cola, tamano_bloque=TAMANO_BLOQUE, cancelacion=None):
+        super().__init__()
+        self.loop = loop
+        self.cola = cola
+        self.tamano_bloque = tamano_bloque
+        self.cancelacion = cancelacion
+        self.buffer = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, datos):
+        if self.cancelacion is not None:
+            self.cancelacion.verificar()
+        self.buffer += datos
+        if len(self.buffer) >= self.tamano_bloque:
+            self.vaciar()
+        return len(datos)
+
+    def vaciar(self):
+        if self.buffer:
+            self.loop.call_soon_threadsafe(self.cola.put_nowait, bytes(self.buffer))
+            self.buffer = bytearray()
+
+
+def _en_buffer(fn, args, cancelacion):
+    # En el pool de procesos: fn escribe en memoria y vuelve el resultado entero
+    fp = io.BytesIO()
+    fn(*args, fp, cancelacion)
+    return fp.getvalue()
+
+
+def _inicializar_trabajador():
+    # Ctrl-C es para el proceso servidor, que cierra el pool al terminar
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    Image.init()
+
+
+class CapaEjecutores:
+    """
+    Saca el trabajo de PIL del event loop.
+
+    - Un pool de procesos para decodificar/codificar imágenes grandes, que no
+      compiten por el GIL del servidor.
+    - Un pool de hilos para imágenes chicas y operaciones donde PIL libera el GIL,
+      que evitan copiar los bytes a otro proceso.
+
+    Con modo='hilo' todo va al pool de hilos.
+    """
+
+    def __init__(self, modo='proceso', procesos=None, hilos=None, umbral_proceso=UMBRAL_PROCESO):
+        self.modo = modo
+        self.umbral_proceso = umbral_proceso
+        self.hilos = ThreadPoolExecutor(max_workers=hilos or min(32, (os.cpu_count() or 1) + 4))
+        self.procesos = None
+        if modo == 'proceso':
+            disponibles = multiprocessing.get_all_start_methods()
+            contexto = multiprocessing.get_context('forkserver' if 'forkserver' in disponibles else 'spawn')
+            if contexto.get_start_method() == 'forkserver':
+                contexto.set_forkserver_preload(MODULOS_PRECARGADOS)
+            self.procesos = ProcessPoolExecutor(max_workers=procesos or os.cpu_count() or 1,
+                                                mp_context=contexto, initializer=_inicializar_trabajador)
+
+    async def pesado(self, tamano, fn, *args):
+        """
+        Ejecuta fn(*args) en el pool de procesos si `tamano` (bytes) supera el umbral,
+        o en el de hilos si no.
+        """
+        executor = self.procesos if self.procesos is not None and tamano >= self.umbral_proceso else self.hilos
+        return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+
+    async def codificar_en_bloques(self, modo, ancho, alto, stride, pixeles, formato="PNG", traza=None):
+        """
+        Codifica la imagen en el pool de hilos y devuelve los bloques a medida que
+        el codificador los produce, sin esperar a tener el archivo completo.
+        """
+        async for bloque in self.en_bloques(codificar, modo, ancho, alto, stride, pixeles, formato, traza=traza):
+            yield bloque
+
+    async def en_bloques(self, fn, *args, traza=None, etapa='codificacion'):
+        """
+        Corre fn(*args, fp) en el pool de hilos y devuelve los bloques que fn
+        escribe en fp a medida que los produce.
+
+        Si se pasa una traza, registra en `etapa` el tiempo de fn. Si se
+        abandona el iterador (la tarea se canceló), el hilo se detiene en su
+        próxima escritura.
+        """
+        loop = asyncio.get_running_loop()
+        cola = asyncio.Queue()
+        cancelacion = TokenCancelacion()
+        escritor = _EscritorCola(loop, cola, cancelacion=cancelacion)
+
+        def trabajo():
+            inicio = time.perf_counter()
+            try:
+                fn(*args, escritor)
+                escritor.vaciar()
+            finally:
+                if traza is not None:
+                    traza.agregar(etapa, time.perf_counter() - inicio)
+                loop.call_soon_threadsafe(cola.put_nowait, None)
+
+        futuro = loop.run_in_executor(self.hilos, trabajo)
+        terminado = False
+        try:
+            while True:
+                bloque = await cola.get()
+                if bloque is None:
+                    terminado = True
+                    break
+                yield bloque
+        finally:
+            if not terminado:
+                cancelacion.cancelar("Se abandonó la respuesta")
+                # Nadie va a esperar el resultado: marcar el error como leído
+                futuro.add_done_callback(lambda f: f.cancelled() or f.exception())
+        await futuro
+
+    async def pesado_en_bloques(self, tamano, fn, *args, traza=None, etapa='codificacion'):
+        """
+        Como en_bloques(), pero si `tamano` (bytes) supera el umbral corre
+        fn(*args, fp, cancelacion) en el pool de procesos, igual que pesado(),
+        para no ocupar con imágenes grandes los hilos que codifican las demás
+        respuestas. Entre procesos los bloques no salen a medida que se
+        producen: fn escribe en memoria y el resultado vuelve entero.
+
+        Si se abandona el iterador, el trabajo se cancela con un TokenCancelacion.
+        """
+        if self.procesos is None or tamano < self.umbral_proceso:
+            async for bloque in self.en_bloques(fn, *args, traza=traza, etapa=etapa):
+                yield bloque
+            return
+
+        cancelacion = TokenCancelacion()
+        inicio = time.perf_counter()
+        try:
+            datos = await asyncio.get_running_loop().run_in_executor(self.procesos, _en_buffer, fn, args,
+                                                                     cancelacion)
+        except asyncio.CancelledError:
+            cancelacion.cancelar("Se abandonó la respuesta")
+            raise
+        finally:
+            if traza is not None:
+                traza.agregar(etapa, time.perf_counter() - inicio)
+            cancelacion.cerrar()
+        for desde in range(0, len(datos), TAMANO_BLOQUE):
+            yield datos[desde:desde + TAMANO_BLOQUE]
+
+    async def liviano(self, fn, *args):
+        """
+        Ejecuta fn(*args) en el pool de hilos.
+        """
+        return await asyncio.get_running_loop().run_in_executor(self.hilos, fn, *args)
+
+    def cerrar(self):
+        self.hilos.shutdown(wait=True)
+        if self.procesos is not None:
+            self.procesos.shutdown(wait=True)
+
+
+def configurar_ejecutores(**opciones):
+    """
+    Reemplaza la capa de ejecutores del proceso por una nueva con estas opciones.
+    """
+    global _ejecutores
+    if _ejecutores is not None:
+        _ejecutores.cerrar()
+    _ejecutores = CapaEjecutores(**opciones)
+    return _ejecutores
+
+
+def obtener_ejecutores():
+    """
+    Devuelve la capa de ejecutores del proceso, creándola la primera vez.
+    """
+    global _ejecutores
+    if _ejecutores is None:
+        _ejecutores = CapaEjecutores()
+    return _ejecutores
@@ -1,70 +1,757 @@
+import os
+import time
+import signal
+import socket
 import asyncio
 import argparse
-from PIL import Image
-import io
-from tp2.server_asinc.utililades import send_to_scale_server  # Importa la función auxiliar para la comunicación con el segundo servidor
+import multiprocessing
+from multiprocessing.connection import wait
+from tp1.backends import configurar_backend, disponibles
+from tp1.cadena import compilar, ejecutar_cadena
+from tp2.metricas import iniciar_servidor_estadisticas, obtener_metricas
+from tp2.protocolo import (DATOS, ERROR, FIN, MAGIA, OCUPADO, SOLICITUD, ErrorProtocolo, descartar,
+                           escribir_trama, leer_encabezado)
+from tp2.server_asinc.utililades import ErrorEscalado, configurar_escalado, obtener_pool, parsear_endpoint, scale_raw  # Importa la función auxiliar para la comunicación con el segundo servidor
+from tp2.server_asinc.cache import calcular_clave, configurar_cache, obtener_cache
+from tp2.server_asinc.admision import (MAX_CONCURRENTES, VENTANA_LOTE, PayloadDemasiadoGrande, SinCapacidad,
+                                      configurar_admision, obtener_admision, tamano_payload)
+from tp2.server_asinc.ejecutores import UMBRAL_PROCESO, configurar_ejecutores, decodificar_a_grises, obtener_ejecutores
 
-async def handle_client(reader, writer):
+ESCALA_POR_DEFECTO = 0.7  # Factor de escala 0.7 (ejemplo)
+# Bloques de respuesta que puede adelantar una solicitud mientras espera su turno de envío
+BLOQUES_EN_COLA = 16
+# Sugerencia de espera para los clientes rechazados por falta de capacidad
+REINTENTAR_MS = 100
+
+# Segundos que se espera a las conexiones abiertas al recibir SIGTERM
+GRACIA = 30.0
+# Un trabajador que muere antes de este tiempo se reinicia con demora
+VIDA_MINIMA = 1.0
+
+metricas = obtener_metricas('asinc')
+_conexiones = set()
+# Se activa con SIGTERM: desde ahí las conexiones no leen solicitudes nuevas
+_drenaje = None
+
+
+async def esperar_trama(reader):
+    """
+    Espera el primer byte de la próxima trama (o del encabezado v1).
+
+    Devuelve b'' si el cliente cerró la conexión o si el servidor empezó a
+    drenar: así una conexión inactiva se cierra enseguida y una con respuestas
+    pendientes las termina sin aceptar solicitudes nuevas.
+    """
+    if _drenaje is None:
+        return await reader.read(1)
+    if _drenaje.is_set():
+        return b''
+    lectura = asyncio.ensure_future(reader.read(1))
+    drenaje = asyncio.ensure_future(_drenaje.wait())
+    try:
+        await asyncio.wait({lectura, drenaje}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        drenaje.cancel()
+        if not lectura.done():
+            lectura.cancel()
+    if _drenaje.is_set():
+        return b''
+    return lectura.result()
+
+async def handle_client(reader, writer, ejecutores=None):
+    ejecutores = ejecutores or obtener_ejecutores()
+    metricas.ajustar('conexiones', 1)
+    _conexiones.add(asyncio.current_task())
     try:
-        # Leer el encabezado de 4 bytes que indica el tamaño de la imagen
-        data_size_bytes = await reader.read(4)
-        if not data_size_bytes:
-            print("Error: No se recibió el tamaño de los datos.")
-            writer.close()
+        # Los clientes v2 empiezan con la magia del protocolo; los demás mandan
+        # directamente el encabezado de 4 bytes con el tamaño de la imagen
+        inicio = await esperar_trama(reader)
+        if not inicio:
+            return
+        inicio += await reader.readexactly(len(MAGIA) - 1)
+        if inicio == MAGIA:
+            await atender_v2(reader, writer, ejecutores, inicio)
+        else:
+            await atender_v1(reader, writer, ejecutores, inicio)
+    except asyncio.IncompleteReadError:
+        print("Error: Conexión cerrada antes de recibir todos los datos de la imagen.")
+    except asyncio.CancelledError:
+        # El cliente se fue (o se vence la gracia al apagar) y ya se cancelaron
+        # sus solicitudes; la tarea termina normalmente para que asyncio no lo
+        # reporte como error
+        print("Conexión cancelada.")
+    except Exception as e:
+        print(f"Error en handle_client: {e}")
+    finally:
+        metricas.ajustar('conexiones', -1)
+        _conexiones.discard(asyncio.current_task())
+        writer.close()
+        try:
             await writer.wait_closed()
+        except OSError:
+            pass
+
+
+async def procesar_imagen(data, parametros, ejecutores, cache=None, traza=None, limite=None, recursos=None):
+    """
+    Convierte la imagen a escala de grises, la manda a escalar y devuelve los
+    bloques de la imagen escalada a medida que llegan.
+
+    Si hay cache, las imágenes ya procesadas con los mismos parámetros se
+    responden sin repetir el trabajo; un 'nonce' en los parámetros entra en la
+    clave, así esa solicitud nunca acierta. Con escala None no se pasa por el
+    servidor de escalado. `limite` (reloj del event loop) es el plazo de la solicitud; lo que quede de él se
+    reenvía al servidor de escalado.
+
+    Con cache el cálculo se comparte entre solicitudes idénticas, así que no
+    lleva el plazo de ninguna (cada una lo aplica mientras espera) y retiene
+    `recursos` (la Reserva dueña de `data`) hasta terminar.
+
+    Con 'ops' (una cadena como "gray|scale:0.7|blur:2|png") la imagen no pasa
+    por el servidor de escalado: la cadena se compila y se ejecuta acá, por
+    bandas. Las imágenes chicas van al pool de hilos y cada banda sale
+    codificada apenas está lista; las grandes, al pool de procesos.
+    """
+    traza = traza or metricas.traza()
+    cache = cache or obtener_cache()
+    limite_calculo = limite if cache is None else None
+    ops = parametros.get('ops')
+    if ops is not None:
+        plan = compilar(ops)
+        clave_parametros = {'ops': plan.canonica}
+
+        def producir():
+            return ejecutores.pesado_en_bloques(tamano_payload(data), ejecutar_cadena, plan, data, traza=traza,
+                                                etapa='cadena')
+    else:
+        escala = parametros.get('escala', ESCALA_POR_DEFECTO)
+        escala = None if escala is None else float(escala)
+        clave_parametros = {'modo': 'L', 'escala': escala, 'formato': 'PNG'}
+
+        def producir():
+            return convertir_y_escalar(data, escala, ejecutores, traza, limite_calculo)
+
+    if parametros.get('nonce') is not None:
+        # Distinto en cada solicitud (carga --sin-cache): fuerza un fallo de la cache
+        clave_parametros['nonce'] = str(parametros['nonce'])
+    if cache is None:
+        async for bloque in producir():
+            yield bloque
+        return
+
+    with traza.etapa('clave_cache'):
+        clave = await ejecutores.liviano(calcular_clave, data, clave_parametros)
+    async for bloque in cache.servir(clave, producir, recursos):
+        yield bloque
+
+
+async def convertir_y_escalar(data, escala, ejecutores, traza=None, limite=None):
+    traza = traza or metricas.traza()
+    # Decodificar y convertir a escala de grises fuera del event loop
+    inicio = time.perf_counter()
+    with metricas.en_curso('en_cola_ejecutor'):
+        gris, tiempos = await ejecutores.pesado(tamano_payload(data), decodificar_a_grises, data)
+    for etapa, segundos in tiempos.items():
+        traza.agregar(etapa, segundos)
+    traza.agregar('espera_ejecutor', time.perf_counter() - inicio - sum(tiempos.values()))
+    print("Imagen convertida a escala de grises.")
+
+    # Los píxeles viajan sin comprimir al servidor de escalado y vuelven igual;
+    # la imagen se codifica una sola vez, acá, hacia el cliente
+    if escala is None:
+        modo, ancho, alto, stride, pixeles = gris
+    else:
+        with traza.etapa('escalado'):
+            modo, ancho, alto, stride, pixeles = await scale_raw(*gris, escala,
+                                                                 plazo_ms=plazo_restante_ms(limite))
+    async for bloque in ejecutores.codificar_en_bloques(modo, ancho, alto, stride, pixeles, "PNG", traza):
+        yield bloque
+    print("Imagen escalada enviada de vuelta al cliente.")
+
+
+def limite_de(parametros):
+    """
+    Instante (reloj del event loop) en que vence el plazo 'plazo_ms' de una
+    solicitud, contado desde ahora; None si no tiene plazo.
+    """
+    plazo_ms = parametros.get('plazo_ms')
+    if plazo_ms is None:
+        return None
+    return asyncio.get_running_loop().time() + float(plazo_ms) / 1000
+
+
+def plazo_restante_ms(limite):
+    if limite is None:
+        return None
+    return max(1, int((limite - asyncio.get_running_loop().time()) * 1000))
+
+
+def drenando():
+    return _drenaje is not None and _drenaje.is_set()
+
+
+def cliente_se_fue(escritor, tareas):
+    """
+    EOF en una conexión v2: nadie va a leer las respuestas pendientes, así que
+    se cancelan las solicitudes en curso (y con ellas su trabajo en los pools y
+    en el servidor de escalado) y la tarea que escribe las respuestas.
+    """
+    if tareas:
+        metricas.incrementar('desconexiones')
+        print(f"El cliente se fue con {len(tareas)} solicitudes en curso; se cancelan.")
+    for tarea in list(tareas):
+        tarea.cancel()
+    escritor.cancel()
+
+
+def cancelar_si_falla(escritor, tareas):
+    """
+    Si la tarea que escribe al cliente termina con error (el cliente se fue),
+    cancela las solicitudes de la conexión y la tarea que la atiende: nadie va
+    a leer esas respuestas.
+    """
+    principal = asyncio.current_task()
+
+    def al_terminar(tarea):
+        if tarea.cancelled() or tarea.exception() is None:
             return
+        metricas.incrementar('desconexiones')
+        for pendiente in list(tareas):
+            pendiente.cancel()
+        principal.cancel()
+
+    escritor.add_done_callback(al_terminar)
+
 
-        data_size = int.from_bytes(data_size_bytes, byteorder='big')
-        print(f"Tamaño de la imagen recibido: {data_size} bytes")
-
-        # Leer los datos de la imagen en fragmentos hasta completar data_size
-        data = b""
-        while len(data) < data_size:
-            packet = await reader.read(data_size - len(data))
-            if not packet:
-                print("Error: Conexión cerrada antes de recibir todos los datos de la imagen.")
-                writer.close()
-                await writer.wait_closed()
+async def atender_v1(reader, writer, ejecutores, inicio):
+    """
+    Protocolo original: 4 bytes con el tamaño y la imagen; la respuesta va sin
+    encabezado y la conexión se cierra al terminar.
+    """
+    admision = obtener_admision()
+    traza = metricas.traza()
+    data_size = int.from_bytes(inicio + await reader.readexactly(4 - len(inicio)), byteorder='big')
+    print(f"Tamaño de la imagen recibido: {data_size} bytes")
+    # Este protocolo no tiene cómo avisar el rechazo: se corta la conexión
+    try:
+        reserva = admision.admitir(data_size)
+    except (PayloadDemasiadoGrande, SinCapacidad) as e:
+        metricas.incrementar('rechazadas')
+        print(f"Solicitud rechazada: {e}")
+        return
+
+    data = None
+    vigia = None
+    try:
+        with traza.etapa('recepcion'):
+            data = await admision.recibir(reader, data_size)
+        reserva.payload = data
+        metricas.incrementar('bytes_entrada', data_size)
+
+        # Después de la imagen el cliente v1 solo espera: si la lectura termina
+        # (EOF o error), se fue y no tiene sentido seguir procesando
+        principal = asyncio.current_task()
+
+        def cliente_desconectado(lectura):
+            if lectura.cancelled():
                 return
-            data += packet
+            lectura.exception()
+            metricas.incrementar('desconexiones')
+            principal.cancel()
 
-        # Convertir a escala de grises
-        try:
-            image = Image.open(io.BytesIO(data)).convert("L")  # Convertir a escala de grises
-            print("Imagen convertida a escala de grises.")
-        except OSError as e:
-            print(f"Error al abrir la imagen: {e}")
-            writer.close()
-            await writer.wait_closed()
-            return
+        vigia = asyncio.create_task(reader.read(1))
+        vigia.add_done_callback(cliente_desconectado)
+        with metricas.en_curso('en_vuelo'):
+            async for bloque in procesar_imagen(data, {}, ejecutores, traza=traza, recursos=reserva):
+                with traza.etapa('envio'):
+                    writer.write(bloque)
+                    await writer.drain()
+                metricas.incrementar('bytes_salida', len(bloque))
+    except asyncio.CancelledError:
+        metricas.incrementar('canceladas')
+        raise
+    finally:
+        if vigia is not None:
+            vigia.cancel()
+        # Con el payload: la capacidad vuelve cuando termina el cálculo que lo usa
+        reserva.liberar()
+    traza.terminar()
+    metricas.incrementar('solicitudes')
+
+
+async def atender_v2(reader, writer, ejecutores, inicio):
+    """
+    Protocolo v2: el cliente puede mandar varias solicitudes seguidas sobre la misma
+    conexión. Se procesan en paralelo y las respuestas salen en el orden en que
+    llegaron las solicitudes, cada una en bloques a medida que se genera.
+
+    Cada solicitud pasa por el control de admisión antes de leer su payload: si
+    el servidor está lleno se descarta el payload y se responde OCUPADO; si el
+    payload supera el máximo se responde ERROR y se cierra la conexión.
+
+    Si la primera trama es la operación 'lote', la conexión pasa a modo lote
+    (ver atender_lote).
+
+    Los clientes v2 no cierran solo su lado de escritura: un EOF quiere decir
+    que el cliente se fue, y se cancela lo que estaba en curso para él. Al
+    drenar, en cambio, se terminan las respuestas pendientes.
+    """
+    admision = obtener_admision()
+    respuestas = asyncio.Queue()
+    escritor = asyncio.create_task(enviar_respuestas(writer, respuestas))
+    tareas = set()
+    cancelar_si_falla(escritor, tareas)
+    primera = True
+    try:
+        while True:
+            # El primer byte de la trama marca el fin de la espera entre solicitudes
+            inicio = inicio or await esperar_trama(reader)
+            if not inicio:
+                if drenando():
+                    break
+                cliente_se_fue(escritor, tareas)
+                return
+            traza = metricas.traza()
+            with traza.etapa('recepcion'):
+                tipo, id_solicitud, parametros, largo_payload = await leer_encabezado(reader, inicio)
+            limite = limite_de(parametros)
+            inicio = b''
+            if tipo != SOLICITUD:
+                raise ErrorProtocolo(f"Se esperaba una solicitud y llegó una trama de tipo {tipo}")
+            if primera and parametros.get('op') == 'lote':
+                respuestas.put_nowait(None)
+                await escritor
+                await atender_lote(reader, writer, ejecutores, id_solicitud, parametros)
+                return
+            primera = False
+            print(f"Solicitud {id_solicitud}: {largo_payload} bytes, parámetros {parametros}")
+
+            cola = asyncio.Queue(BLOQUES_EN_COLA)
+            respuestas.put_nowait((id_solicitud, cola, traza))
+            try:
+                recibida = await admitir_y_recibir(reader, admision, largo_payload, cola, traza)
+            except PayloadDemasiadoGrande:
+                break
+            if recibida is None:
+                continue
+
+            reserva, payload = recibida
+            tarea = asyncio.create_task(responder(id_solicitud, parametros, payload, reserva, cola,
+                                                  ejecutores, traza, limite))
+            tareas.add(tarea)
+            tarea.add_done_callback(tareas.discard)
+    except BaseException:
+        escritor.cancel()
+        for tarea in tareas:
+            tarea.cancel()
+        raise
+
+    # Se está drenando: esperar a que salgan todas las respuestas
+    respuestas.put_nowait(None)
+    await escritor
+
+
+async def admitir_y_recibir(reader, admision, largo_payload, cola, traza):
+    """
+    Pasa la solicitud por el control de admisión y lee su payload.
+
+    Devuelve (reserva, payload), o None si se rechazó por falta de capacidad (el
+    OCUPADO ya quedó en `cola`). Si el payload supera el máximo, deja el ERROR
+    en `cola` y vuelve a levantar PayloadDemasiadoGrande: hay que cerrar la conexión.
+    """
+    try:
+        reserva = admision.admitir(largo_payload)
+    except PayloadDemasiadoGrande as e:
+        metricas.incrementar('rechazadas')
+        await cola.put((ERROR, {'error': str(e)}))
+        raise
+    except SinCapacidad as e:
+        metricas.incrementar('rechazadas')
+        with traza.etapa('recepcion'):
+            await descartar(reader, largo_payload)
+        await cola.put((OCUPADO, {'error': str(e), 'reintentar_ms': REINTENTAR_MS}))
+        return None
+
+    try:
+        with traza.etapa('recepcion'):
+            payload = await admision.recibir(reader, largo_payload)
+    except BaseException:
+        reserva.liberar()
+        raise
+    reserva.payload = payload
+    metricas.incrementar('bytes_entrada', largo_payload)
+    return reserva, payload
+
+
+class ColaEtiquetada:
+    """
+    Vista de la cola de salida de una conexión en modo lote para una sola
+    solicitud: agrega el id y la traza a lo que encola responder().
+    """
+
+    def __init__(self, salida, id_solicitud, traza):
+        self.salida = salida
+        self.id_solicitud = id_solicitud
+        self.traza = traza
+
+    async def put(self, item):
+        tipo, contenido = item
+        await self.salida.put((self.id_solicitud, tipo, contenido, self.traza))
 
-        # Convertir la imagen procesada a bytes
-        output = io.BytesIO()
-        image.save(output, format="PNG")
 
-        # Enviar al servidor de escalado
-        scaled_data = await send_to_scale_server(output.getvalue(), 0.7)  # Factor de escala 0.7 (ejemplo)
-        print("Imagen escalada enviada de vuelta al cliente.")
-        
-        writer.write(scaled_data)
-        await writer.drain()
+async def atender_lote(reader, writer, ejecutores, id_lote, parametros):
+    """
+    Modo lote del protocolo v2, para mandar muchas imágenes por una conexión.
+
+    Se procesan a la vez hasta `ventana` solicitudes (la que pide el cliente,
+    sin pasar el máximo del control de admisión); mientras la ventana está llena no se leen
+    solicitudes nuevas. Las respuestas salen a medida que terminan, no en el
+    orden de llegada: las tramas de distintas solicitudes se intercalan y el
+    cliente las separa por id.
+
+    La operación 'lote' se confirma con un FIN que lleva la ventana acordada.
+    Como en atender_v2, un EOF quiere decir que el cliente se fue.
+    """
+    admision = obtener_admision()
+    ventana = max(1, min(int(parametros.get('ventana', admision.max_ventana_lote)), admision.max_ventana_lote))
+    libres = asyncio.Semaphore(ventana)
+    salida = asyncio.Queue(BLOQUES_EN_COLA * ventana)
+    escritor = asyncio.create_task(enviar_en_desorden(writer, salida, libres))
+    tareas = set()
+    cancelar_si_falla(escritor, tareas)
+    print(f"Conexión en modo lote (ventana {ventana}).")
+    await salida.put((id_lote, FIN, {'ventana': ventana}, None))
+    try:
+        while True:
+            # La ventana se libera cuando sale la última trama de una respuesta
+            await libres.acquire()
+            inicio = await esperar_trama(reader)
+            if not inicio:
+                if drenando():
+                    break
+                cliente_se_fue(escritor, tareas)
+                return
+            traza = metricas.traza()
+            with traza.etapa('recepcion'):
+                tipo, id_solicitud, parametros, largo_payload = await leer_encabezado(reader, inicio)
+            limite = limite_de(parametros)
+            if tipo != SOLICITUD:
+                raise ErrorProtocolo(f"Se esperaba una solicitud y llegó una trama de tipo {tipo}")
+
+            cola = ColaEtiquetada(salida, id_solicitud, traza)
+            try:
+                recibida = await admitir_y_recibir(reader, admision, largo_payload, cola, traza)
+            except PayloadDemasiadoGrande:
+                break
+            if recibida is None:
+                continue
+
+            reserva, payload = recibida
+            tarea = asyncio.create_task(responder(id_solicitud, parametros, payload, reserva, cola,
+                                                  ejecutores, traza, limite))
+            tareas.add(tarea)
+            tarea.add_done_callback(tareas.discard)
+
+        # Se está drenando: esperar a que salgan todas las respuestas
+        if tareas:
+            await asyncio.wait(set(tareas))
+        await salida.put(None)
+        await escritor
+    except BaseException:
+        escritor.cancel()
+        for tarea in tareas:
+            tarea.cancel()
+        raise
+
+
+async def responder_plazo_vencido(id_solicitud, cola):
+    """
+    Responde ERROR con 'plazo_vencido' y lo cuenta en 'plazos_vencidos'.
+    """
+    print(f"Solicitud {id_solicitud}: venció el plazo.")
+    metricas.incrementar('plazos_vencidos')
+    await cola.put((ERROR, {'error': "Venció el plazo de la solicitud", 'plazo_vencido': True}))
+
+
+async def responder(id_solicitud, parametros, payload, reserva, cola, ejecutores, traza, limite=None):
+    """
+    Procesa una solicitud y deja su respuesta en `cola`. Si vence el plazo
+    (`limite`, en el reloj del event loop) se abandona el trabajo y se responde
+    ERROR con 'plazo_vencido'; lo mismo si el servidor de escalado abandonó la
+    solicitud porque le venció primero el plazo reenviado.
+    """
+    metricas.ajustar('en_vuelo', 1)
+    plazo = asyncio.timeout_at(limite)
+    try:
+        async with plazo:
+            async for bloque in procesar_imagen(payload, parametros, ejecutores, traza=traza, limite=limite,
+                                                recursos=reserva):
+                await cola.put((DATOS, bloque))
+        await cola.put((FIN, None))
+    except asyncio.CancelledError:
+        metricas.incrementar('canceladas')
+        raise
     except Exception as e:
-        print(f"Error en handle_client: {e}")
+        # Solo es un plazo vencido si venció el de la solicitud (o el que se
+        # reenvió al servidor de escalado): un TimeoutError de un socket es un error más
+        if plazo.expired() or (isinstance(e, ErrorEscalado) and e.plazo_vencido):
+            await responder_plazo_vencido(id_solicitud, cola)
+            return
+        mensaje = str(e) or type(e).__name__
+        print(f"Error en la solicitud {id_solicitud}: {mensaje}")
+        metricas.incrementar('errores')
+        await cola.put((ERROR, {'error': mensaje}))
     finally:
-        writer.close()
-        await writer.wait_closed()
+        metricas.ajustar('en_vuelo', -1)
+        # También borra el payload, salvo que lo siga usando un cálculo compartido
+        reserva.liberar()
+
+
+async def enviar_respuestas(writer, respuestas):
+    while True:
+        siguiente = await respuestas.get()
+        if siguiente is None:
+            return
+        id_solicitud, cola, traza = siguiente
+        while True:
+            tipo, contenido = await cola.get()
+            with traza.etapa('envio'):
+                if tipo == DATOS:
+                    escribir_trama(writer, DATOS, id_solicitud, None, contenido)
+                    metricas.incrementar('bytes_salida', len(contenido))
+                else:
+                    escribir_trama(writer, tipo, id_solicitud, contenido)
+                await writer.drain()
+            if tipo != DATOS:
+                break
+        traza.terminar()
+        if tipo == FIN:
+            metricas.incrementar('solicitudes')
+
+
+async def enviar_en_desorden(writer, salida, libres):
+    """
+    Escribe las tramas de una conexión en modo lote en el orden en que se
+    generan; al terminar cada respuesta libera su lugar en la ventana.
+    """
+    while True:
+        siguiente = await salida.get()
+        if siguiente is None:
+            return
+        id_solicitud, tipo, contenido, traza = siguiente
+        if traza is None:
+            escribir_trama(writer, tipo, id_solicitud, contenido)
+            await writer.drain()
+            continue
+        with traza.etapa('envio'):
+            if tipo == DATOS:
+                escribir_trama(writer, DATOS, id_solicitud, None, contenido)
+                metricas.incrementar('bytes_salida', len(contenido))
+            else:
+                escribir_trama(writer, tipo, id_solicitud, contenido)
+            await writer.drain()
+        if tipo != DATOS:
+            traza.terminar()
+            if tipo == FIN:
+                metricas.incrementar('solicitudes')
+            libres.release()
+
+
+def estadisticas_extra():
+    admision = obtener_admision()
+    extra = {'admision': {'en_curso': admision.en_curso, 'bytes_en_curso': admision.bytes_en_curso},
+             'escalado': obtener_pool().estado()}
+    cache = obtener_cache()
+    if cache is not None:
+        extra['cache'] = cache.estadisticas()
+    return extra
+
+
+async def main(host, port, stats_host=None, stats_port=None, sock=None, gracia=GRACIA):
+    global _drenaje
+    _drenaje = asyncio.Event()
+    if sock is not None:
+        server = await asyncio.start_server(handle_client, sock=sock)
+    else:
+        server = await asyncio.start_server(handle_client, host, port)
+    print(f"Servidor escuchando en {host}:{port} (pid {os.getpid()})")
+    estadisticas = None
+    if stats_port:
+        estadisticas = await iniciar_servidor_estadisticas(metricas, stats_host, stats_port, estadisticas_extra)
+        print(f"Estadísticas en http://{stats_host}:{stats_port}/metrics y /stats")
+    # Con SIGTERM dejar de aceptar, cerrar las conexiones inactivas, esperar a
+    # las que tienen respuestas pendientes y salir ordenadamente (cerrando los pools)
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, _drenaje.set)
+    try:
+        # Sin `async with server` ni serve_forever(): desde Python 3.12.1 los dos
+        # terminan en wait_closed(), que espera a todas las conexiones sin límite
+        await _drenaje.wait()
+        server.close()
+        if _conexiones:
+            print(f"Esperando {len(_conexiones)} conexiones abiertas (hasta {gracia} s)...")
+            _, pendientes = await asyncio.wait(set(_conexiones), timeout=gracia)
+            for tarea in pendientes:
+                tarea.cancel()
+            if pendientes:
+                await asyncio.wait(pendientes)
+    finally:
+        if estadisticas is not None:
+            await estadisticas.cleanup()
+
+
+def crear_socket_escucha(host, port, reuse_port=False, backlog=128):
+    """
+    Crea un socket de escucha. Con reuse_port cada trabajador abre el suyo con
+    SO_REUSEPORT y el kernel reparte las conexiones; si no, todos heredan este.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.setblocking(False)
+    return sock
+
+
+def configurar_proceso(args):
+    """
+    Crea la cache, los pools y el resto del estado de un proceso servidor.
+    """
+    # Antes de crear los pools: los procesos hijos heredan la elección por el entorno
+    if args.backend:
+        configurar_backend(args.backend)
+    if args.cache_memoria > 0 or args.cache_dir:
+        configurar_cache(max_bytes_memoria=args.cache_memoria * 1024 * 1024, directorio=args.cache_dir,
+                         max_bytes_disco=args.cache_disco * 1024 * 1024)
+    configurar_escalado(args.scale or [parsear_endpoint("localhost:9999")], despacho=args.despacho,
+                        intervalo_salud=args.intervalo_salud)
+    configurar_admision(max_payload=args.max_payload * 1024 * 1024, presupuesto_bytes=args.presupuesto * 1024 * 1024,
+                        max_concurrentes=args.max_concurrentes, umbral_disco=args.umbral_disco * 1024 * 1024,
+                        max_ventana_lote=args.ventana_lote)
+    return configurar_ejecutores(modo=args.ejecutor, procesos=args.procesos, hilos=args.hilos,
+                                 umbral_proceso=args.umbral_proceso)
+
+
+def ejecutar_servidor(args, sock=None, indice=0):
+    """
+    Corre un proceso servidor completo: su event loop, sus pools y su cache.
+    """
+    # Los trabajadores forkeados heredan los manejadores del supervisor. Bajo el
+    # supervisor ignoran SIGINT (el Ctrl-C de la terminal les llega a todos): el
+    # supervisor se lo pasa como SIGTERM, que drena. Los procesos que creen
+    # después (el pool de ejecutores) heredan el SIGINT ignorado.
+    signal.signal(signal.SIGINT, signal.SIG_IGN if args.workers > 1 else signal.default_int_handler)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    if sock is None and args.workers > 1:
+        sock = crear_socket_escucha(args.ip, args.port, reuse_port=True)
+    # Cada trabajador expone sus estadísticas en su propio puerto
+    stats_port = args.stats_port + indice if args.stats_port else None
+    ejecutores = configurar_proceso(args)
+    try:
+        asyncio.run(main(args.ip, args.port, args.stats_host, stats_port, sock, args.gracia))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ejecutores.cerrar()
+
+
+def supervisar(args):
+    """
+    Levanta `args.workers` procesos servidores sobre el mismo puerto y los
+    reinicia si mueren. Con SIGTERM se lo pasa a todos, espera a que terminen
+    las conexiones abiertas (hasta la gracia) y sale.
+    """
+    usar_reuse_port = hasattr(socket, 'SO_REUSEPORT') and not args.socket_heredado
+    sock = None if usar_reuse_port else crear_socket_escucha(args.ip, args.port)
+    contexto = multiprocessing.get_context('fork')
+    print(f"Supervisor (pid {os.getpid()}): {args.workers} trabajadores en {args.ip}:{args.port} "
+          f"({'SO_REUSEPORT' if usar_reuse_port else 'socket heredado'})")
+
+    def lanzar(indice):
+        p = contexto.Process(target=ejecutar_servidor, args=(args, sock, indice), name=f"asinc-{indice}")
+        p.start()
+        return p, time.monotonic()
+
+    trabajadores = {indice: lanzar(indice) for indice in range(args.workers)}
+    terminando = False
+
+    def al_terminar(sig, frame):
+        nonlocal terminando
+        terminando = True
+
+    signal.signal(signal.SIGTERM, al_terminar)
+    signal.signal(signal.SIGINT, al_terminar)
 
+    while not terminando:
+        vivos = {p.sentinel: indice for indice, (p, _) in trabajadores.items()}
+        for sentinela in wait(list(vivos), timeout=1.0):
+            indice = vivos[sentinela]
+            p, inicio = trabajadores[indice]
+            p.join()
+            if terminando:
+                break
+            print(f"El trabajador {indice} (pid {p.pid}) terminó con código {p.exitcode}; reiniciando.")
+            if time.monotonic() - inicio < VIDA_MINIMA:
+                time.sleep(VIDA_MINIMA)
+            trabajadores[indice] = lanzar(indice)
 
-async def main(host, port):
-    server = await asyncio.start_server(handle_client, host, port)
-    print(f"Servidor escuchando en {host}:{port}")
-    async with server:
-        await server.serve_forever()
+    print("Supervisor: drenando trabajadores...")
+    for p, _ in trabajadores.values():
+        if p.is_alive():
+            os.kill(p.pid, signal.SIGTERM)
+    limite = time.monotonic() + args.gracia + 5
+    for p, _ in trabajadores.values():
+        p.join(max(0.0, limite - time.monotonic()))
+        if p.is_alive():
+            p.kill()
+            p.join()
+    if sock is not None:
+        sock.close()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Servidor de procesamiento de imágenes.")
     parser.add_argument("-i", "--ip", type=str, required=True, help="Dirección IP de escucha")
     parser.add_argument("-p", "--port", type=int, required=True, help="Puerto de escucha")
+    parser.add_argument("-w", "--workers", type=int, default=1,
+                        help="Procesos servidores, cada uno con su event loop, sobre el mismo puerto")
+    parser.add_argument("--socket-heredado", action="store_true",
+                        help="Con --workers, compartir un socket heredado en lugar de SO_REUSEPORT")
+    parser.add_argument("--gracia", type=float, default=GRACIA,
+                        help="Segundos para terminar las conexiones abiertas al recibir SIGTERM")
+    parser.add_argument("--ejecutor", choices=["proceso", "hilo"], default="proceso",
+                        help="Dónde decodificar/codificar las imágenes grandes")
+    parser.add_argument("--backend", choices=disponibles(), default=None,
+                        help="Backend de imágenes (por defecto el de TP_BACKEND, o 'pil')")
+    parser.add_argument("--procesos", type=int, default=None, help="Tamaño del pool de procesos (por trabajador)")
+    parser.add_argument("--hilos", type=int, default=None, help="Tamaño del pool de hilos (por trabajador)")
+    parser.add_argument("--umbral-proceso", type=int, default=UMBRAL_PROCESO,
+                        help="Bytes a partir de los cuales una imagen va al pool de procesos")
+    parser.add_argument("--cache-memoria", type=int, default=256,
+                        help="MiB para la cache de resultados en memoria (0 la desactiva)")
+    parser.add_argument("--cache-dir", type=str, default=None, help="Directorio para la cache en disco")
+    parser.add_argument("--cache-disco", type=int, default=2048, help="MiB máximos de la cache en disco")
+    parser.add_argument("--max-payload", type=int, default=256, help="MiB máximos por imagen recibida")
+    parser.add_argument("--presupuesto", type=int, default=1024,
+                        help="MiB de imágenes recibidas que pueden estar en proceso a la vez")
+    parser.add_argument("--max-concurrentes", type=int, default=MAX_CONCURRENTES,
+                        help="Solicitudes en proceso a la vez; las demás reciben OCUPADO")
+    parser.add_argument("--umbral-disco", type=int, default=16,
+                        help="MiB a partir de los cuales una imagen se recibe en un archivo temporal")
+    parser.add_argument("--ventana-lote", type=int, default=VENTANA_LOTE,
+                        help="Máximo de solicitudes en proceso a la vez por conexión en modo lote")
+    parser.add_argument("--scale", type=parsear_endpoint, action="append", default=None, metavar="HOST:PUERTO",
+                        help="Servidor de escalado (se puede repetir); por defecto localhost:9999")
+    parser.add_argument("--despacho", choices=["menos_cargado", "ewma"], default="menos_cargado",
+                        help="Cómo elegir el servidor de escalado para cada solicitud")
+    parser.add_argument("--intervalo-salud", type=float, default=5.0,
+                        help="Segundos entre chequeos de salud de los servidores de escalado")
+    parser.add_argument("--stats-host", type=str, default="127.0.0.1", help="Dirección del endpoint de estadísticas")
+    parser.add_argument("--stats-port", type=int, default=None,
+                        help="Puerto HTTP para /metrics y /stats; con --workers, el trabajador i usa este + i")
     args = parser.parse_args()
 
-    asyncio.run(main(args.ip, args.port))
\ No newline at end of file
+    if args.workers > 1:
+        supervisar(args)
+    else:
+        ejecutar_servidor(args)
@@ -1,22 +1,452 @@
 # utils.py
 
 import asyncio
+import time
 
-async def send_to_scale_server(image_data, scale_factor):
-    reader, writer = await asyncio.open_connection('localhost', 9999)
-    
-    # Convertir el factor de escala a bytes
-    scale_data = f"{scale_factor}".encode()
-    
-    # Preparar un encabezado de 4 bytes para la longitud de la imagen
-    image_length = len(image_data).to_bytes(4, byteorder='big')
-    
-    # Enviar longitud de la imagen, datos de la imagen y luego el factor de escala
-    writer.write(image_length + image_data + scale_data)
-    await writer.drain()
-
-    # Recibir la imagen escalada del servidor de escalado
-    data = await reader.read(1024 * 1024)
-    writer.close()
-    await writer.wait_closed()
-    return data
\ No newline at end of file
+from tp2.protocolo import (DATOS, ERROR, FIN, MAX_ID, SOLICITUD, ErrorProtocolo, desempaquetar_raw,
+                           empaquetar_raw, escribir_trama, leer_trama)
+
+SCALE_HOST = 'localhost'
+SCALE_PORT = 9999
+
+_pool = None
+
+
+class ErrorEscalado(RuntimeError):
+    """
+    El servidor de escalado respondió la solicitud con una trama ERROR.
+
+    `plazo_vencido` indica que la abandonó porque venció el plazo que se le pasó.
+    """
+
+    def __init__(self, mensaje, plazo_vencido=False):
+        super().__init__(mensaje)
+        self.plazo_vencido = plazo_vencido
+
+
+class ConexionMultiplexada:
+    """
+    Conexión persistente al servidor de escalado con varias solicitudes en vuelo.
+
+    Cada solicitud lleva un id; una tarea lectora reparte las respuestas a quien
+    las espera, en el orden en que lleguen.
+    """
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.pendientes = {}
+        self.cerrada = False
+        self.ultimo_uso = time.monotonic()
+        self._siguiente_id = 0
+        self._lector = asyncio.create_task(self._leer_respuestas())
+
+    @classmethod
+    async def abrir(cls, host, port):
+        reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    @property
+    def en_vuelo(self):
+        return len(self.pendientes)
+
+    async def solicitar(self, parametros, *payload):
+        """
+        Envía una solicitud y devuelve un iterador asíncrono con los bloques de la
+        respuesta, a medida que el servidor de escalado los va codificando.
+
+        El payload puede pasarse en varias partes (cabecera raw y píxeles). Si se
+        abandona el iterador antes del final (la tarea se canceló, venció el plazo
+        o se fue el cliente), se le avisa al servidor de escalado para que no
+        siga trabajando en la solicitud.
+        """
+        if self.cerrada:
+            raise ConnectionError("La conexión con el servidor de escalado está cerrada")
+
+        id_solicitud = self._siguiente_id
+        self._siguiente_id = (self._siguiente_id + 1) % MAX_ID
+        cola = asyncio.Queue()
+        self.pendientes[id_solicitud] = cola
+        self.ultimo_uso = time.monotonic()
+        terminada = False
+        try:
+            try:
+                escribir_trama(self.writer, SOLICITUD, id_solicitud, parametros, *payload)
+                await self.writer.drain()
+            except OSError as e:
+                self._fallar(ConnectionError(f"Error al enviar al servidor de escalado: {e}"))
+                raise ConnectionError(str(e)) from e
+
+            while True:
+                trama = await cola.get()
+                if isinstance(trama, Exception):
+                    raise trama
+                if trama.tipo == ERROR:
+                    terminada = True
+                    raise ErrorEscalado(trama.parametros.get('error', 'error desconocido'),
+                                        bool(trama.parametros.get('plazo_vencido')))
+                if trama.payload:
+                    yield trama.payload
+                if trama.tipo == FIN:
+                    terminada = True
+                    return
+        finally:
+            self.pendientes.pop(id_solicitud, None)
+            self.ultimo_uso = time.monotonic()
+            if not terminada and not self.cerrada:
+                self._cancelar(id_solicitud)
+
+    def _cancelar(self, id_solicitud):
+        # Sin await: puede correr mientras se cancela la tarea; la trama queda en el buffer del writer
+        try:
+            escribir_trama(self.writer, SOLICITUD, id_solicitud, {'op': 'cancelar'})
+        except (OSError, RuntimeError):
+            pass
+
+    async def _leer_respuestas(self):
+        try:
+            while True:
+                trama = await leer_trama(self.reader)
+                if trama is None:
+                    raise ConnectionError("El servidor de escalado cerró la conexión")
+                cola = self.pendientes.get(trama.id)
+                if cola is not None and trama.tipo in (DATOS, FIN, ERROR):
+                    cola.put_nowait(trama)
+        except asyncio.CancelledError:
+            self._fallar(ConnectionError("Conexión cerrada"))
+        except (ConnectionError, OSError, ValueError, asyncio.IncompleteReadError) as e:
+            self._fallar(ConnectionError(str(e)))
+
+    def _fallar(self, error):
+        self.cerrada = True
+        for cola in self.pendientes.values():
+            cola.put_nowait(error)
+        self.writer.close()
+
+    async def cerrar(self):
+        self._lector.cancel()
+        try:
+            await self._lector
+        except asyncio.CancelledError:
+            pass
+        self._fallar(ConnectionError("Conexión cerrada"))
+        try:
+            await self.writer.wait_closed()
+        except OSError:
+            pass
+
+
+class PoolConexiones:
+    """
+    Pool de conexiones multiplexadas al servidor de escalado.
+
+    Reutiliza la conexión menos cargada, abre otra si todas tienen
+    `max_en_vuelo` solicitudes (hasta `max_conexiones`), cierra las que pasan
+    `tiempo_inactivo` segundos sin uso y reconecta si una conexión falla.
+    """
+
+    def __init__(self, host=SCALE_HOST, port=SCALE_PORT, max_conexiones=4, max_en_vuelo=8,
+                 tiempo_inactivo=30.0, reintentos=1):
+        self.host = host
+        self.port = port
+        self.max_conexiones = max_conexiones
+        self.max_en_vuelo = max_en_vuelo
+        self.tiempo_inactivo = tiempo_inactivo
+        self.reintentos = reintentos
+        self.conexiones = []
+        self._abriendo = 0
+        self._cambios = asyncio.Condition()
+        self._desalojo = None
+
+    async def _obtener(self):
+        async with self._cambios:
+            while True:
+                self.conexiones = [c for c in self.conexiones if not c.cerrada]
+                libres = [c for c in self.conexiones if c.en_vuelo < self.max_en_vuelo]
+                if libres:
+                    return min(libres, key=lambda c: c.en_vuelo)
+                if len(self.conexiones) + self._abriendo < self.max_conexiones:
+                    break
+                await self._cambios.wait()
+
+            self._abriendo += 1
+        try:
+            conexion = await ConexionMultiplexada.abrir(self.host, self.port)
+        finally:
+            async with self._cambios:
+                self._abriendo -= 1
+                self._cambios.notify_all()
+
+        async with self._cambios:
+            self.conexiones.append(conexion)
+            if self._desalojo is None:
+                self._desalojo = asyncio.create_task(self._desalojar_inactivas())
+        return conexion
+
+    async def solicitar(self, parametros, *payload):
+        """
+        Envía una solicitud por alguna conexión del pool y devuelve un iterador
+        asíncrono con los bloques de la respuesta.
+
+        Si la conexión no se puede abrir o falla antes de recibir el primer
+        bloque, reintenta por otra. Abrir una conexión a un host remoto puede
+        fallar con cualquier OSError (host inalcanzable, DNS, timeout), no solo
+        con ConnectionError.
+        """
+        for intento in range(self.reintentos + 1):
+            recibido = False
+            try:
+                conexion = await self._obtener()
+                async for bloque in conexion.solicitar(parametros, *payload):
+                    recibido = True
+                    yield bloque
+                return
+            except OSError:
+                if recibido or intento == self.reintentos:
+                    raise
+            finally:
+                async with self._cambios:
+                    self._cambios.notify_all()
+
+    async def _desalojar_inactivas(self):
+        while True:
+            await asyncio.sleep(self.tiempo_inactivo / 2)
+            ahora = time.monotonic()
+            inactivas = [c for c in self.conexiones
+                         if c.en_vuelo == 0 and ahora - c.ultimo_uso > self.tiempo_inactivo]
+            for conexion in inactivas:
+                self.conexiones.remove(conexion)
+                await conexion.cerrar()
+
+    async def cerrar(self):
+        if self._desalojo is not None:
+            self._desalojo.cancel()
+            self._desalojo = None
+        conexiones, self.conexiones = self.conexiones, []
+        for conexion in conexiones:
+            await conexion.cerrar()
+
+
+class Fragmento:
+    """
+    Un servidor de escalado del grupo, con su pool de conexiones y su estado:
+    solicitudes pendientes, latencia promedio (EWMA) y salud.
+
+    Los chequeos de salud van por una conexión propia, fuera del pool: con el
+    pool lleno, un servidor ocupado pero sano igual responde el ping.
+    """
+
+    def __init__(self, host, port, **opciones_pool):
+        self.host = host
+        self.port = port
+        self.pool = PoolConexiones(host, port, **opciones_pool)
+        self.pendientes = 0
+        self.latencia_ewma = None
+        self.fallos_consecutivos = 0
+        self.sano = True
+        self._conexion_salud = None
+
+    @property
+    def nombre(self):
+        return f"{self.host}:{self.port}"
+
+    def registrar_latencia(self, segundos, alfa):
+        if self.latencia_ewma is None:
+            self.latencia_ewma = segundos
+        else:
+            self.latencia_ewma = alfa * segundos + (1 - alfa) * self.latencia_ewma
+
+    async def ping(self):
+        if self._conexion_salud is None or self._conexion_salud.cerrada:
+            self._conexion_salud = await ConexionMultiplexada.abrir(self.host, self.port)
+        async for _ in self._conexion_salud.solicitar({'op': 'ping'}):
+            pass
+
+    async def cerrar_salud(self):
+        conexion, self._conexion_salud = self._conexion_salud, None
+        if conexion is not None:
+            await conexion.cerrar()
+
+    def estado(self):
+        return {'pendientes': self.pendientes, 'latencia_ewma_s': self.latencia_ewma,
+                'sano': self.sano, 'fallos_consecutivos': self.fallos_consecutivos}
+
+
+class GrupoEscalado:
+    """
+    Reparte las solicitudes entre varios servidores de escalado.
+
+    - despacho='menos_cargado': al que tenga menos solicitudes pendientes.
+    - despacho='ewma': al de menor latencia promedio ponderada por su carga.
+
+    Un chequeo periódico (op 'ping') marca como no sano al servidor que falla
+    `max_fallos` veces seguidas y lo vuelve a sumar cuando responde. Si una
+    conexión falla antes de recibir respuesta, la solicitud se reintenta en otro
+    servidor.
+
+    Tiene la misma interfaz que PoolConexiones (solicitar y cerrar).
+    """
+
+    def __init__(self, endpoints, despacho='menos_cargado', intervalo_salud=5.0, tiempo_salud=2.0,
+                 max_fallos=2, alfa=0.3, **opciones_pool):
+        if despacho not in ('menos_cargado', 'ewma'):
+            raise ValueError(f"Despacho desconocido: {despacho}")
+        self.fragmentos = [Fragmento(host, port, **opciones_pool) for host, port in endpoints]
+        if not self.fragmentos:
+            raise ValueError("Hace falta al menos un servidor de escalado")
+        self.despacho = despacho
+        self.intervalo_salud = intervalo_salud
+        self.tiempo_salud = tiempo_salud
+        self.max_fallos = max_fallos
+        self.alfa = alfa
+        self._salud = None
+
+    def _costo(self, fragmento):
+        if self.despacho == 'ewma':
+            # Sin medición todavía, probarlo primero
+            return ((fragmento.latencia_ewma or 0.0) * (fragmento.pendientes + 1), fragmento.pendientes)
+        return (fragmento.pendientes, fragmento.latencia_ewma or 0.0)
+
+    def _elegir(self, probados):
+        candidatos = [f for f in self.fragmentos if f.sano and f not in probados]
+        if not candidatos:
+            # Ninguno sano sin probar: intentar igual con los que no se probaron
+            candidatos = [f for f in self.fragmentos if f not in probados]
+        if not candidatos:
+            return None
+        return min(candidatos, key=self._costo)
+
+    def _fallo(self, fragmento):
+        fragmento.fallos_consecutivos += 1
+        if fragmento.sano and fragmento.fallos_consecutivos >= self.max_fallos:
+            fragmento.sano = False
+            print(f"Servidor de escalado {fragmento.nombre} fuera de servicio.")
+
+    def _exito(self, fragmento):
+        fragmento.fallos_consecutivos = 0
+        if not fragmento.sano:
+            fragmento.sano = True
+            print(f"Servidor de escalado {fragmento.nombre} de vuelta en servicio.")
+
+    async def solicitar(self, parametros, *payload):
+        """
+        Envía la solicitud al mejor servidor del grupo y devuelve un iterador
+        asíncrono con los bloques de la respuesta.
+        """
+        if self._salud is None and self.intervalo_salud:
+            self._salud = asyncio.create_task(self._chequear_salud())
+
+        probados = []
+        while True:
+            fragmento = self._elegir(probados)
+            if fragmento is None:
+                raise ConnectionError("No hay servidores de escalado disponibles")
+            probados.append(fragmento)
+            fragmento.pendientes += 1
+            inicio = time.monotonic()
+            recibido = False
+            try:
+                async for bloque in fragmento.pool.solicitar(parametros, *payload):
+                    recibido = True
+                    yield bloque
+                fragmento.registrar_latencia(time.monotonic() - inicio, self.alfa)
+                self._exito(fragmento)
+                return
+            except OSError as e:
+                # ConnectionError, host o red inalcanzable, socket.gaierror y TimeoutError
+                self._fallo(fragmento)
+                if recibido:
+                    raise
+                print(f"Falló {fragmento.nombre} ({e}); reintentando en otro servidor.")
+            finally:
+                fragmento.pendientes -= 1
+
+    async def _chequear_salud(self):
+        while True:
+            await asyncio.sleep(self.intervalo_salud)
+            for fragmento in self.fragmentos:
+                try:
+                    await asyncio.wait_for(fragmento.ping(), self.tiempo_salud)
+                except Exception as e:
+                    # Cualquier error (también ErrorEscalado) cuenta como fallo; si se
+                    # escapara, el chequeo moriría sin avisar y no se volvería a lanzar.
+                    # La conexión del chequeo se descarta: el próximo ping abre otra
+                    if fragmento.sano:
+                        print(f"Chequeo de salud de {fragmento.nombre} falló: {e!r}")
+                    await fragmento.cerrar_salud()
+                    self._fallo(fragmento)
+                else:
+                    self._exito(fragmento)
+
+    def estado(self):
+        return {f.nombre: f.estado() for f in self.fragmentos}
+
+    async def cerrar(self):
+        if self._salud is not None:
+            self._salud.cancel()
+            self._salud = None
+        for fragmento in self.fragmentos:
+            await fragmento.cerrar_salud()
+            await fragmento.pool.cerrar()
+
+
+def parsear_endpoint(texto):
+    """
+    'host:puerto' -> (host, puerto).
+    """
+    host, _, port = texto.rpartition(':')
+    return host or SCALE_HOST, int(port)
+
+
+def configurar_escalado(endpoints, **opciones):
+    """
+    Reemplaza el grupo de servidores de escalado del proceso.
+    """
+    global _pool
+    _pool = GrupoEscalado(endpoints, **opciones)
+    return _pool
+
+
+def obtener_pool():
+    """
+    Devuelve el grupo de servidores de escalado del proceso, creándolo la primera
+    vez con el servidor por defecto.
+    """
+    global _pool
+    if _pool is None:
+        _pool = GrupoEscalado([(SCALE_HOST, SCALE_PORT)])
+    return _pool
+
+
+async def stream_from_scale_server(image_data, scale_factor, pool=None):
+    """
+    Envía la imagen al servidor de escalado y devuelve los bloques de la imagen
+    escalada a medida que llegan.
+    """
+    pool = pool or obtener_pool()
+    async for bloque in pool.solicitar({'escala': scale_factor}, image_data):
+        yield bloque
+
+
+async def send_to_scale_server(image_data, scale_factor, pool=None):
+    return b''.join([bloque async for bloque in stream_from_scale_server(image_data, scale_factor, pool)])
+
+
+async def scale_raw(modo, ancho, alto, stride, pixeles, scale_factor, pool=None, plazo_ms=None):
+    """
+    Manda píxeles sin comprimir al servidor de escalado y devuelve la imagen
+    escalada como (modo, ancho, alto, stride, píxeles), también sin comprimir.
+
+    Con `plazo_ms`, el servidor de escalado abandona la solicitud si no llega
+    a tiempo. Una respuesta vacía o truncada levanta ErrorEscalado.
+    """
+    pool = pool or obtener_pool()
+    parametros = {'escala': scale_factor, 'formato': 'raw'}
+    if plazo_ms is not None:
+        parametros['plazo_ms'] = plazo_ms
+    bloques = [bloque async for bloque in
+               pool.solicitar(parametros, empaquetar_raw(modo, ancho, alto, stride), pixeles)]
+    try:
+        return desempaquetar_raw(bloques[0] if len(bloques) == 1 else b''.join(bloques))
+    except ErrorProtocolo as e:
+        raise ErrorEscalado(f"Respuesta inválida del servidor de escalado: {e}") from e
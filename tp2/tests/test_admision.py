@@ -0,0 +1,39 @@
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from tp2.server_asinc.admision import ControlAdmision, SinCapacidad
+
+
+def test_reserva_retenida_sigue_contando(tmp_path):
+    control = ControlAdmision(presupuesto_bytes=100)
+    reserva = control.admitir(80)
+    reserva.payload = str(tmp_path / 'payload.img')
+    with open(reserva.payload, 'wb') as f:
+        f.write(b'x' * 80)
+
+    # Un cálculo compartido sigue usando el payload después de que termina la solicitud
+    reserva.retener()
+    reserva.liberar()
+    assert control.bytes_en_curso == 80 and control.en_curso == 1
+    assert os.path.exists(reserva.payload)
+    with pytest.raises(SinCapacidad):
+        control.admitir(40)
+
+    reserva.liberar()
+    assert control.bytes_en_curso == 0 and control.en_curso == 0
+    assert not os.path.exists(reserva.payload)
+    control.admitir(40)
+
+
+def test_liberar_de_mas_no_devuelve_dos_veces():
+    control = ControlAdmision()
+    reserva = control.admitir(10)
+    reserva.liberar()
+    reserva.liberar()
+    assert control.bytes_en_curso == 0 and control.en_curso == 0
+    with pytest.raises(RuntimeError):
+        reserva.retener()
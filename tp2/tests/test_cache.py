@@ -0,0 +1,115 @@
+import asyncio
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from tp2.server_asinc.admision import ControlAdmision
+from tp2.server_asinc.cache import CacheResultados
+
+BLOQUES = 8
+
+
+def solicitud_con_payload(control, directorio, contenido):
+    # Como admitir_y_recibir con un payload recibido en disco
+    reserva = control.admitir(len(contenido))
+    ruta = os.path.join(directorio, 'payload.img')
+    with open(ruta, 'wb') as f:
+        f.write(contenido)
+    reserva.payload = ruta
+    return reserva, ruta
+
+
+def productor(ruta, calculos, pausa=0.01):
+    # Lee el payload de a poco, como un cálculo que todavía lo está usando
+    async def producir():
+        calculos.append(ruta)
+        with open(ruta, 'rb') as f:
+            for _ in range(BLOQUES):
+                await asyncio.sleep(pausa)
+                yield f.read(4)
+    return producir
+
+
+async def leer(cache, clave, producir, reserva=None, plazo=None):
+    datos = b''
+    try:
+        async with asyncio.timeout(plazo):
+            async for bloque in cache.servir(clave, producir, reserva):
+                datos += bloque
+    finally:
+        # Lo que hace responder() al terminar, haya salido bien o no
+        if reserva is not None:
+            reserva.liberar()
+    return datos
+
+
+def test_primera_solicitud_cancelada_no_corta_a_las_demas(tmp_path):
+    contenido = bytes(range(4 * BLOQUES))
+
+    async def escenario():
+        cache = CacheResultados()
+        control = ControlAdmision()
+        calculos = []
+        reserva, ruta = solicitud_con_payload(control, str(tmp_path), contenido)
+        primera = asyncio.create_task(leer(cache, 'k', productor(ruta, calculos), reserva))
+        await asyncio.sleep(0.02)
+        segunda = asyncio.create_task(leer(cache, 'k', productor(ruta, calculos)))
+        await asyncio.sleep(0.01)
+        primera.cancel()
+        await asyncio.sleep(0)
+
+        # La primera ya terminó, pero el cálculo compartido sigue usando su payload
+        assert os.path.exists(ruta)
+        assert control.bytes_en_curso == len(contenido)
+
+        assert await segunda == contenido
+        await asyncio.sleep(0)
+        assert len(calculos) == 1
+        assert not os.path.exists(ruta)
+        assert control.bytes_en_curso == 0 and control.en_curso == 0
+        assert cache.contadores['colapsadas'] == 1
+
+    asyncio.run(escenario())
+
+
+def test_plazo_de_la_primera_no_se_aplica_a_las_demas(tmp_path):
+    contenido = bytes(range(4 * BLOQUES))
+
+    async def escenario():
+        cache = CacheResultados()
+        control = ControlAdmision()
+        calculos = []
+        reserva, ruta = solicitud_con_payload(control, str(tmp_path), contenido)
+        producir = productor(ruta, calculos)
+        primera = asyncio.create_task(leer(cache, 'k', producir, reserva, plazo=0.03))
+        await asyncio.sleep(0.005)
+        segunda = asyncio.create_task(leer(cache, 'k', producir))
+        try:
+            await primera
+        except TimeoutError:
+            pass
+        else:
+            raise AssertionError("A la primera solicitud le tenía que vencer el plazo")
+        assert await segunda == contenido
+        assert len(calculos) == 1
+
+    asyncio.run(escenario())
+
+
+def test_si_se_van_todas_se_cancela_y_se_libera(tmp_path):
+    contenido = bytes(range(4 * BLOQUES))
+
+    async def escenario():
+        cache = CacheResultados()
+        control = ControlAdmision()
+        reserva, ruta = solicitud_con_payload(control, str(tmp_path), contenido)
+        tarea = asyncio.create_task(leer(cache, 'k', productor(ruta, []), reserva))
+        await asyncio.sleep(0.02)
+        tarea.cancel()
+        await asyncio.sleep(0.01)
+        assert not cache._en_curso
+        assert not os.path.exists(ruta)
+        assert control.bytes_en_curso == 0
+
+    asyncio.run(escenario())